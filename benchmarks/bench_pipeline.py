@@ -0,0 +1,240 @@
+"""
+End-to-end benchmark of the delivery pipelines against a fake Telegram Bot API.
+
+Scenarios:
+    pdf-text     process_pdf_in_batches on generated text PDFs
+    pdf-scanned  process_pdf_in_batches on PDFs made of JPEG scans
+    images       finish_pdf_creation on a session of photos (downloads included)
+    text         create_text_pdf on chat messages, then sending the document
+
+For each scenario and size it reports pages/sec, p50/p99 time to first page
+(first photo or document delivered), API calls per job, 429s and peak RSS of
+the bot and its render workers. Rendering needs poppler; the text scenario
+needs the font at pdfusion.text_pdf.TEXT_FONT_PATH (or --font).
+
+Telegram's real limits come from the outbound dispatcher, so pages/sec
+includes them. To measure rendering alone, lift them through the environment:
+    PDFUSION_CHAT_RATE=1000 PDFUSION_CHAT_BURST=1000 PDFUSION_GLOBAL_RATE=1000 python benchmarks/bench_pipeline.py
+
+Usage:
+    python benchmarks/bench_pipeline.py --pages 1,10,100,1000 --jobs 3
+    python benchmarks/bench_pipeline.py --scenario pdf-text --latency 0.1 --rate-limit-prob 0.05
+    python benchmarks/bench_pipeline.py --json before.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtures
+from fake_telegram import FakeTeleBot
+from pdfusion import image_pdf, log, telegram, text_pdf
+from pdfusion.delivery import process_pdf_in_batches
+from pdfusion.encoding import DEFAULT_PRESET, ENCODING_PRESETS
+from pdfusion.memory import process_tree_rss
+from pdfusion.outbound import api_call, outbound
+
+SCENARIOS = ('pdf-text', 'pdf-scanned', 'images', 'text')
+DELIVERY_METHODS = ('send_photo', 'send_media_group', 'send_document')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+
+class RssSampler:
+    """Samples the RSS of the bot and its render workers in the background"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, process_tree_rss())
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def wait_outbound_idle():
+    """Wait until every queued send and status edit has gone out"""
+    while True:
+        with outbound.cond:
+            if not outbound.busy and not any(outbound.queues.values()):
+                return
+        time.sleep(0.01)
+
+
+class Runner:
+    def __init__(self, fake, workdir, preset):
+        self.fake = fake
+        self.workdir = workdir
+        self.preset = preset
+        self.chat_ids = iter(range(1000, 10 ** 9))
+
+    def job_stats(self, chat_id, start, pages):
+        calls = [call for call in self.fake.calls_for(chat_id) if call.start >= start]
+        delivered = [call.end for call in calls if call.method in DELIVERY_METHODS and call.status == 200]
+        return {
+            'pages': pages,
+            'first_page': (min(delivered) - start) if delivered else None,
+            'api_calls': sum(1 for call in calls if call.status == 200),
+            'rate_limited': sum(1 for call in calls if call.status == 429),
+            'uploaded': sum(call.bytes for call in calls if call.status == 200),
+        }
+
+    def pdf_job(self, pdf_path, pages):
+        chat_id = next(self.chat_ids)
+        start = time.perf_counter()
+        status = api_call(chat_id, 'send_message', chat_id, "Processing PDF...")
+        if process_pdf_in_batches(pdf_path, chat_id, status.message_id, preset_name=self.preset) is None:
+            raise RuntimeError(f"Processing {pdf_path} failed (run with --verbose for the bot's log)")
+        return self.job_stats(chat_id, start, pages)
+
+    def images_job(self, file_ids):
+        chat_id = next(self.chat_ids)
+        message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), from_user=SimpleNamespace(id=chat_id))
+        start = time.perf_counter()
+        session = image_pdf.new_image_session()
+        session['images'] = [
+            {'file_id': file_id, 'page_number': None, 'download': image_pdf.start_image_download(session, file_id)}
+            for file_id in file_ids
+        ]
+        image_pdf.pdf_creation_sessions[chat_id] = session
+        image_pdf.finish_pdf_creation(message)
+        self.fake.wait_for(lambda calls: any(call.chat_id == chat_id and call.method == 'send_document'
+                                             and call.status == 200 for call in calls))
+        return self.job_stats(chat_id, start, len(file_ids))
+
+    def text_job(self, messages):
+        chat_id = next(self.chat_ids)
+        start = time.perf_counter()
+        pdf_path = text_pdf.create_text_pdf(messages, chat_id)
+        try:
+            with open(pdf_path, 'rb') as pdf_file:
+                pages = len(re.findall(rb'/Type\s*/Page\b', pdf_file.read()))
+                pdf_file.seek(0)
+                api_call(chat_id, 'send_document', chat_id, pdf_file, caption="Here is your text PDF file.")
+        finally:
+            os.remove(pdf_path)
+        return self.job_stats(chat_id, start, pages)
+
+    def prepare(self, scenario, size):
+        """Return a zero-argument job function for one scenario and size"""
+        if scenario == 'pdf-text':
+            path = fixtures.text_pdf(os.path.join(self.workdir, f'text_{size}.pdf'), size)
+            return lambda: self.pdf_job(path, size)
+        if scenario == 'pdf-scanned':
+            path = fixtures.scanned_pdf(os.path.join(self.workdir, f'scanned_{size}.pdf'), size)
+            return lambda: self.pdf_job(path, size)
+        if scenario == 'images':
+            file_ids = fixtures.photo_set(self.workdir, size)
+            return lambda: self.images_job(file_ids)
+        messages = fixtures.text_messages(size)
+        return lambda: self.text_job(messages)
+
+    def run(self, scenario, size, jobs, concurrency):
+        job = self.prepare(scenario, size)
+        with RssSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(lambda _: job(), range(jobs)))
+            elapsed = time.perf_counter() - start
+            wait_outbound_idle()
+        first_pages = [r['first_page'] for r in results if r['first_page'] is not None]
+        return {
+            'scenario': scenario,
+            'size': size,
+            'jobs': jobs,
+            'pages_per_sec': sum(r['pages'] for r in results) / elapsed,
+            'ttfp_p50': percentile(first_pages, 50) if first_pages else None,
+            'ttfp_p99': percentile(first_pages, 99) if first_pages else None,
+            'api_calls_per_job': sum(r['api_calls'] for r in results) / jobs,
+            'rate_limited': sum(r['rate_limited'] for r in results),
+            'uploaded_mb_per_job': sum(r['uploaded'] for r in results) / jobs / (1024 * 1024),
+            'peak_rss_mb': rss.peak / (1024 * 1024),
+        }
+
+
+def format_row(result):
+    ttfp = (f"{result['ttfp_p50']:7.2f}s {result['ttfp_p99']:7.2f}s"
+            if result['ttfp_p50'] is not None else f"{'-':>8} {'-':>8}")
+    return (f"{result['scenario']:<12} {result['size']:>5} {result['pages_per_sec']:9.2f} {ttfp} "
+            f"{result['api_calls_per_job']:9.1f} {result['rate_limited']:5d} "
+            f"{result['uploaded_mb_per_job']:8.2f} {result['peak_rss_mb']:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument('--pages', default='1,10,100,1000',
+                        help="comma-separated sizes: pages for PDFs and text, photos for images")
+    parser.add_argument('--jobs', type=int, default=3, help="jobs per scenario and size")
+    parser.add_argument('--concurrency', type=int, default=1, help="jobs running at the same time")
+    parser.add_argument('--preset', default=DEFAULT_PRESET, choices=sorted(ENCODING_PRESETS))
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated Bot API latency in seconds")
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0, help="chance of a 429 per API call")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--font', default=text_pdf.TEXT_FONT_PATH, help="TTF font for the text scenario")
+    parser.add_argument('--fixtures', help="directory to keep generated fixtures in (default: temporary)")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's log output")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    sizes = [int(size) for size in args.pages.split(',')]
+    if not args.verbose:
+        log.LOG_LEVEL = max(log.LOG_LEVELS.values()) + 1
+    if 'text' in scenarios and not os.path.exists(args.font):
+        print(f"Skipping the text scenario: font {args.font} not found (use --font)")
+        scenarios.remove('text')
+    text_pdf.TEXT_FONT_PATH = args.font
+
+    fake = FakeTeleBot(latency=args.latency, rate_limit_prob=args.rate_limit_prob, retry_after=args.retry_after)
+    telegram.bot = fake
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.fixtures or tmp
+        os.makedirs(workdir, exist_ok=True)
+        fake.serve_files(workdir, latency=args.latency)
+        runner = Runner(fake, workdir, args.preset)
+        print(f"Latency {args.latency * 1000:.0f}ms, 429 probability {args.rate_limit_prob}, "
+              f"{args.jobs} jobs per row, concurrency {args.concurrency}, preset {args.preset}")
+        print(f"{'scenario':<12} {'size':>5} {'pages/s':>9} {'ttfp p50':>8} {'ttfp p99':>8} "
+              f"{'calls/job':>9} {'429s':>5} {'MB/job':>8} {'peak RSS':>8}")
+        try:
+            for scenario in scenarios:
+                for size in sizes:
+                    result = runner.run(scenario, size, args.jobs, args.concurrency)
+                    results.append(result)
+                    print(format_row(result), flush=True)
+        finally:
+            fake.close()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
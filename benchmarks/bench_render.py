@@ -0,0 +1,85 @@
+# pip install PyPDF2
+"""
+Compare the old batch rendering (PyPDF2 writes a temporary PDF for every batch,
+then pdf2image renders it) with the render worker, which renders page ranges
+straight from the source with one pdftoppm run per batch. Both encode every
+page for upload, as the bot does.
+
+Usage:
+    python benchmarks/bench_render.py --pages 500 --batch-size 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf2image import convert_from_path
+
+from pdfusion.encoding import DEFAULT_PRESET, encode_page
+from pdfusion.rendering import RENDER_DPI, get_page_count, render_range_encoded
+from fixtures import text_pdf
+
+
+def legacy_render(pdf_path, batch_size, dpi):
+    """The previous implementation: re-write every batch to disk before rendering"""
+    from PyPDF2 import PdfReader, PdfWriter
+
+    pdf = PdfReader(pdf_path)
+    total_pages = len(pdf.pages)
+    rendered = 0
+    for batch_start in range(0, total_pages, batch_size):
+        batch_end = min(batch_start + batch_size, total_pages)
+        pdf_writer = PdfWriter()
+        for page_num in range(batch_start, batch_end):
+            pdf_writer.add_page(pdf.pages[page_num])
+        batch_pdf_path = f"{pdf_path}_batch_{batch_start}.pdf"
+        with open(batch_pdf_path, 'wb') as output_file:
+            pdf_writer.write(output_file)
+        for image in convert_from_path(batch_pdf_path, dpi=dpi):
+            encode_page(image, DEFAULT_PRESET)
+            rendered += 1
+        os.remove(batch_pdf_path)
+    return rendered
+
+
+def range_render(pdf_path, batch_size, dpi):
+    """The current implementation: the render worker, on page ranges of the original file"""
+    total_pages = get_page_count(pdf_path)
+    rendered = 0
+    for batch_start in range(0, total_pages, batch_size):
+        batch_end = min(batch_start + batch_size, total_pages)
+        pages, _ = render_range_encoded(pdf_path, batch_start + 1, batch_end, dpi, DEFAULT_PRESET)
+        rendered += len(pages)
+    return rendered
+
+
+def run(name, func, pdf_path, batch_size, dpi):
+    start = time.perf_counter()
+    pages = func(pdf_path, batch_size, dpi)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<8} {pages:>6} pages  {elapsed:8.2f}s  {pages / elapsed:8.2f} pages/sec")
+    return pages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--dpi', type=int, default=RENDER_DPI)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_path = os.path.join(workdir, 'fixture.pdf')
+        text_pdf(pdf_path, args.pages)
+        print(f"Fixture: {args.pages} pages, batch size {args.batch_size}, {args.dpi} DPI")
+        legacy = run('legacy', legacy_render, pdf_path, args.batch_size, args.dpi)
+        ranged = run('ranged', range_render, pdf_path, args.batch_size, args.dpi)
+        print(f"Speedup: {ranged / legacy:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Cold-start benchmark: time until the bot is ready to take updates, and what
+the first request of each kind pays on top of that.
+
+Every run starts a fresh interpreter, so nothing is cached in sys.modules.
+Modes:
+    lazy     import pdfusion.app and create the bot (PDFUSION_WARMUP=off)
+    warm     the same, then warm_up() before the first request (PDFUSION_WARMUP=startup)
+    eager    the same as lazy, but every heavy dependency is imported up front,
+             as the single-script bot did
+
+Columns are medians over --runs runs, in milliseconds:
+    import        import pdfusion.app: every module loaded and the handlers recorded
+                  (plus the heavy dependencies in eager mode)
+    bot           create the TeleBot and register the handlers
+    ready         import + bot: what `python -m pdfusion` waits for before polling
+    warm-up       pdfusion.app.warm_up(): libraries, text font, render workers
+    first encode  encode one small page (loads Pillow's modules if nothing did yet)
+    first text    lay out one text message (loads fpdf, the RTL libraries and the
+                  font; needs the font at --font)
+
+Usage:
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --font /path/to/Vazir.ttf --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('lazy', 'warm', 'eager')
+COLUMNS = ('import', 'bot', 'ready', 'warm-up', 'first encode', 'first text')
+
+# Runs in the child interpreter with argv [mode, font]; prints the timings as JSON.
+CHILD = r'''
+import json, os, sys, time
+mode, font = sys.argv[1], sys.argv[2]
+timings = {}
+start = time.perf_counter()
+if mode == 'eager':
+    import pdf2image, PyPDF2, fpdf, arabic_reshaper
+    import PIL.Image, PIL.ImageChops, PIL.ImageDraw, bidi.algorithm
+import pdfusion.app
+from pdfusion import encoding, rendering, telegram, text_pdf
+timings['import'] = time.perf_counter() - start
+step = time.perf_counter()
+telegram.create_bot('0:benchmark')
+timings['bot'] = time.perf_counter() - step
+timings['ready'] = time.perf_counter() - start
+text_pdf.TEXT_FONT_PATH = font
+if mode == 'warm':
+    step = time.perf_counter()
+    pdfusion.app.warm_up()
+    timings['warm-up'] = time.perf_counter() - step
+page = rendering.Image.new('RGB', (124, 175), 'white')
+step = time.perf_counter()
+encoding.encode_page(page, encoding.DEFAULT_PRESET)
+timings['first encode'] = time.perf_counter() - step
+if os.path.exists(font):
+    step = time.perf_counter()
+    text_pdf.TextPdfBuilder().add_text("Hello سلام")
+    timings['first text'] = time.perf_counter() - step
+print(json.dumps(timings))
+'''
+
+
+def run_child(mode, font):
+    env = dict(os.environ, PDFUSION_LOG_LEVEL='ERROR')
+    result = subprocess.run([sys.executable, '-c', CHILD, mode, font], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def format_cell(values):
+    return f"{statistics.median(values) * 1000:14.1f}" if values else f"{'-':>14}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', action='append', choices=MODES, help="mode to run (repeatable, default: all)")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters per mode")
+    parser.add_argument('--font', default=os.path.join(ROOT, 'Vazir.ttf'), help="TTF font for the first text column")
+    parser.add_argument('--json', help="also write the raw timings to this file")
+    args = parser.parse_args()
+
+    modes = args.mode or list(MODES)
+    results = {}
+    print(f"Medians of {args.runs} runs, in ms")
+    print(f"{'mode':<6}" + ''.join(f"{column:>14}" for column in COLUMNS))
+    for mode in modes:
+        runs = [run_child(mode, args.font) for _ in range(args.runs)]
+        results[mode] = runs
+        print(f"{mode:<6}" + ''.join(format_cell([run[column] for run in runs if column in run])
+                                     for column in COLUMNS), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
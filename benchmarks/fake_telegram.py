@@ -0,0 +1,148 @@
+"""
+In-process stand-in for the Telegram Bot API, used by the benchmarks.
+
+FakeTeleBot takes the place of pdfusion.telegram.bot. Every Bot API method the bot uses is recorded
+with its timing and upload size, sleeps for a simulated network latency and can
+fail with a 429 like the real API. Files returned by get_file are served over
+HTTP from a local directory, so downloads run through the same code as in
+production.
+"""
+
+import itertools
+import os
+import random
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+
+
+class QuietFileHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().send_head()
+
+
+def payload_size(obj):
+    """Bytes a request would upload for a file argument (0 for file_ids)"""
+    if obj is None or isinstance(obj, str):
+        return 0
+    if hasattr(obj, 'media'):
+        return payload_size(obj.media)
+    if hasattr(obj, 'getbuffer'):
+        return obj.getbuffer().nbytes
+    if hasattr(obj, 'fileno'):
+        return os.fstat(obj.fileno()).st_size
+    return 0
+
+
+class FakeTeleBot:
+    """
+    Records calls as SimpleNamespace(method, chat_id, start, end, bytes, status).
+    latency and jitter are in seconds; rate_limit_prob is the chance of a 429
+    with the given retry_after.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.01, rate_limit_prob=0.0, retry_after=1, seed=0):
+        self.token = '0:fake'
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.cond = threading.Condition()
+        self.calls = []
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.file_server = None
+
+    def _request(self, method, chat_id, uploaded=0):
+        start = time.perf_counter()
+        with self.cond:
+            delay = max(0.0, self.random.gauss(self.latency, self.jitter))
+            limited = self.random.random() < self.rate_limit_prob
+        time.sleep(delay)
+        with self.cond:
+            self.calls.append(SimpleNamespace(method=method, chat_id=chat_id, start=start, end=time.perf_counter(),
+                                              bytes=uploaded, status=429 if limited else 200))
+            self.cond.notify_all()
+        if limited:
+            raise ApiTelegramException(method, None, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            })
+
+    def _message(self, chat_id, **fields):
+        return SimpleNamespace(message_id=next(self.message_ids), chat=SimpleNamespace(id=chat_id), **fields)
+
+    def _photo(self):
+        return [SimpleNamespace(file_id=f'photo-{next(self.file_ids)}')]
+
+    # Bot API methods used by the bot
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._request('send_message', chat_id)
+        return self._message(chat_id, text=text)
+
+    def reply_to(self, message, text, **kwargs):
+        return self.send_message(message.chat.id, text, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self._request('edit_message_text', chat_id)
+        return True
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        self._request('send_photo', chat_id, payload_size(photo))
+        return self._message(chat_id, photo=self._photo(), caption=caption)
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        self._request('send_media_group', chat_id, sum(payload_size(item) for item in media))
+        return [self._message(chat_id, photo=self._photo()) for _ in media]
+
+    def send_document(self, chat_id, document, caption=None, **kwargs):
+        self._request('send_document', chat_id, payload_size(document))
+        return self._message(chat_id, document=SimpleNamespace(file_id=f'document-{next(self.file_ids)}'),
+                             caption=caption)
+
+    def get_file(self, file_id):
+        self._request('get_file', None)
+        return SimpleNamespace(file_id=file_id, file_path=file_id)
+
+    def register_next_step_handler(self, *args, **kwargs):
+        pass
+
+    # Helpers for the benchmarks
+
+    def serve_files(self, directory, latency=0.0):
+        """Serve directory as Telegram's file storage; file_ids are file names in it"""
+        handler = type('FileHandler', (QuietFileHandler,), {'latency': latency})
+        self.file_server = ThreadingHTTPServer(('127.0.0.1', 0), partial(handler, directory=directory))
+        threading.Thread(target=self.file_server.serve_forever, name="fake-file-server", daemon=True).start()
+        apihelper.FILE_URL = f'http://127.0.0.1:{self.file_server.server_port}/{{1}}'
+
+    def close(self):
+        if self.file_server is not None:
+            self.file_server.shutdown()
+            self.file_server.server_close()
+            apihelper.FILE_URL = None
+
+    def calls_for(self, chat_id):
+        with self.cond:
+            return [call for call in self.calls if call.chat_id == chat_id]
+
+    def wait_for(self, predicate, timeout=600):
+        """Block until predicate(calls) is true; returns False on timeout"""
+        with self.cond:
+            return self.cond.wait_for(lambda: predicate(self.calls), timeout)
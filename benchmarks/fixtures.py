@@ -0,0 +1,93 @@
+"""
+Deterministic fixtures for the benchmarks: text PDFs, scanned PDFs, photo sets
+and text messages. Files are written once per directory and reused.
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+from PIL import Image, ImageDraw, ImageFilter
+
+from pdfusion.image_pdf import write_jpeg_pdf
+
+ENGLISH_WORDS = "the quick brown fox jumps over a lazy dog while PDF pages render in parallel".split()
+PERSIAN_WORDS = "این یک متن آزمایشی برای ساخت فایل پی دی اف از پیام های تلگرام است".split()
+
+
+def text_pdf(path, pages):
+    """Write a simple text PDF with the given number of pages"""
+    if os.path.exists(path):
+        return path
+    pdf = FPDF()
+    pdf.set_font('Arial', '', 12)
+    for page in range(pages):
+        pdf.add_page()
+        for line in range(40):
+            pdf.cell(0, 6, f"Benchmark page {page + 1}, line {line + 1}", ln=1)
+    pdf.output(path)
+    return path
+
+
+def scan_image(path, seed, size=(1240, 1754)):
+    """A grayscale A4 page at 150 DPI that looks like a scan: text-like bars, noise and blur"""
+    rng = random.Random(seed)
+    image = Image.new('L', size, 235)
+    draw = ImageDraw.Draw(image)
+    y = 120
+    while y < size[1] - 120:
+        x = 100
+        while x < size[0] - 100:
+            word = rng.randint(20, 90)
+            draw.rectangle([x, y, min(x + word, size[0] - 100), y + 14], fill=rng.randint(20, 70))
+            x += word + rng.randint(10, 20)
+        y += rng.choice([28, 28, 28, 56])
+    noise = Image.effect_noise(size, 18)
+    image = Image.blend(image, noise, 0.15).filter(ImageFilter.GaussianBlur(0.8))
+    image.save(path, 'JPEG', quality=75)
+    return path
+
+
+def scanned_pdf(path, pages, distinct=5):
+    """A PDF whose pages are JPEG scans, embedded as-is like the image-to-PDF feature does"""
+    if os.path.exists(path):
+        return path
+    directory = os.path.dirname(path)
+    scans = [scan_image(os.path.join(directory, f'scan_{i}.jpg'), i) for i in range(distinct)]
+    write_jpeg_pdf(path, [scans[i % distinct] for i in range(pages)], resolution=150.0)
+    return path
+
+
+def photo(path, seed, size=(1600, 1200)):
+    """A colour photo-like JPEG: a gradient with noise"""
+    rng = random.Random(seed)
+    channels = []
+    for _ in range(3):
+        gradient = Image.linear_gradient('L').rotate(rng.randint(0, 359)).resize(size)
+        channels.append(Image.blend(gradient, Image.effect_noise(size, 40), 0.3))
+    Image.merge('RGB', channels).filter(ImageFilter.GaussianBlur(1)).save(path, 'JPEG', quality=85)
+    return path
+
+
+def photo_set(directory, count):
+    """Write count photos into directory and return their file names (used as fake file_ids)"""
+    names = []
+    for i in range(count):
+        name = f'photo_{i}.jpg'
+        if not os.path.exists(os.path.join(directory, name)):
+            photo(os.path.join(directory, name), i)
+        names.append(name)
+    return names
+
+
+def text_messages(pages, chars_per_page=3000, seed=0):
+    """Chat messages of mixed English and Persian paragraphs, about pages pages long"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(pages * chars_per_page // 600):
+        words = PERSIAN_WORDS if rng.random() < 0.5 else ENGLISH_WORDS
+        messages.append(' '.join(rng.choice(words) for _ in range(100))[:600])
+    return messages
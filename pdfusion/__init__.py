@@ -0,0 +1,31 @@
+# pip install pyTelegramBotAPI pdf2image PyPDF2 Pillow fpdf arabic-reshaper python-bidi
+"""
+PDFusion: a Telegram bot that turns PDFs into images, and images and text into PDFs.
+
+Importing a module of this package creates no bot, starts no threads and
+loads no imaging or PDF library; `python -m pdfusion` (pdfusion.app.main)
+does the startup work. One module per part of the pipeline:
+
+    telegram     the TeleBot instance and the handler registry
+    log, metrics logging, Prometheus metrics and timing spans
+    outbound     rate-limited queue for every Bot API call
+    core         the asyncio core that runs downloads and async handlers
+    cancel       cancel tokens, stage deadlines and /cancel
+    jobs         the fair job scheduler
+    downloads    HTTP client, URL and Telegram file downloads
+    encoding     presets and adaptive page encoding
+    options      page ranges, thumbnails and contact sheets
+    pool, memory render process pool and memory budget
+    preflight    page tree inspection: cost estimate and image pages
+    rendering    page rendering in the pool, delivered in order
+    cache        render cache of sent file_ids
+    delivery     page albums and the PDF conversion loop
+    workspace    per-request scratch directories
+    flights      single-flight rendering shared by concurrent requests
+    handlers     PDF-to-images and general command handlers
+    sessions     session store
+    image_pdf    image-to-PDF feature
+    text_pdf     text-to-PDF feature
+    webhook      webhook server
+    app          startup, warm-up, polling
+"""
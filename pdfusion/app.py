@@ -0,0 +1,105 @@
+"""Startup: create the bot, optionally warm up, then poll Telegram or serve the webhook"""
+
+import os
+import shutil
+import threading
+import time
+
+from pdfusion import telegram
+from pdfusion.cancel import conversions
+from pdfusion.core import core
+# Importing the feature modules registers their handlers, in the order the bot checks them.
+from pdfusion import handlers, image_pdf, text_pdf  # noqa: F401
+from pdfusion.encoding import ImageChops
+from pdfusion.jobs import scheduler
+from pdfusion.log import log_message
+from pdfusion.metrics import METRICS_PORT, start_metrics_server
+from pdfusion.outbound import outbound
+from pdfusion.pool import start_render_workers
+from pdfusion.preflight import PyPDF2
+from pdfusion.rendering import Image, ImageDraw, pdf2image
+from pdfusion.webhook import RUN_MODE, run_webhook
+from pdfusion.workspace import remove_all_workspaces
+
+# 'background' warms up while the bot is already taking updates, 'startup' before it
+# takes any, 'off' leaves every cost to the first request that needs it.
+WARM_UP = os.environ.get('PDFUSION_WARMUP', 'background')
+# Seconds interrupted requests get at shutdown to clean up and send their last status edits
+SHUTDOWN_TIMEOUT = float(os.environ.get('PDFUSION_SHUTDOWN_TIMEOUT', 20))
+SHUTDOWN_REASON = "The bot is restarting. Please send your request again in a minute."
+
+def warm_up():
+    """
+    Pay the first-use costs up front: import the imaging and PDF libraries,
+    parse the text font, check that poppler is installed and start the render
+    workers (which import the rendering libraries themselves as they start).
+    """
+    start = time.perf_counter()
+    for module in (Image, ImageChops, ImageDraw, pdf2image, PyPDF2, text_pdf.fpdf, text_pdf.arabic_reshaper,
+                   text_pdf.bidi):
+        module.load()
+    if not (shutil.which('pdfinfo') and shutil.which('pdftoppm')):
+        log_message("poppler (pdfinfo, pdftoppm) not found: PDF conversion will fail", "WARNING")
+    try:
+        text_pdf.load_text_font()
+    except Exception as e:
+        log_message(f"Could not load the text font: {e}", "WARNING")
+    start_render_workers()
+    log_message(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+def stop_work(timeout=SHUTDOWN_TIMEOUT):
+    """
+    Wind down before the process exits: take no new jobs, cancel every download
+    and conversion, give them timeout seconds to clean up and send their last
+    status edits, then remove the workspaces of any that did not finish.
+    """
+    scheduler.close(SHUTDOWN_REASON)
+    log_message(f"Shutting down: cancelled {conversions.cancel_all(SHUTDOWN_REASON)} requests")
+    deadline = time.monotonic() + timeout
+    if not core.wait_idle(max(0.0, deadline - time.monotonic())):
+        log_message("Downloads still running at shutdown", "WARNING")
+    if not scheduler.wait_idle(max(0.0, deadline - time.monotonic())):
+        log_message("Jobs still running at shutdown", "WARNING")
+    outbound.wait_idle(max(0.0, deadline - time.monotonic()))
+    removed = remove_all_workspaces()
+    if removed:
+        log_message(f"Removed {removed} workspaces left by interrupted requests")
+
+# ----------------------------------------------------
+# Global Safe Polling: Restart polling if an error occurs.
+# ----------------------------------------------------
+def safe_polling():
+    while True:
+        try:
+            telegram.bot.polling(none_stop=True)
+        except Exception as e:
+            log_message(f"Polling error: {str(e)}", level="ERROR")
+            time.sleep(5)  # Wait a bit before restarting
+
+def main():
+    telegram.create_bot()
+    if WARM_UP == 'startup':
+        warm_up()
+    elif WARM_UP == 'background':
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+    log_message("Bot started and ready to process PDFs, images, and text")
+    print("\n" + "="*50)
+    print("Bot is running...")
+    print("Press Ctrl+C to stop")
+    print("="*50 + "\n")
+
+    if METRICS_PORT:
+        start_metrics_server()
+
+    if RUN_MODE == 'webhook':
+        run_webhook(on_stop=stop_work)
+    else:
+        # Remove any active webhook
+        telegram.bot.remove_webhook()
+
+        # Start polling in a safe mode so errors don't stop the bot.
+        safe_polling()
+
+if __name__ == '__main__':
+    main()
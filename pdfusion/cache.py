@@ -0,0 +1,141 @@
+"""The render cache: Telegram file_ids of pages already sent, by document and settings"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pdfusion.encoding import ENCODING_PRESETS, DEFAULT_PRESET
+from pdfusion.log import log_message
+from pdfusion.metrics import metrics
+
+# ---------------------------
+# Render cache: remember the Telegram file_id of every page photo already sent
+# ---------------------------
+CACHE_DIR = 'cache'
+RENDER_CACHE_INDEX = os.path.join(CACHE_DIR, 'render_index.json')
+RENDER_CACHE_TTL = int(os.environ.get('PDFUSION_CACHE_TTL', 7 * 24 * 3600))  # seconds
+RENDER_CACHE_MAX_PAGES = int(os.environ.get('PDFUSION_CACHE_MAX_PAGES', 50000))
+
+class RenderCache:
+    """
+    Persistent index from (document, render settings) to the file_ids of the
+    page photos Telegram already stores. A hit is replayed with send_photo(file_id),
+    so nothing is downloaded, rendered or uploaded again.
+    """
+
+    def __init__(self, index_path, ttl, max_pages):
+        self.index_path = index_path
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self.lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries = None
+
+    @property
+    def entries(self):
+        """The index, read from disk on first use rather than at import"""
+        if self._entries is None:
+            with self._load_lock:
+                if self._entries is None:
+                    self._entries = self._load()
+        return self._entries
+
+    @staticmethod
+    def make_key(source_id, settings):
+        """Build a cache key from a document identity and the settings used to render it"""
+        raw = json.dumps({'source': source_id, 'settings': settings}, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            log_message(f"Loaded render cache index with {len(entries)} documents")
+            return entries
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            log_message(f"Ignoring unreadable render cache index: {e}", "WARNING")
+            return {}
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _evict_locked(self, now):
+        expired = [key for key, entry in self.entries.items() if now - entry['created'] > self.ttl]
+        for key in expired:
+            del self.entries[key]
+        total_pages = sum(len(entry['file_ids']) for entry in self.entries.values())
+        # Least recently used documents go first once the page budget is exceeded.
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_used']):
+            if total_pages <= self.max_pages:
+                break
+            total_pages -= len(self.entries.pop(key)['file_ids'])
+
+    def get(self, key):
+        """
+        Return the cached entry for key, or None on a miss. The first call reads
+        the index from disk, so callers on the asyncio core run it with core.run_io.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry['created'] > self.ttl:
+                # Left for the next put to write out; an expired entry on disk is never served.
+                del self.entries[key]
+                return None
+            entry['last_used'] = now
+            return dict(entry)
+
+    def invalidate(self, key):
+        """Drop the entry for key, e.g. once Telegram rejects one of its file_ids"""
+        with self.lock:
+            if self.entries.pop(key, None) is None:
+                return
+            try:
+                self._save_locked()
+            except Exception as e:
+                log_message(f"Error saving render cache index: {e}", "ERROR")
+
+    def put(self, key, file_ids, captions=None):
+        """Store the page file_ids of a fully delivered document, with their captions unless they are the default"""
+        with self.lock:
+            now = time.time()
+            self.entries[key] = {'file_ids': list(file_ids), 'created': now, 'last_used': now}
+            if captions is not None:
+                self.entries[key]['captions'] = list(captions)
+            self._evict_locked(now)
+            try:
+                self._save_locked()
+            except Exception as e:
+                log_message(f"Error saving render cache index: {e}", "ERROR")
+
+render_cache = RenderCache(RENDER_CACHE_INDEX, RENDER_CACHE_TTL, RENDER_CACHE_MAX_PAGES)
+metrics.gauge('pdfusion_render_cache_documents', "Documents in the render cache",
+              func=lambda: len(render_cache.entries))
+
+def render_settings(preset_name=DEFAULT_PRESET, options=None):
+    """Settings that change the rendered output and therefore belong in the cache key"""
+    settings = {'preset': preset_name, **ENCODING_PRESETS[preset_name]}
+    # Whole-document requests keep the keys they had before request options existed.
+    if options is not None and options['pages'] is not None:
+        settings['pages'] = options['pages']
+    if options is not None and options['sheet']:
+        settings['sheet'] = options['sheet']
+    return settings
+
+def file_sha256(path):
+    """Hash a downloaded file so identical content from different URLs shares a cache entry"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,140 @@
+"""Cancellation of requests: cancel tokens, stage deadlines and the registry behind /cancel"""
+
+import asyncio
+import os
+import threading
+import time
+
+from pdfusion.log import log_message
+from pdfusion.metrics import metrics
+
+# ---------------------------
+# Cancellation: tokens checked between pages and chunks, stage deadlines and /cancel
+# ---------------------------
+# Longest a stage of one request may take, in seconds; 0 means no limit.
+STAGE_DEADLINES = {
+    'download': int(os.environ.get('PDFUSION_DOWNLOAD_DEADLINE', 15 * 60)),
+    'render': int(os.environ.get('PDFUSION_RENDER_DEADLINE', 30 * 60)),
+}
+
+class JobCancelled(Exception):
+    """Raised at a cancellation point once a request was cancelled or overran its stage deadline"""
+
+class CancelToken:
+    """
+    Cancellation state of one request, shared by its download and its job.
+    Sync code calls check() between pages; async code awaits through
+    cancellable(), which also interrupts a pending read.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reason = None
+        self.stage = None
+        self.deadline = None
+        self.callbacks = []
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def cancel(self, reason="Conversion cancelled."):
+        """Cancel the request; returns False if it was already cancelled"""
+        with self.lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+        return True
+
+    def on_cancel(self, callback):
+        """Call callback on cancellation (at once if already cancelled); returns a function that unregisters it"""
+        with self.lock:
+            if self.reason is None:
+                self.callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+    def start_stage(self, stage):
+        """Enter a stage and start its deadline from STAGE_DEADLINES"""
+        self.stage = stage
+        limit = STAGE_DEADLINES.get(stage, 0)
+        self.deadline = time.monotonic() + limit if limit else None
+
+    def remaining(self):
+        """Seconds left before the current stage's deadline, or None without one"""
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Raise JobCancelled if the request was cancelled or its stage ran out of time"""
+        if self.reason is None and self.remaining() == 0:
+            log_message(f"Request ran past its {self.stage} deadline", "WARNING")
+            self.cancel(f"Conversion stopped: the {self.stage} took longer than "
+                        f"{STAGE_DEADLINES[self.stage]} seconds.")
+        if self.reason is not None:
+            raise JobCancelled(self.reason)
+
+async def cancellable(coro, token):
+    """Await coro on the asyncio core, abandoning it when token is cancelled or its stage deadline passes"""
+    task = asyncio.ensure_future(coro)
+    loop = asyncio.get_running_loop()
+    unregister = token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        return await asyncio.wait_for(task, token.remaining())
+    except asyncio.TimeoutError:
+        remaining = token.remaining()
+        if remaining is None or remaining > 1:
+            raise  # a read timeout inside coro, not the deadline
+        token.deadline = time.monotonic()  # the loop may fire a timer slightly early
+        token.check()
+    except asyncio.CancelledError:
+        if not token.cancelled:
+            raise  # the caller itself is being cancelled
+        token.check()
+    finally:
+        unregister()
+
+class ConversionRegistry:
+    """The cancel tokens of every chat's unfinished requests, for /cancel"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}
+
+    def start(self, chat_id):
+        token = CancelToken()
+        with self.lock:
+            self.tokens.setdefault(chat_id, set()).add(token)
+        return token
+
+    def finish(self, chat_id, token):
+        with self.lock:
+            tokens = self.tokens.get(chat_id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.tokens[chat_id]
+
+    def cancel_chat(self, chat_id):
+        """Cancel every unfinished request of a chat; returns how many there were"""
+        with self.lock:
+            tokens = list(self.tokens.get(chat_id, ()))
+        return sum(token.cancel() for token in tokens)
+
+    def cancel_all(self, reason):
+        """Cancel every unfinished request of every chat (at shutdown); returns how many there were"""
+        with self.lock:
+            tokens = [token for chat_tokens in self.tokens.values() for token in chat_tokens]
+        return sum(token.cancel(reason) for token in tokens)
+
+conversions = ConversionRegistry()
+metrics.gauge('pdfusion_conversions', "Requests that /cancel can stop",
+              func=lambda: sum(len(tokens) for tokens in conversions.tokens.values()))
@@ -0,0 +1,90 @@
+"""The asyncio core: downloads and async handlers run as coroutines on one background loop"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pdfusion.log import log_message
+from pdfusion.metrics import Trace, current_trace
+from pdfusion.outbound import outbound
+from pdfusion.pool import get_render_pool
+
+# ---------------------------
+# asyncio core: waiting on the network suspends a coroutine instead of blocking a thread
+# ---------------------------
+IO_WORKERS = int(os.environ.get('PDFUSION_IO_WORKERS', 16))  # threads for short blocking library calls
+
+class AsyncCore:
+    """
+    One event loop on a background thread.
+    Synchronous code hands it coroutines with submit(); coroutines await
+    blocking library calls with run_io() and CPU-bound work with run_cpu().
+    """
+
+    def __init__(self, io_workers):
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='async-io')
+        self.loop = None
+        self.lock = threading.Lock()
+
+    def _get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.loop.set_default_executor(self.io_pool)
+                threading.Thread(target=self.loop.run_forever, name="async-core", daemon=True).start()
+            return self.loop
+
+    def submit(self, coro):
+        """Schedule a coroutine from any thread; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    async def run_io(self, func, *args, **kwargs):
+        # Like asyncio.to_thread, the call sees the coroutine's context (and so its trace).
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.io_pool, functools.partial(context.run, func, *args, **kwargs))
+
+    async def run_cpu(self, func, *args):
+        return await asyncio.wrap_future(get_render_pool().submit(func, *args))
+
+    def wait_idle(self, timeout):
+        """Wait for the coroutines running on the core to finish; returns False if some outlast timeout seconds"""
+        if self.loop is None:
+            return True
+
+        async def wait():
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            if not tasks:
+                return True
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            return not pending
+
+        return self.submit(wait()).result()
+
+core = AsyncCore(IO_WORKERS)
+
+def _log_handler_error(name, future):
+    if not future.cancelled() and future.exception() is not None:
+        log_message(f"Error in {name}: {future.exception()}", level="ERROR")
+
+async def _traced(coro):
+    current_trace.set(Trace())
+    return await coro
+
+def async_handler(func):
+    """Adapter for telebot: the async def handler runs on the core and the calling thread returns at once"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        future = core.submit(_traced(func(*args, **kwargs)))
+        future.add_done_callback(functools.partial(_log_handler_error, func.__name__))
+    return wrapper
+
+async def api_call_async(chat_id, method, *args, **kwargs):
+    """api_call for coroutines: the request waits in the dispatcher without holding a thread"""
+    return await asyncio.wrap_future(outbound.call(chat_id, method, *args, **kwargs))
+
+async def reply_to_async(message, text, **kwargs):
+    return await api_call_async(message.chat.id, 'reply_to', message, text, **kwargs)
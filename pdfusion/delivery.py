@@ -0,0 +1,244 @@
+"""Page delivery in albums, and the loop that renders and sends a PDF's pages"""
+
+import contextlib
+import io
+import os
+import re
+
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InputMediaPhoto
+
+from pdfusion.cache import render_cache
+from pdfusion.cancel import CancelToken, JobCancelled
+from pdfusion.core import api_call_async
+from pdfusion.encoding import DEFAULT_PRESET, preset_dpi
+from pdfusion.log import log_message
+from pdfusion.memory import process_tree_rss
+from pdfusion.metrics import span
+from pdfusion.options import DEFAULT_RENDER_OPTIONS, page_captions, select_pages, sheet_captions, sheet_dpi
+from pdfusion.outbound import api_call, edit_status
+from pdfusion.rendering import estimate_page_bytes, inspect_document, render_pages_ordered
+
+# ---------------------------
+# Page delivery: albums of up to 10 photos per send_media_group call
+# ---------------------------
+# 'album' groups pages with send_media_group, 'single' sends one send_photo per page.
+DELIVERY_MODE = os.environ.get('PDFUSION_DELIVERY_MODE', 'album')
+ALBUM_SIZE = 10  # Telegram's maximum number of items in a media group
+
+def page_upload(page_num, page_data, extension='jpg'):
+    """Wrap encoded page bytes in a named in-memory file for upload"""
+    buffer = io.BytesIO(page_data)
+    buffer.name = f'page_{page_num + 1}.{extension}'
+    return buffer
+
+class PageSender:
+    """
+    Deliver pages to a chat in order, either one photo per call or as albums,
+    and keep count of the Telegram API calls a document needs.
+    Pages are either encoded (data, file_extension) pairs, which are uploaded,
+    or cached file_ids, which are re-sent.
+    """
+
+    def __init__(self, chat_id, status_message_id, total_pages, mode=DELIVERY_MODE, progress_every=5, captions=None):
+        self.chat_id = chat_id
+        self.status_message_id = status_message_id
+        self.total_pages = total_pages
+        self.captions = captions or page_captions(range(total_pages), total_pages)
+        self.album_size = ALBUM_SIZE if mode == 'album' else 1
+        self.progress_every = max(progress_every, self.album_size)
+        self.pending = []
+        self.file_ids = []
+        self.sent = 0
+        self.last_progress = 0
+        self.on_sent = None  # called with the file_ids of every flushed batch
+        self.api_calls = 0
+        self.bytes_uploaded = 0
+
+    def caption(self, page_num):
+        return self.captions[page_num]
+
+    def _media(self, page_num, page):
+        if isinstance(page, str):
+            return page
+        data, extension = page
+        self.bytes_uploaded += len(data)
+        return page_upload(page_num, data, extension)
+
+    def add(self, page_num, page):
+        """Queue a page; a full album (or a single page in 'single' mode) is sent immediately"""
+        self.pending.append((page_num, page))
+        if len(self.pending) >= self.album_size:
+            self.flush()
+
+    def flush(self):
+        """Send whatever is queued and update the progress message if due"""
+        if not self.pending:
+            return
+        method, args, kwargs = self._request()
+        with span('upload'):
+            result = api_call(self.chat_id, method, self.chat_id, *args, **kwargs)
+        self._record(method, result)
+
+    async def flush_async(self):
+        """flush() for coroutines: the request waits in the dispatcher without holding a thread"""
+        if not self.pending:
+            return
+        method, args, kwargs = self._request()
+        with span('upload'):
+            result = await api_call_async(self.chat_id, method, self.chat_id, *args, **kwargs)
+        self._record(method, result)
+
+    def _request(self):
+        """The Bot API method, arguments (after the chat) and keyword arguments that send the queued pages"""
+        if len(self.pending) == 1:
+            # Media groups need at least two items.
+            page_num, page = self.pending[0]
+            log_message(f"Sending page {page_num + 1}", "DEBUG")
+            return 'send_photo', (self._media(page_num, page),), {'caption': self.caption(page_num)}
+        first, last = self.pending[0][0] + 1, self.pending[-1][0] + 1
+        log_message(f"Sending album: pages {first} to {last}", "DEBUG")
+        media = [InputMediaPhoto(self._media(page_num, page), caption=self.caption(page_num))
+                 for page_num, page in self.pending]
+        return 'send_media_group', (media,), {}
+
+    def _record(self, method, result):
+        sent_messages = [result] if method == 'send_photo' else result
+        self.api_calls += 1
+        new_file_ids = [sent_message.photo[-1].file_id for sent_message in sent_messages]
+        self.file_ids.extend(new_file_ids)
+        if self.on_sent is not None:
+            self.on_sent(new_file_ids)
+        self.sent += len(self.pending)
+        self.pending = []
+
+        if self.sent - self.last_progress >= self.progress_every or self.sent == self.total_pages:
+            self.last_progress = self.sent
+            self.update_progress(
+                f"Processing: {int(self.sent / self.total_pages * 100)}% complete "
+                f"({self.sent}/{self.total_pages} pages)"
+            )
+
+    def update_progress(self, text):
+        self.api_calls += 1
+        edit_status(text, self.chat_id, self.status_message_id)
+
+    def finish(self):
+        """Send the remaining pages and return the file_ids of every delivered page"""
+        self.flush()
+        log_message(f"Delivered {self.sent} pages to {self.chat_id} in {self.api_calls} API calls, "
+                    f"{self.bytes_uploaded/1024:.0f}KB uploaded")
+        return self.file_ids
+
+# 400 descriptions that mean a cached file_id is no longer usable (expired, from another bot or of the
+# wrong type); any other Bad Request is a real error and is not blamed on the cache.
+REJECTED_FILE_ERRORS = re.compile(r'wrong (remote )?file identifier|wrong file_id|file reference|type of file mismatch'
+                                  r'|wrong type of the web page content|MEDIA_EMPTY', re.IGNORECASE)
+
+class CachedFileRejected(Exception):
+    """Telegram refused a cached file_id; sent_file_ids are the pages delivered before it"""
+
+    def __init__(self, error, sent_file_ids):
+        super().__init__(str(error))
+        self.sent_file_ids = sent_file_ids
+
+async def send_cached_pages(chat_id, status_message_id, entry, sent_file_ids=(), token=None):
+    """
+    Replay a cache entry by re-sending the stored photo file_ids after the
+    leading pages in sent_file_ids, which were already delivered (e.g. an early
+    preview). Runs on the asyncio core without holding a thread; token, if
+    given, is checked before every album. Raises CachedFileRejected if Telegram
+    no longer accepts one of the file_ids (it expired, or the bot was registered again).
+    """
+    file_ids = entry['file_ids']
+    first_page = len(sent_file_ids)
+    log_message(f"Render cache hit: sending {len(file_ids) - first_page} cached pages to {chat_id}")
+    sender = PageSender(chat_id, status_message_id, len(file_ids), captions=entry.get('captions'))
+    sender.sent = sender.last_progress = first_page
+    sender.file_ids = list(sent_file_ids)
+    try:
+        for page_num in range(first_page, len(file_ids)):
+            sender.pending.append((page_num, file_ids[page_num]))
+            if len(sender.pending) >= sender.album_size or page_num == len(file_ids) - 1:
+                if token is not None:
+                    token.check()
+                await sender.flush_async()
+        return sender.finish()
+    except ApiTelegramException as e:
+        if e.error_code != 400 or not REJECTED_FILE_ERRORS.search(e.description or ''):
+            raise
+        raise CachedFileRejected(e, sender.file_ids) from e
+
+def process_pdf_in_batches(pdf_path, chat_id, status_message_id, batch_size=5, cache_key=None, sent_file_ids=None,
+                           preset_name=DEFAULT_PRESET, flight=None, options=None, token=None, inspection=None):
+    """
+    Process PDF pages in small batches.
+    options (see parse_render_options) select pages or contact sheets; by default
+    every page is sent.
+    inspection is the document's pre-flight PdfInspection, if the caller already has
+    one. Its cost estimate picks the direct path (render in this thread) or the
+    render pool, and pages that are a single JPEG are sent from that JPEG.
+    sent_file_ids lists leading pages that were already delivered (e.g. an early
+    preview of page 1); rendering continues after them.
+    Delivered pages are published to flight, if given, for chats following this render.
+    token is checked before every page; JobCancelled is raised once it is cancelled.
+    Returns the file_ids of the sent photos, or None if processing failed.
+    """
+    options = options or DEFAULT_RENDER_OPTIONS
+    token = token or CancelToken()
+    try:
+        log_message(f"Starting PDF processing: {pdf_path}")
+        inspection = inspection or inspect_document(pdf_path)
+        info = inspection.info
+        total_pages = info['pages']
+        log_message(f"Total pages in PDF: {total_pages}", "DEBUG")
+        peak_rss = process_tree_rss()
+
+        pages = select_pages(options, total_pages)
+        sheet_size = options['sheet']
+        if sheet_size:
+            captions = sheet_captions([pages[i:i + sheet_size] for i in range(0, len(pages), sheet_size)], total_pages)
+            dpi = sheet_dpi(info, preset_name, sheet_size)
+        else:
+            captions = page_captions(pages, total_pages)
+            dpi = preset_dpi(info, preset_name)
+        route = inspection.route(pages)
+        image_pages = frozenset() if sheet_size else inspection.image_pages
+        log_message(f"Pre-flight: {len(pages)} pages, estimated cost {inspection.cost(pages):.1f}, "
+                    f"{len(image_pages.intersection(pages))} possible image pages, {route} path")
+
+        sender = PageSender(chat_id, status_message_id, len(captions), progress_every=batch_size, captions=captions)
+        if sent_file_ids:
+            sender.file_ids = list(sent_file_ids)
+            sender.sent = sender.last_progress = len(sent_file_ids)
+        if flight is not None:
+            flight.publish(sender.file_ids, captions, first=0)
+            sender.on_sent = lambda file_ids: flight.publish(file_ids, captions)
+        # sender counts sheets, not pages, in sheet mode.
+        remaining = pages[sender.sent * sheet_size:] if sheet_size else pages[sender.sent:]
+        rendered = render_pages_ordered(pdf_path, remaining, batch_size,
+                                        page_bytes=estimate_page_bytes(inspection.largest_page(pages), dpi),
+                                        dpi=dpi, preset_name=preset_name, sheet_size=sheet_size,
+                                        image_pages=image_pages, direct=route == 'direct', token=token)
+        # Closing the generator cancels the batches still rendering ahead.
+        with contextlib.closing(rendered):
+            for page_num, page_data in enumerate(rendered, start=sender.sent):
+                token.check()
+                sender.add(page_num, page_data)
+                peak_rss = max(peak_rss, process_tree_rss())
+        token.check()
+        file_ids = sender.finish()
+        log_message(f"Peak RSS while processing {pdf_path}: {peak_rss/(1024*1024):.1f}MB")
+
+        if cache_key is not None:
+            render_cache.put(cache_key, file_ids, captions=None if options == DEFAULT_RENDER_OPTIONS else captions)
+        return file_ids
+
+    except JobCancelled:
+        raise
+    except Exception as e:
+        # A pdftoppm killed at the stage deadline surfaces here as a timeout error.
+        token.check()
+        log_message(f"Error in PDF processing: {str(e)}", "ERROR")
+        api_call(chat_id, 'send_message', chat_id, f"Error processing PDF: {str(e)}")
+        return None
@@ -0,0 +1,449 @@
+"""HTTP client on the asyncio core, URL downloads and Telegram file downloads"""
+
+import asyncio
+import contextlib
+import os
+import re
+import ssl
+from urllib.parse import urlparse, urljoin
+
+from telebot import apihelper
+
+from pdfusion import telegram
+from pdfusion.core import core
+from pdfusion.log import log_message
+from pdfusion.metrics import span
+
+# ---------------------------
+# HTTP layer: asyncio client with keep-alive pooling, parallel Range downloads with resume
+# ---------------------------
+HTTP_TIMEOUT = (10, 60)  # (connect, read) seconds
+HTTP_MAX_REDIRECTS = 5
+HTTP_IDLE_CONNECTIONS_PER_HOST = 8
+DOWNLOAD_CONNECTIONS = int(os.environ.get('PDFUSION_DOWNLOAD_CONNECTIONS', 4))
+DOWNLOAD_SEGMENT_SIZE = 4 * 1024 * 1024
+RANGED_DOWNLOAD_MIN_SIZE = 2 * DOWNLOAD_SEGMENT_SIZE
+DOWNLOAD_RETRIES = 3
+MAX_DOWNLOAD_SIZE = int(os.environ.get('PDFUSION_MAX_DOWNLOAD_SIZE', 1024 * 1024 * 1024))  # bytes
+
+class HttpError(Exception):
+    """Non-success HTTP status"""
+
+class RangeIgnored(IOError):
+    """The server answered a Range request with the whole file"""
+
+def check_download_size(size):
+    """Raise HttpError if a download of size bytes would exceed MAX_DOWNLOAD_SIZE"""
+    if size > MAX_DOWNLOAD_SIZE:
+        raise HttpError(f"File is larger than the {MAX_DOWNLOAD_SIZE/(1024*1024):.0f}MB download limit")
+
+_ssl_context = None
+# Key: (scheme, host, port), Value: idle (reader, writer) pairs. Only used on the core's event loop.
+_idle_connections = {}
+
+def get_ssl_context():
+    """The TLS context for HTTPS downloads, created on first use (loading the CA store takes a while)"""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+async def _open_connection(key):
+    """Return (reader, writer, reused), preferring an idle pooled connection"""
+    idle = _idle_connections.get(key)
+    while idle:
+        reader, writer = idle.pop()
+        if not reader.at_eof() and not writer.is_closing():
+            return reader, writer, True
+        writer.close()
+    scheme, host, port = key
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=get_ssl_context() if scheme == 'https' else None),
+        HTTP_TIMEOUT[0])
+    return reader, writer, False
+
+async def _exchange(key, request):
+    """Send a request and read the status line and header lines of the response"""
+    while True:
+        reader, writer, reused = await _open_connection(key)
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), HTTP_TIMEOUT[1])
+            if not status_line:
+                raise ConnectionResetError("Connection closed before the response")
+            header_lines = []
+            while True:
+                line = await asyncio.wait_for(reader.readline(), HTTP_TIMEOUT[1])
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                header_lines.append(line)
+            return reader, writer, status_line, header_lines
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused:
+                raise
+            # The server dropped an idle pooled connection; try the next one.
+        except BaseException:
+            writer.close()
+            raise
+
+class HttpResponse:
+    """A response whose body is read from the connection as it is consumed"""
+
+    def __init__(self, url, method, status, headers, reader, writer, key):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        self.key = key
+        self.chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        if method == 'HEAD' or status in (204, 304):
+            self.chunked = False
+            self.remaining = 0
+        elif not self.chunked and 'content-length' in headers:
+            self.remaining = int(headers['content-length'])
+        else:
+            self.remaining = None
+        self.keep_alive = (headers.get('connection', '').lower() != 'close'
+                           and (self.chunked or self.remaining is not None))
+        self.complete = self.remaining == 0
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HttpError(f"HTTP {self.status} from {urlparse(self.url).hostname}")
+
+    async def _read(self, size):
+        data = await asyncio.wait_for(self.reader.read(size), HTTP_TIMEOUT[1])
+        if not data:
+            raise ConnectionResetError("Connection closed in the middle of the response body")
+        return data
+
+    async def iter_chunks(self, size=64 * 1024):
+        """Yield the body in pieces of at most size bytes"""
+        if self.chunked:
+            while True:
+                line = await asyncio.wait_for(self.reader.readline(), HTTP_TIMEOUT[1])
+                if not line:
+                    raise ConnectionResetError("Connection closed in the middle of the response body")
+                chunk_size = int(line.split(b';', 1)[0].strip(), 16)
+                if chunk_size == 0:
+                    while (await asyncio.wait_for(self.reader.readline(), HTTP_TIMEOUT[1])) not in (b'\r\n', b'\n', b''):
+                        pass  # trailers
+                    break
+                while chunk_size:
+                    data = await self._read(min(size, chunk_size))
+                    chunk_size -= len(data)
+                    yield data
+                await asyncio.wait_for(self.reader.readline(), HTTP_TIMEOUT[1])
+        elif self.remaining is not None:
+            while self.remaining:
+                data = await self._read(min(size, self.remaining))
+                self.remaining -= len(data)
+                yield data
+        else:
+            while True:
+                data = await asyncio.wait_for(self.reader.read(size), HTTP_TIMEOUT[1])
+                if not data:
+                    break
+                yield data
+        self.complete = True
+
+    async def read(self):
+        return b''.join([data async for data in self.iter_chunks()])
+
+    def close(self):
+        """Return the connection to the pool if the body was read to the end, otherwise close it"""
+        idle = _idle_connections.setdefault(self.key, [])
+        if self.complete and self.keep_alive and len(idle) < HTTP_IDLE_CONNECTIONS_PER_HOST:
+            idle.append((self.reader, self.writer))
+        else:
+            self.writer.close()
+
+async def _send_request(method, url, headers):
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        parts = urlparse(url)
+        if parts.scheme not in ('http', 'https'):
+            raise HttpError(f"Unsupported URL scheme: {parts.scheme!r}")
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {parts.netloc.rpartition("@")[2]}',
+                 'User-Agent: PDFusion', 'Accept-Encoding: identity']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        reader, writer, status_line, header_lines = await _exchange(key, request)
+        status = int(status_line.split(None, 2)[1])
+        response_headers = {}
+        for line in header_lines:
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        response = HttpResponse(url, method, status, response_headers, reader, writer, key)
+
+        if status in (301, 302, 303, 307, 308) and 'location' in response_headers:
+            try:
+                await response.read()
+            finally:
+                response.close()
+            url = urljoin(url, response_headers['location'])
+            if status == 303:
+                method = 'GET'
+            continue
+        return response
+    raise HttpError(f"Too many redirects for {url}")
+
+def response_validator(headers):
+    """A validator for If-Range: a strong ETag, else Last-Modified (weak ETags are not allowed there)"""
+    etag = headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('last-modified')
+
+def content_range_start(response):
+    """First byte of a 206 response according to its Content-Range, or None if missing or unreadable"""
+    match = re.match(r'bytes\s+(\d+)-\d+/(?:\d+|\*)$', response.headers.get('content-range', ''))
+    return int(match.group(1)) if match else None
+
+@contextlib.asynccontextmanager
+async def http_request(method, url, headers=None):
+    """
+    Make an HTTP/1.1 request on the asyncio core, following redirects.
+    Use as `async with http_request('GET', url) as response:`; the body is read with
+    response.iter_chunks() or response.read(), and the connection goes back to the
+    pool when the block exits.
+    """
+    response = await _send_request(method, url, headers)
+    try:
+        yield response
+    finally:
+        response.close()
+
+async def probe_pdf_url(url):
+    """
+    Check if URL points to a PDF file.
+    Returns a dict with 'size', 'ranges' (server accepts Range requests) and
+    'validator' (ETag/Last-Modified), or None if the URL is not a PDF.
+    The HEAD request's connection is pooled, so the download reuses it.
+    """
+    try:
+        log_message(f"Validating URL: {url}", "DEBUG")
+        async with http_request('HEAD', url) as response:
+            headers = response.headers
+        content_type = headers.get('content-type', '').lower()
+        is_valid = 'application/pdf' in content_type or url.lower().endswith('.pdf')
+        log_message(f"URL validation result: {is_valid}", "DEBUG")
+        if not is_valid:
+            return None
+        return {
+            'url': response.url,
+            'size': int(headers.get('content-length', 0)),
+            'ranges': headers.get('accept-ranges', '').lower() == 'bytes',
+            'validator': response_validator(headers),
+        }
+    except Exception as e:
+        log_message(f"URL validation error: {str(e)}", "ERROR")
+        return None
+
+def read_linearization(head):
+    """
+    Parse the linearization dictionary at the start of a PDF, if any.
+    Returns {'pages': N, 'first_page_end': E} or None for non-linearized files.
+    """
+    match = re.search(rb'/Linearized\b(.{0,512}?)>>', head, re.S)
+    if not match:
+        return None
+    params = dict(re.findall(rb'/([NE])\s+(\d+)', match.group(1)))
+    if b'N' not in params or b'E' not in params:
+        return None
+    return {'pages': int(params[b'N']), 'first_page_end': int(params[b'E'])}
+
+async def _fetch_segment(url, fd, start, end, validator, progress):
+    """Fetch bytes start..end (inclusive) into fd at the same offset, resuming on errors"""
+    position = start
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        headers = {'Range': f'bytes={position}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
+        try:
+            async with http_request('GET', url, headers) as response:
+                if response.status == 200:
+                    raise RangeIgnored(f"Server ignored range request (HTTP {response.status})")
+                if response.status != 206:
+                    raise IOError(f"Server ignored range request (HTTP {response.status})")
+                if content_range_start(response) != position:
+                    raise IOError(f"Server sent {response.headers.get('content-range')!r} for bytes {position}-{end}")
+                async for data in response.iter_chunks():
+                    os.pwrite(fd, data, position)
+                    position += len(data)
+                    progress(len(data))
+            if position > end:
+                return
+            raise IOError(f"Segment ended early at byte {position}")
+        except RangeIgnored:
+            raise
+        except Exception as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            log_message(f"Resuming segment at byte {position} after error: {e}", "WARNING")
+            await asyncio.sleep(2 ** attempt)
+
+async def _download_ranged(url, destination, probe, on_first_page):
+    """
+    Download with DOWNLOAD_CONNECTIONS parallel Range requests.
+    The tail (trailer and main xref) and the first segment are fetched first;
+    for linearized PDFs on_first_page is awaited as soon as the first-page
+    section and the trailer are on disk, before the rest has arrived.
+    A segment interrupted by a network error resumes from the last byte written.
+    """
+    total_size = probe['size']
+    segments = [(start, min(start + DOWNLOAD_SEGMENT_SIZE, total_size) - 1)
+                for start in range(0, total_size, DOWNLOAD_SEGMENT_SIZE)]
+    # Last segment first, then front to back.
+    order = [len(segments) - 1] + list(range(len(segments) - 1))
+
+    done = set()
+    downloaded = 0
+    connections = asyncio.Semaphore(DOWNLOAD_CONNECTIONS)
+
+    def count(nbytes):
+        nonlocal downloaded
+        downloaded += nbytes
+
+    async def fetch(index):
+        async with connections:
+            await _fetch_segment(probe['url'], fd, *segments[index], probe['validator'], count)
+        return index
+
+    fd = os.open(destination, os.O_RDWR | os.O_CREAT)
+    tasks = []
+    try:
+        os.ftruncate(fd, total_size)
+        # The semaphore wakes waiters in order, so segments start in the order created.
+        tasks = [asyncio.ensure_future(fetch(i)) for i in order]
+        pending = set(tasks)
+        linearization = None
+        first_page_sent = on_first_page is None
+        while pending:
+            finished, pending = await asyncio.wait(pending, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                done.add(task.result())
+
+            if not first_page_sent and 0 in done and len(segments) - 1 in done:
+                if linearization is None:
+                    linearization = read_linearization(os.pread(fd, 1024, 0)) or {}
+                first_page_end = linearization.get('first_page_end')
+                if first_page_end is None:
+                    first_page_sent = True
+                elif all(i in done for i in range(first_page_end // DOWNLOAD_SEGMENT_SIZE + 1)):
+                    first_page_sent = True
+                    await on_first_page(destination, linearization['pages'])
+            yield downloaded, total_size
+    finally:
+        for task in tasks:
+            task.cancel()
+        try:
+            # wait_for can drop a cancel whose result arrived at the same time, so wait until every
+            # segment has stopped before fd is closed (and its number possibly reused). This also
+            # retrieves the errors of segments that failed alongside the one raised.
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            os.close(fd)
+
+async def _download_streamed(url, destination, probe):
+    """
+    Download over a single connection, resuming with a Range request after
+    errors. A resume is conditional on the file's validator (If-Range) and must
+    start where the file on disk ends; otherwise the download starts over, so a
+    file that changed between attempts is never spliced onto the old one.
+    """
+    downloaded = 0
+    total_size = probe['size'] if probe else 0
+    validator = probe['validator'] if probe else None
+    with open(destination, 'wb') as file:
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            headers = {}
+            if downloaded and validator:
+                headers = {'Range': f'bytes={downloaded}-', 'If-Range': validator}
+            try:
+                async with http_request('GET', url, headers) as response:
+                    response.raise_for_status()
+                    if downloaded and response.status == 206 and content_range_start(response) != downloaded:
+                        validator = None  # retry with a plain GET
+                        raise IOError(f"Server sent {response.headers.get('content-range')!r} "
+                                      f"for a resume at byte {downloaded}")
+                    if downloaded and response.status != 206:
+                        # No validator, no range support or a changed file: start over.
+                        file.seek(0)
+                        file.truncate()
+                        downloaded = 0
+                        validator = None
+                        total_size = 0
+                    if not downloaded:
+                        # This response's bytes are the ones on disk, so its validator is the one to resume with.
+                        validator = response_validator(response.headers) or validator
+                    if not total_size:
+                        total_size = int(response.headers.get('content-length', 0))
+                        check_download_size(total_size)
+                    async for data in response.iter_chunks():
+                        file.write(data)
+                        downloaded += len(data)
+                        # Chunked responses and lying servers are only caught by counting.
+                        check_download_size(downloaded)
+                        yield downloaded, total_size
+                return
+            except (OSError, EOFError) as e:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                log_message(f"Resuming download at byte {downloaded} after error: {e}", "WARNING")
+                await asyncio.sleep(2 ** attempt)
+
+async def download_file_in_chunks(url, destination, probe=None, on_first_page=None):
+    """
+    Download a file in chunks with progress tracking, yielding (downloaded, total_size).
+    Large files from servers that accept Range requests are fetched in parallel segments;
+    if the server then ignores the ranges, the file is downloaded again over one connection.
+    Files larger than MAX_DOWNLOAD_SIZE are refused with HttpError.
+    """
+    log_message(f"Starting download from: {url}")
+    if probe is None:
+        probe = await probe_pdf_url(url)
+    total_size = probe['size'] if probe else 0
+    log_message(f"Total file size: {total_size/(1024*1024):.2f}MB")
+    check_download_size(total_size)
+
+    if probe and probe['ranges'] and total_size >= RANGED_DOWNLOAD_MIN_SIZE:
+        log_message(f"Using {DOWNLOAD_CONNECTIONS} parallel range requests")
+        try:
+            async for progress in _download_ranged(url, destination, probe, on_first_page):
+                yield progress
+        except RangeIgnored as e:
+            log_message(f"{e}, downloading over a single connection", "WARNING")
+            async for progress in _download_streamed(url, destination, probe):
+                yield progress
+    else:
+        async for progress in _download_streamed(url, destination, probe):
+            yield progress
+
+    log_message("Download completed")
+
+def telegram_file_url(file_path):
+    """Download URL of a file returned by getFile; honours apihelper.FILE_URL (e.g. a local Bot API server)"""
+    return (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(telegram.bot.token, file_path)
+
+async def download_telegram_file(file_id, destination):
+    """Stream a Telegram file to destination; only the short getFile call runs on a thread"""
+    file_info = await core.run_io(telegram.bot.get_file, file_id)
+    try:
+        with span('download'):
+            async with http_request('GET', telegram_file_url(file_info.file_path)) as response:
+                response.raise_for_status()
+                with open(destination, 'wb') as f:
+                    async for data in response.iter_chunks():
+                        f.write(data)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(destination)
+        raise
+    return destination
@@ -0,0 +1,138 @@
+"""Encoding presets and adaptive per-page encoding"""
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from pdfusion.lazy import lazy_import
+
+ImageChops = lazy_import('PIL.ImageChops')
+
+# ---------------------------
+# Adaptive encoding: per-page DPI, format and quality to hit a byte target
+# ---------------------------
+# Telegram scales photos down to 2560px on the long side, so larger renders only cost upload time.
+ENCODING_PRESETS = {
+    'fast': {'dpi': 100, 'max_side': 1280, 'target_bytes': 150 * 1024, 'formats': ('JPEG',)},
+    'balanced': {'dpi': 150, 'max_side': 2048, 'target_bytes': 350 * 1024, 'formats': ('JPEG', 'PNG')},
+    'quality': {'dpi': 200, 'max_side': 2560, 'target_bytes': 900 * 1024, 'formats': ('JPEG', 'PNG')},
+    'small': {'dpi': 120, 'max_side': 1600, 'target_bytes': 100 * 1024, 'formats': ('WEBP', 'JPEG', 'PNG')},
+    'thumbnail': {'dpi': 50, 'max_side': 480, 'target_bytes': 30 * 1024, 'formats': ('JPEG',)},
+}
+DEFAULT_PRESET = os.environ.get('PDFUSION_DEFAULT_PRESET', 'balanced')
+MIN_QUALITY, MAX_QUALITY = 35, 90
+FILE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+# Users whose /preset choice is remembered; the least recently active are forgotten first.
+MAX_USER_PRESETS = int(os.environ.get('PDFUSION_MAX_USER_PRESETS', 100000))
+
+# Key: user_id, Value: name of the preset chosen with /preset, least recently used first
+user_presets = OrderedDict()
+_user_presets_lock = threading.Lock()
+
+def get_user_preset(user_id):
+    with _user_presets_lock:
+        if user_id not in user_presets:
+            return DEFAULT_PRESET
+        user_presets.move_to_end(user_id)
+        return user_presets[user_id]
+
+def set_user_preset(user_id, name):
+    """Remember a user's preset; choosing the default forgets it, and the map holds at most MAX_USER_PRESETS users"""
+    with _user_presets_lock:
+        user_presets.pop(user_id, None)
+        if name != DEFAULT_PRESET:
+            user_presets[user_id] = name
+            while len(user_presets) > MAX_USER_PRESETS:
+                user_presets.popitem(last=False)
+
+def preset_dpi(info, preset_name):
+    """DPI for a document: the preset's DPI, lowered so the long side stays within max_side"""
+    preset = ENCODING_PRESETS[preset_name]
+    long_side_inches = max(info['width'], info['height']) / 72
+    return max(36, min(preset['dpi'], int(preset['max_side'] / long_side_inches)))
+
+def classify_page(image):
+    """
+    Return 'text', 'gray' or 'color' for a rendered page.
+    Colour is judged on a downscaled copy; text pages are almost only paper
+    and ink, so their full-resolution histogram has few mid-tones.
+    """
+    sample = image.convert('RGB').reduce(4)
+    red, green, blue = sample.split()
+    max_channel_diff = max(ImageChops.difference(red, green).getextrema()[1],
+                           ImageChops.difference(green, blue).getextrema()[1])
+    histogram = image.convert('L').histogram()
+    mid_tones = sum(histogram[64:192]) / max(1, sum(histogram))
+    if max_channel_diff < 24 and mid_tones < 0.05:
+        return 'text'
+    if max_channel_diff < 24:
+        return 'gray'
+    return 'color'
+
+def _encode(image, fmt, quality=None, buffer=None):
+    """Encode into buffer, rewound and emptied first, and return a copy of the output"""
+    if buffer is None:
+        buffer = io.BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    if fmt == 'PNG':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+def _encode_to_target(image, fmt, target_bytes, buffer=None):
+    """Binary-search the highest quality whose output fits target_bytes (lowest quality if none does)"""
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = _encode(image, fmt, low, buffer)
+    if len(best) > target_bytes:
+        return best
+    while high - low > 5:
+        middle = (low + high) // 2
+        data = _encode(image, fmt, middle, buffer)
+        if len(data) <= target_bytes:
+            best, low = data, middle
+        else:
+            high = middle
+    return best
+
+def encode_page(image, preset_name):
+    """
+    Encode a rendered page for upload; returns (data, file_extension).
+    Grayscale and text pages drop the colour channels, text pages are also
+    tried as a 16-level PNG, and every candidate aims at the preset's byte target.
+    All trials encode into one buffer, which keeps its memory instead of
+    growing a new one for every quality tried.
+    """
+    preset = ENCODING_PRESETS[preset_name]
+    # Classify before scaling: resampling turns sharp text edges into mid-tones.
+    kind = classify_page(image)
+    if max(image.size) > preset['max_side']:
+        image.thumbnail((preset['max_side'], preset['max_side']))
+    if kind != 'color':
+        image = image.convert('L')
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    target = preset['target_bytes']
+    buffer = io.BytesIO()
+    candidates = []
+    for fmt in preset['formats']:
+        if fmt == 'PNG':
+            if kind == 'text':
+                candidates.append((_encode(image.quantize(16), 'PNG', buffer=buffer), fmt))
+        else:
+            candidates.append((_encode_to_target(image, fmt, target, buffer), fmt))
+    if not candidates:
+        candidates.append((_encode_to_target(image, 'JPEG', target, buffer), 'JPEG'))
+
+    fitting = [c for c in candidates if len(c[0]) <= target]
+    data, fmt = min(fitting or candidates, key=lambda c: len(c[0]))
+    if len(data) > target * 1.5 and fmt != 'PNG':
+        # Still far too big at the lowest quality: trade resolution for size once.
+        scale = (target / len(data)) ** 0.5
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+        data = _encode_to_target(image, fmt, target, buffer)
+    return data, FILE_EXTENSIONS[fmt]
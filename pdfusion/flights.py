@@ -0,0 +1,155 @@
+"""Single-flight rendering: requests for a document that is already rendering follow that render"""
+
+import threading
+
+from telebot.types import InputMediaPhoto
+
+from pdfusion.cancel import CancelToken, conversions
+from pdfusion.delivery import ALBUM_SIZE, DELIVERY_MODE
+from pdfusion.log import log_message
+from pdfusion.metrics import metrics
+from pdfusion.outbound import outbound, edit_status
+
+# ---------------------------
+# Single-flight: one render per document and settings, fanned out to every chat asking for it
+# ---------------------------
+class FanOut:
+    """
+    Delivers another chat's render to one more chat. Pages are re-sent by the
+    file_ids the leader's uploads produced, as they arrive, without waiting:
+    the outbound dispatcher keeps them in order per chat.
+    """
+
+    def __init__(self, chat_id, status_message_id, sent_file_ids=(), mode=DELIVERY_MODE, token=None, user_id=None):
+        self.chat_id = chat_id
+        self.status_message_id = status_message_id
+        self.user_id = user_id
+        self.sent_file_ids = list(sent_file_ids)  # leading pages already delivered to this chat
+        self.first_page = len(self.sent_file_ids)
+        self.album_size = ALBUM_SIZE if mode == 'album' else 1
+        self.token = token or CancelToken()  # cancelling it stops this chat's copy only
+        self.received = 0
+
+    def send(self, file_ids, captions):
+        if self.token.cancelled:
+            return
+        first = self.received
+        self.received += len(file_ids)
+        skip = max(0, self.first_page - first)
+        file_ids, first = file_ids[skip:], first + skip
+        if not file_ids:
+            return
+        for start in range(0, len(file_ids), self.album_size):
+            chunk = file_ids[start:start + self.album_size]
+            chunk_captions = captions[first + start:first + start + len(chunk)]
+            if len(chunk) == 1:
+                future = outbound.call(self.chat_id, 'send_photo', self.chat_id, chunk[0], caption=chunk_captions[0])
+            else:
+                media = [InputMediaPhoto(file_id, caption=caption) for file_id, caption in zip(chunk, chunk_captions)]
+                future = outbound.call(self.chat_id, 'send_media_group', self.chat_id, media)
+            future.add_done_callback(self._log_failure)
+        edit_status(f"Processing: {int(self.received / len(captions) * 100)}% complete "
+                    f"({self.received}/{len(captions)} pages)",
+                    self.chat_id, self.status_message_id)
+
+    def finish(self, ok, error=None):
+        if self.token.cancelled:
+            text = self.token.reason
+        elif ok:
+            text = "All pages have been sent!"
+        else:
+            text = error or "Error processing PDF. Please try again."
+        edit_status(text, self.chat_id, self.status_message_id)
+        conversions.finish(self.chat_id, self.token)
+
+    def _log_failure(self, future):
+        if future.exception() is not None:
+            log_message(f"Error fanning out pages to {self.chat_id}: {future.exception()}", "ERROR")
+
+class Flight:
+    """A render in progress; chats that ask for the same document meanwhile follow it"""
+
+    def __init__(self, key):
+        self.key = key
+        self.lock = threading.Lock()
+        self.captions = None
+        self.file_ids = []
+        self.followers = []
+        self.result = None  # True or False once finished
+        self.error = None  # message for followers when the leader failed, if not the generic one
+
+    def follow(self, fan_out):
+        with self.lock:
+            self.followers.append(fan_out)
+            if self.file_ids:
+                fan_out.send(self.file_ids, self.captions)
+            if self.result is not None:
+                fan_out.finish(self.result, self.error)
+
+    def publish(self, file_ids, captions, first=None):
+        """
+        Called by the leader with the file_ids of pages it has just delivered and
+        every page's caption. With first, file_ids start at that 0-based page and
+        the pages already published (by a leader before it) are skipped.
+        """
+        with self.lock:
+            if first is not None:
+                file_ids = file_ids[len(self.file_ids) - first:]
+            self.captions = captions
+            self.file_ids.extend(file_ids)
+            for fan_out in self.followers:
+                fan_out.send(file_ids, captions)
+
+    def hand_over(self):
+        """
+        Take the first follower whose copy was not cancelled out of the flight, to
+        lead the render after the leader was cancelled. Returns it with the
+        file_ids of the pages its chat already has, or (None, None).
+        """
+        with self.lock:
+            for fan_out in self.followers:
+                if not fan_out.token.cancelled:
+                    self.followers.remove(fan_out)
+                    sent_file_ids = fan_out.sent_file_ids + self.file_ids[fan_out.first_page:]
+                    return fan_out, sent_file_ids
+        return None, None
+
+    def finish(self, ok, error=None):
+        with self.lock:
+            self.result = ok
+            self.error = error
+            for fan_out in self.followers:
+                fan_out.finish(ok, error)
+            if self.followers:
+                log_message(f"Render of {self.key[:12]} fanned out to {len(self.followers)} more chats")
+
+class SingleFlight:
+    """
+    Registry of renders in progress, keyed like the render cache. The first
+    request for a key leads and does the work; later ones follow until the
+    leader finishes, by which time the render cache answers new requests.
+    A leader that is cancelled hands the render over to a follower
+    (Flight.hand_over), so one chat's /cancel never stops another's copy.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def join(self, key):
+        """Return (flight, True) for the leader or (flight, False) for a follower"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.flights[key] = Flight(key)
+            return flight, True
+
+    def finish(self, flight, ok, error=None):
+        with self.lock:
+            self.flights.pop(flight.key, None)
+        flight.finish(ok, error)
+
+single_flight = SingleFlight()
+metrics.gauge('pdfusion_flights', "Renders in progress that other chats can join",
+              func=lambda: len(single_flight.flights))
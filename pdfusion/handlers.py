@@ -0,0 +1,450 @@
+"""Handlers for PDF-to-images conversion and the general commands"""
+
+import os
+
+from pdfusion.cache import RenderCache, file_sha256, render_cache, render_settings
+from pdfusion.cancel import JobCancelled, cancellable, conversions
+from pdfusion.core import core, async_handler, api_call_async, reply_to_async
+from pdfusion.delivery import CachedFileRejected, page_upload, process_pdf_in_batches, send_cached_pages
+from pdfusion.downloads import download_file_in_chunks, download_telegram_file, probe_pdf_url
+from pdfusion.encoding import DEFAULT_PRESET, ENCODING_PRESETS, get_user_preset, preset_dpi, set_user_preset
+from pdfusion.flights import FanOut, single_flight
+from pdfusion.jobs import scheduler
+from pdfusion.log import log_message, safe_execution
+from pdfusion.memory import memory_budget
+from pdfusion.metrics import span
+from pdfusion.options import (DEFAULT_RENDER_OPTIONS, parse_caption_options, parse_render_options, request_preset,
+                              select_pages, wants_early_preview)
+from pdfusion.outbound import edit_status, reply_to
+from pdfusion.rendering import (estimate_page_bytes, get_pdf_info, inspect_document, record_render_timings,
+                                render_range_encoded)
+from pdfusion.telegram import message_handler
+from pdfusion.workspace import new_workspace, remove_workspace
+
+async def send_from_cache(cache_key, chat_id, status_message_id, sent_file_ids=(), token=None):
+    """
+    Replay a render cache hit for cache_key after the pages in sent_file_ids.
+    Returns (done, sent_file_ids): done once every page was sent, otherwise
+    the pages delivered so far, for a fresh render to continue after. An entry
+    Telegram rejects is dropped, so the next request renders afresh too.
+    The replay is checked against token between albums and raises JobCancelled.
+    """
+    cached = await core.run_io(render_cache.get, cache_key)
+    if cached is None:
+        return False, list(sent_file_ids)
+    try:
+        await send_cached_pages(chat_id, status_message_id, cached, sent_file_ids, token)
+    except CachedFileRejected as e:
+        log_message(f"Render cache entry rejected by Telegram, rendering again: {e}", "WARNING")
+        await core.run_io(render_cache.invalidate, cache_key)
+        return False, e.sent_file_ids
+    edit_status("All pages have been sent!", chat_id, status_message_id)
+    return True, list(sent_file_ids)
+
+@message_handler(commands=['process_url'])
+@async_handler
+async def handle_url_command(message):
+    log_message(f"Received URL command from user {message.from_user.id}")
+    words = message.text.split()
+    if len(words) < 2:
+        log_message(f"Invalid URL command format from user {message.from_user.id}", "WARNING")
+        await reply_to_async(message, "Please provide a URL after the /process_url command.\nExample: /process_url https://example.com/file.pdf")
+        return
+    try:
+        options = parse_render_options(words[2:])
+    except ValueError as e:
+        await reply_to_async(message, f"{e}\nExample: /process_url https://example.com/file.pdf 10-25")
+        return
+    await process_url(message, words[1], options=options)
+
+async def send_first_page_preview(pdf_path, total_pages, chat_id, preset_name=DEFAULT_PRESET):
+    """
+    Render and send page 1 of a partially downloaded linearized PDF; returns its file_id or None.
+    It renders at the DPI the full render would use and reserves its bitmap from the memory
+    budget like any batch; when the budget has nothing to spare, page 1 waits for the full render.
+    """
+    try:
+        log_message("First page is on disk, sending it before the download completes")
+        info = await core.run_io(get_pdf_info, pdf_path)
+        dpi = preset_dpi(info, preset_name)
+        reserved = memory_budget.acquire(estimate_page_bytes(info, dpi), blocking=False)
+        if not reserved:
+            log_message("No render memory to spare for an early first page", "DEBUG")
+            return None
+        try:
+            pages, timings = await core.run_cpu(render_range_encoded, pdf_path, 1, 1, dpi, preset_name)
+        finally:
+            memory_budget.release(reserved)
+        record_render_timings(timings)
+        data, extension = pages[0]
+        sent_message = await api_call_async(chat_id, 'send_photo', chat_id, page_upload(0, data, extension),
+                                            caption=f'Page 1 of {total_pages}')
+        return sent_message.photo[-1].file_id
+    except Exception as e:
+        log_message(f"Early first page render failed, continuing with full download: {e}", "WARNING")
+        return None
+
+def render_downloaded_pdf(scratch, pdf_path, chat_id, status_message_id, cache_key=None, sent_file_ids=None,
+                          preset_name=DEFAULT_PRESET, flight=None, options=None, token=None, inspection=None):
+    """
+    Render and send a PDF that is already on disk (runs as a scheduled job), then
+    remove its workspace. Chats following flight get the pages as they are sent;
+    if this request is cancelled, a follower takes over the render and the workspace.
+    """
+    file_ids = None
+    handed_over = False
+    try:
+        token.start_stage('render')
+        token.check()
+        file_ids = process_pdf_in_batches(pdf_path, chat_id, status_message_id, cache_key=cache_key,
+                                          sent_file_ids=sent_file_ids, preset_name=preset_name, flight=flight,
+                                          options=options, token=token, inspection=inspection)
+        if file_ids is not None:
+            edit_status("All pages have been sent!", chat_id, status_message_id)
+            log_message("Processing completed successfully")
+        return file_ids
+    except JobCancelled as e:
+        edit_status(str(e), chat_id, status_message_id)
+        handed_over = flight is not None and hand_over_render(
+            flight, scratch, pdf_path, cache_key=cache_key, preset_name=preset_name, options=options,
+            inspection=inspection)
+        raise
+    finally:
+        conversions.finish(chat_id, token)
+        if not handed_over:
+            if flight is not None:
+                single_flight.finish(flight, file_ids is not None)
+            remove_workspace(scratch)
+
+def hand_over_render(flight, scratch, pdf_path, options=None, inspection=None, **kwargs):
+    """
+    Queue the rest of a cancelled leader's render for the first follower still
+    waiting for it, which becomes the leader and owns the workspace from now on.
+    Returns False if no follower is left.
+    """
+    successor, sent_file_ids = flight.hand_over()
+    if successor is None:
+        return False
+    log_message(f"Leader of a render was cancelled, handing it over to chat {successor.chat_id}")
+    inspection = inspection or inspect_document(pdf_path)
+    cost = inspection.cost(select_pages(options or DEFAULT_RENDER_OPTIONS, inspection.pages))
+    scheduler.submit(successor.user_id, successor.chat_id, cost, 'handover', render_downloaded_pdf,
+                     scratch, pdf_path, successor.chat_id, successor.status_message_id,
+                     sent_file_ids=sent_file_ids, flight=flight, options=options, token=successor.token,
+                     inspection=inspection, **kwargs)
+    return True
+
+async def process_url(message, url, probe=None, options=DEFAULT_RENDER_OPTIONS):
+    """Download a PDF from a URL on the asyncio core, then queue it for rendering"""
+    try:
+        log_message(f"Processing URL request from user {message.from_user.id}: {url}")
+
+        if probe is None:
+            probe = await probe_pdf_url(url)
+        if probe is None:
+            log_message("Invalid PDF URL", "WARNING")
+            await reply_to_async(message, "The URL must point to a valid PDF file.")
+            return
+
+        status_message = await reply_to_async(message, "Starting download...")
+        log_message("Download started", "DEBUG")
+
+        scratch = new_workspace('url')
+        pdf_path = os.path.join(scratch, 'document.pdf')
+        token = conversions.start(message.chat.id)
+
+        preset_name = request_preset(options, message.from_user.id)
+        early_pages = []
+
+        async def on_first_page(path, total_pages):
+            file_id = await send_first_page_preview(path, total_pages, message.chat.id, preset_name)
+            if file_id is not None:
+                early_pages.append(file_id)
+
+        async def download():
+            last_reported = -1
+            with span('download'):
+                async for downloaded, total_size in download_file_in_chunks(
+                        url, pdf_path, probe, on_first_page if wants_early_preview(options) else None):
+                    progress = (downloaded / total_size * 100) if total_size else 0
+                    if int(progress // 10) > last_reported:  # Update every 10%
+                        last_reported = int(progress // 10)
+                        edit_status(
+                            f"Downloading: {progress:.1f}% ({downloaded/(1024*1024):.1f}MB / {total_size/(1024*1024):.1f}MB)",
+                            message.chat.id,
+                            status_message.message_id
+                        )
+
+        queued = following = False
+        flight = None
+        try:
+            token.start_stage('download')
+            await cancellable(download(), token)
+
+            digest = await core.run_io(file_sha256, pdf_path)
+            cache_key = RenderCache.make_key(f"sha256:{digest}", render_settings(preset_name, options))
+            done, early_pages = await send_from_cache(cache_key, message.chat.id, status_message.message_id,
+                                                      early_pages, token)
+            if done:
+                return
+
+            edit_status(
+                "Download complete. Processing PDF...",
+                message.chat.id,
+                status_message.message_id
+            )
+            leader_flight, leader = single_flight.join(cache_key)
+            if not leader:
+                log_message("Document is already being rendered, following that render")
+                following = True
+                leader_flight.follow(FanOut(message.chat.id, status_message.message_id, early_pages,
+                                            token=token, user_id=message.from_user.id))
+                return
+            flight = leader_flight
+
+            inspection = await core.run_io(inspect_document, pdf_path)
+            try:
+                pages = select_pages(options, inspection.pages)
+            except ValueError as e:
+                edit_status(f"{e} Nothing was converted.", message.chat.id, status_message.message_id)
+                return
+            cost = inspection.cost(pages)
+            # Queued even if cancelled meanwhile: the job hands the render over to any follower.
+            log_message("Download completed, queueing PDF for rendering")
+            scheduler.submit(message.from_user.id, message.chat.id, cost, 'url', render_downloaded_pdf,
+                             scratch, pdf_path, message.chat.id, status_message.message_id,
+                             cache_key=cache_key, sent_file_ids=early_pages, preset_name=preset_name,
+                             flight=flight, options=options, token=token, inspection=inspection)
+            queued = True
+
+        except JobCancelled as e:
+            log_message(f"URL request from user {message.from_user.id} stopped: {e}")
+            edit_status(str(e), message.chat.id, status_message.message_id)
+        except Exception as e:
+            log_message(f"Error during processing: {str(e)}", "ERROR")
+            edit_status(
+                f"Error processing file: {str(e)}",
+                message.chat.id,
+                status_message.message_id
+            )
+        finally:
+            # Once queued, the job owns the workspace, the flight and the token; a fan-out owns a follower's token.
+            if not queued:
+                if flight is not None:
+                    single_flight.finish(flight, False)
+                if not following:
+                    conversions.finish(message.chat.id, token)
+                remove_workspace(scratch)
+
+    except Exception as e:
+        log_message(f"General error: {str(e)}", "ERROR")
+        await reply_to_async(message, f"An error occurred: {str(e)}")
+
+@message_handler(content_types=['document'])
+@async_handler
+async def handle_pdf(message):
+    try:
+        log_message(f"Received document from user {message.from_user.id}")
+
+        if not message.document.file_name.endswith('.pdf'):
+            log_message("Non-PDF file received", "WARNING")
+            await reply_to_async(message, "Please send a PDF file.")
+            return
+
+        file_size_mb = message.document.file_size / (1024 * 1024)
+        log_message(f"File size: {file_size_mb:.2f}MB")
+
+        if message.document.file_size > 20 * 1024 * 1024:
+            log_message("File too large for direct upload", "WARNING")
+            await reply_to_async(message,
+                "This file is larger than 20MB. Please upload it to a file hosting service "
+                "and send me the direct download link using the /process_url command.\n\n"
+                "Example: /process_url https://example.com/file.pdf")
+            return
+
+        try:
+            options = parse_caption_options(message.caption)
+        except ValueError as e:
+            await reply_to_async(message, f"{e}\nSend the PDF again with a caption such as: pages=10-25")
+            return
+
+        await convert_document(message, options)
+
+    except Exception as e:
+        log_message(f"Error in handle_pdf: {str(e)}", "ERROR")
+        await reply_to_async(message, f"An error occurred: {str(e)}")
+
+async def convert_document(message, options=DEFAULT_RENDER_OPTIONS):
+    """Fetch a PDF sent as a Telegram document on the asyncio core, then queue it for rendering"""
+    status_message = await reply_to_async(message, "Processing PDF...")
+
+    preset_name = request_preset(options, message.from_user.id)
+    cache_key = RenderCache.make_key(f"tg:{message.document.file_unique_id}", render_settings(preset_name, options))
+    token = conversions.start(message.chat.id)
+    done = True  # a replay that raises ends the request as well
+    try:
+        done, sent_file_ids = await send_from_cache(cache_key, message.chat.id, status_message.message_id,
+                                                    token=token)
+    except JobCancelled as e:
+        log_message(f"Document from user {message.from_user.id} stopped: {e}")
+        edit_status(str(e), message.chat.id, status_message.message_id)
+    finally:
+        if done:
+            conversions.finish(message.chat.id, token)
+    if done:
+        return
+
+    flight, leader = single_flight.join(cache_key)
+    if not leader:
+        log_message("Document is already being rendered, following that render")
+        flight.follow(FanOut(message.chat.id, status_message.message_id, sent_file_ids, token=token,
+                             user_id=message.from_user.id))
+        return
+
+    scratch = new_workspace('document')
+    pdf_path = os.path.join(scratch, 'document.pdf')
+    user_id, chat_id, status_message_id = message.from_user.id, message.chat.id, status_message.message_id
+    queued = False
+    try:
+        while True:
+            try:
+                log_message("Downloading file from Telegram", "DEBUG")
+                token.start_stage('download')
+                await cancellable(download_telegram_file(message.document.file_id, pdf_path), token)
+                break
+            except JobCancelled as e:
+                log_message(f"Document from user {user_id} stopped: {e}")
+                edit_status(str(e), chat_id, status_message_id)
+                conversions.finish(chat_id, token)
+                # file_id works for any chat, so a follower can download the document itself.
+                successor, successor_file_ids = flight.hand_over()
+                if successor is None:
+                    return
+                log_message(f"Handing the download over to chat {successor.chat_id}")
+                user_id, chat_id, status_message_id = successor.user_id, successor.chat_id, successor.status_message_id
+                token, sent_file_ids = successor.token, successor_file_ids
+        log_message("File downloaded successfully", "DEBUG")
+
+        inspection = await core.run_io(inspect_document, pdf_path)
+        try:
+            pages = select_pages(options, inspection.pages)
+        except ValueError as e:
+            edit_status(f"{e} Nothing was converted.", chat_id, status_message_id)
+            return
+        cost = inspection.cost(pages)
+        # Queued even if cancelled meanwhile: the job hands the render over to any follower.
+        scheduler.submit(user_id, chat_id, cost, 'pdf', render_downloaded_pdf,
+                         scratch, pdf_path, chat_id, status_message_id,
+                         cache_key=cache_key, sent_file_ids=sent_file_ids, preset_name=preset_name, flight=flight,
+                         options=options, token=token, inspection=inspection)
+        queued = True
+    except Exception as e:
+        log_message(f"Error fetching document for user {user_id}: {e}", "ERROR")
+        edit_status(f"Error processing PDF: {str(e)}", chat_id, status_message_id)
+    finally:
+        # Once queued, the job owns the workspace, the flight and the token.
+        if not queued:
+            single_flight.finish(flight, False)
+            conversions.finish(chat_id, token)
+            remove_workspace(scratch)
+
+@message_handler(commands=['start'])
+@safe_execution
+def send_welcome(message):
+    log_message(f"New user started bot: {message.from_user.id}")
+    welcome_text = """
+🔥 PDF Tools Bot – Your Ultimate PDF Assistant!🔥  
+
+📌 Features:
+
+📂 Convert PDF to Images:
+✅ Upload PDFs (Max: 20MB)📤  
+✅ Use /process_url for larger files 🌐
+✅ Pick pages or a preview mode after the link or in the PDF's caption: pages=10-25 | thumbs | sheet 🔎
+
+🖼️ Convert Images to PDF:  
+1️⃣ Start with /start_create_pdf 🏁  
+2️⃣ Send images 📸 & optionally specify page numbers 🔢  
+3️⃣ Finish with /done to get your PDF 🎉  
+4️⃣ Cancel anytime with /cancel_create_pdf ❌  
+
+📝 Convert Text to PDF:
+1️⃣ Begin with /start_text_pdf ✍️  
+2️⃣ Send your text messages (multiple messages allowed) 💬  
+3️⃣ Type /done_text_pdf to generate your PDF 📜  
+4️⃣ Cancel with /cancel_text_pdf ❌  
+
+
+💡 ommands:
+/start | /help | /process_url | /start_create_pdf | /done | /cancel_create_pdf  
+/start_text_pdf | /done_text_pdf | /cancel_text_pdf | /preset | /cancel  
+
+Enjoy seamless PDF management! 🚀
+"""
+    reply_to(message, welcome_text)
+
+@message_handler(commands=['help'])
+@safe_execution
+def send_help(message):
+    log_message(f"Help command requested by user {message.from_user.id}")
+    help_text = """
+🔥 PDF Tools Bot – Your Ultimate PDF Assistant!🔥  
+
+📌 Features:
+
+📂 Convert PDF to Images:
+✅ Upload PDFs (Max: 20MB)📤  
+✅ Use /process_url for larger files 🌐
+✅ Pick pages or a preview mode after the link or in the PDF's caption: pages=10-25 | thumbs | sheet 🔎
+
+🖼️ Convert Images to PDF:  
+1️⃣ Start with /start_create_pdf 🏁  
+2️⃣ Send images 📸 & optionally specify page numbers 🔢  
+3️⃣ Finish with /done to get your PDF 🎉  
+4️⃣ Cancel anytime with /cancel_create_pdf ❌  
+
+📝 Convert Text to PDF:
+1️⃣ Begin with /start_text_pdf ✍️  
+2️⃣ Send your text messages (multiple messages allowed) 💬  
+3️⃣ Type /done_text_pdf to generate your PDF 📜  
+4️⃣ Cancel with /cancel_text_pdf ❌  
+
+
+💡 ommands:
+/start | /help | /process_url | /start_create_pdf | /done | /cancel_create_pdf  
+/start_text_pdf | /done_text_pdf | /cancel_text_pdf | /preset | /cancel  
+
+Enjoy seamless PDF management! 🚀
+"""
+    reply_to(message, help_text)
+
+@message_handler(commands=['preset'])
+@safe_execution
+def choose_preset(message):
+    user_id = message.from_user.id
+    parts = message.text.split()
+    if len(parts) < 2:
+        options = "\n".join(
+            f"{name}: up to {preset['max_side']}px, ~{preset['target_bytes'] // 1024}KB per page"
+            for name, preset in ENCODING_PRESETS.items()
+        )
+        reply_to(message, f"Current image preset: {get_user_preset(user_id)}\n\n{options}\n\nExample: /preset small")
+        return
+    name = parts[1].lower()
+    if name not in ENCODING_PRESETS:
+        reply_to(message, f"Unknown preset. Choose one of: {', '.join(ENCODING_PRESETS)}")
+        return
+    set_user_preset(user_id, name)
+    log_message(f"User {user_id} selected preset {name}")
+    reply_to(message, f"Image preset set to {name}.")
+
+@message_handler(commands=['cancel'])
+@safe_execution
+def cancel_conversions(message):
+    """Stop every download and conversion running for this chat; each cleans up at its next page or chunk"""
+    cancelled = conversions.cancel_chat(message.chat.id)
+    if cancelled:
+        log_message(f"User {message.from_user.id} cancelled {cancelled} conversions")
+        reply_to(message, "Cancelling your conversion..." if cancelled == 1 else f"Cancelling your {cancelled} conversions...")
+    else:
+        reply_to(message, "No conversion is running.")
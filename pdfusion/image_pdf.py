@@ -0,0 +1,300 @@
+"""Image-to-PDF: collect photos in a session and send them back as one PDF"""
+
+import asyncio
+import contextlib
+import io
+import itertools
+import os
+
+from pdfusion import telegram
+from pdfusion.cancel import CancelToken, JobCancelled, conversions
+from pdfusion.core import core
+from pdfusion.downloads import download_telegram_file
+from pdfusion.jobs import scheduler
+from pdfusion.lazy import lazy_import
+from pdfusion.log import log_message, safe_execution
+from pdfusion.metrics import span
+from pdfusion.outbound import api_call, reply_to
+from pdfusion.sessions import SessionFull, SessionStore
+from pdfusion.telegram import message_handler
+from pdfusion.workspace import new_workspace, remove_workspace
+
+Image = lazy_import('PIL.Image')
+
+# ---------------------------
+# New Code: Image to PDF Creation
+# ---------------------------
+IMAGE_SESSION_MAX_BYTES = 50 * 1024 * 1024
+ESTIMATED_PHOTO_BYTES = 200 * 1024  # size assumed for a photo that is still downloading
+
+IMAGE_DOWNLOAD_WORKERS = int(os.environ.get('PDFUSION_IMAGE_DOWNLOAD_WORKERS', 8))
+image_download_slots = asyncio.Semaphore(IMAGE_DOWNLOAD_WORKERS)
+_image_counter = itertools.count()
+
+async def download_session_image(file_id, path):
+    """Fetch one session photo from Telegram to path, at most IMAGE_DOWNLOAD_WORKERS at a time"""
+    async with image_download_slots:
+        return await download_telegram_file(file_id, path)
+
+def new_image_session():
+    """An empty session with its own workspace, which holds its photos and later the PDF"""
+    return {'workspace': new_workspace('images'), 'images': []}
+
+def start_image_download(session, file_id):
+    """Start downloading a photo into the session's workspace as soon as it arrives, so /done only has to assemble the PDF"""
+    path = os.path.join(session['workspace'], f"image_{next(_image_counter)}.jpg")
+    download = core.submit(download_session_image(file_id, path))
+    download.path = path
+    return download
+
+def _remove_downloaded_image(download):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(download.path)
+
+def discard_image_download(download):
+    """Cancel a download and delete whatever it has written so far"""
+    download.cancel()
+    download.add_done_callback(_remove_downloaded_image)
+
+def stop_session_downloads(session):
+    for info in session['images']:
+        info['download'].cancel()
+
+def discard_image_session(session):
+    """Stop the session's downloads and remove its workspace with every photo in it"""
+    stop_session_downloads(session)
+    remove_workspace(session['workspace'])
+
+def image_session_size(session):
+    """Bytes held by an image session: downloaded files, or an estimate while downloading"""
+    total = 0
+    for info in session['images']:
+        download = info['download']
+        if download.done() and not download.cancelled() and download.exception() is None:
+            try:
+                total += os.path.getsize(download.result())
+                continue
+            except OSError:
+                pass
+        total += ESTIMATED_PHOTO_BYTES
+    return total
+
+def serialize_image_session(session):
+    return [{'file_id': info['file_id'], 'page_number': info['page_number']} for info in session['images']]
+
+def deserialize_image_session(chat_id, data):
+    """Restore a persisted session; the local files are gone, so downloads start again in a new workspace"""
+    session = new_image_session()
+    session['images'] = [dict(info, download=start_image_download(session, info['file_id'])) for info in data]
+    return session
+
+# Session store keeping track of PDF creation sessions for images.
+# Key: chat_id, Value: {'workspace': scratch directory, 'images': list of image info dictionaries}, each
+# {'file_id': ..., 'page_number': ..., 'download': Future resolving to the local image path}
+pdf_creation_sessions = SessionStore('image', IMAGE_SESSION_MAX_BYTES, image_session_size,
+                                     serialize_image_session, deserialize_image_session,
+                                     on_evict=discard_image_session)
+
+def _pdf_object(out, offsets, body, stream=None):
+    """Write the next numbered object and remember its byte offset for the xref table"""
+    offsets.append(out.tell())
+    out.write(f"{len(offsets)} 0 obj\n".encode('ascii'))
+    out.write(body.encode('ascii'))
+    if stream is not None:
+        out.write(b"\nstream\n")
+        out.write(stream)
+        out.write(b"\nendstream")
+    out.write(b"\nendobj\n")
+
+def _jpeg_for_pdf(path):
+    """
+    Return (jpeg_bytes, width, height, color_space, decode) for an image file.
+    JPEG files are passed through untouched; only the header is parsed. Other
+    formats are converted to JPEG once.
+    """
+    with Image.open(path) as image:
+        width, height = image.size
+        if image.format == 'JPEG' and image.mode in ('L', 'RGB', 'CMYK'):
+            color_space = {'L': '/DeviceGray', 'RGB': '/DeviceRGB', 'CMYK': '/DeviceCMYK'}[image.mode]
+            # Adobe CMYK JPEGs store inverted values.
+            decode = ' /Decode [1 0 1 0 1 0 1 0]' if image.mode == 'CMYK' and 'adobe' in image.info else ''
+            with open(path, 'rb') as f:
+                return f.read(), width, height, color_space, decode
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, 'JPEG', quality=95)
+        return buffer.getvalue(), width, height, '/DeviceRGB', ''
+
+def write_jpeg_pdf(pdf_path, image_paths, resolution=100.0):
+    """
+    Write a PDF with one image per page, embedding the JPEG data as-is
+    (/DCTDecode) instead of decoding and re-encoding it. Pages are written as
+    they are read, so only one image is in memory at a time.
+    Page size follows the image size at the given resolution, as Pillow's PDF writer does.
+    """
+    count = len(image_paths)
+    offsets = []
+    with open(pdf_path, 'wb') as out:
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        # Objects 1 and 2 are the catalog and page tree; each image then gets page, image and content objects.
+        kids = ' '.join(f"{3 + 3 * i} 0 R" for i in range(count))
+        _pdf_object(out, offsets, "<< /Type /Catalog /Pages 2 0 R >>")
+        _pdf_object(out, offsets, f"<< /Type /Pages /Kids [{kids}] /Count {count} >>")
+        for i, path in enumerate(image_paths):
+            data, width, height, color_space, decode = _jpeg_for_pdf(path)
+            page_obj = 3 + 3 * i
+            page_width, page_height = width * 72.0 / resolution, height * 72.0 / resolution
+            _pdf_object(out, offsets,
+                        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+                        f"/Resources << /XObject << /Im0 {page_obj + 1} 0 R >> >> /Contents {page_obj + 2} 0 R >>")
+            _pdf_object(out, offsets,
+                        f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                        f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode{decode} /Length {len(data)} >>",
+                        data)
+            content = f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q".encode('ascii')
+            _pdf_object(out, offsets, f"<< /Length {len(content)} >>", content)
+
+        xref_offset = out.tell()
+        out.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode('ascii'))
+        for offset in offsets:
+            out.write(f"{offset:010d} 00000 n \n".encode('ascii'))
+        out.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+
+@message_handler(commands=['start_create_pdf'])
+@safe_execution
+def start_create_pdf(message):
+    chat_id = message.chat.id
+    if chat_id in pdf_creation_sessions:
+        discard_image_session(pdf_creation_sessions.pop(chat_id))
+    pdf_creation_sessions[chat_id] = new_image_session()
+    api_call(chat_id, 'send_message', chat_id, "Image-to-PDF session started.\nPlease send me the image you want to add to your PDF.")
+    telegram.bot.register_next_step_handler(message, process_image_for_pdf)
+
+@safe_execution
+def process_image_for_pdf(message):
+    chat_id = message.chat.id
+    if chat_id not in pdf_creation_sessions:
+        return
+
+    # Allow finishing the session by sending '/done'
+    if message.content_type == 'text' and message.text.strip() == '/done':
+        finish_pdf_creation(message)
+        return
+
+    if message.content_type != 'photo':
+        msg = api_call(chat_id, 'send_message', chat_id, "That doesn't look like a photo. Please send an image (or type /done to finish).")
+        telegram.bot.register_next_step_handler(msg, process_image_for_pdf)
+        return
+
+    file_id = message.photo[-1].file_id
+    download = start_image_download(pdf_creation_sessions[chat_id], file_id)
+    msg = api_call(chat_id, 'send_message', chat_id, "Enter the page number for this image (or type 'skip' for default order, or /done to finish):")
+    telegram.bot.register_next_step_handler(msg, process_page_number, file_id, download)
+
+@safe_execution
+def process_page_number(message, file_id, download):
+    chat_id = message.chat.id
+    if message.text.strip() == '/done':
+        discard_image_download(download)
+        finish_pdf_creation(message)
+        return
+
+    text = message.text.strip()
+    page_number = None
+    if text.lower() != 'skip':
+        try:
+            page_number = int(text)
+        except ValueError:
+            api_call(chat_id, 'send_message', chat_id, "Invalid input for page number. The image will use the default order.")
+            page_number = None
+
+    if chat_id not in pdf_creation_sessions:
+        discard_image_download(download)
+        return
+    try:
+        pdf_creation_sessions.check_room(chat_id, ESTIMATED_PHOTO_BYTES)
+    except SessionFull:
+        discard_image_download(download)
+        msg = api_call(chat_id, 'send_message', chat_id, "This PDF has reached the maximum size. Type /done to create it.")
+        telegram.bot.register_next_step_handler(msg, process_image_for_pdf)
+        return
+    pdf_creation_sessions[chat_id]['images'].append({'file_id': file_id, 'page_number': page_number, 'download': download})
+    pdf_creation_sessions.touch(chat_id)
+    msg = api_call(chat_id, 'send_message', chat_id, "Image added. Send another image or type /done to finish PDF creation.")
+    telegram.bot.register_next_step_handler(msg, process_image_for_pdf)
+
+@message_handler(commands=['done'])
+@safe_execution
+def finish_pdf_creation(message):
+    chat_id = message.chat.id
+    if chat_id not in pdf_creation_sessions or len(pdf_creation_sessions[chat_id]['images']) == 0:
+        reply_to(message, "No images received for PDF creation. Start with /start_create_pdf.")
+        return
+    api_call(chat_id, 'send_message', chat_id, "Finishing image-to-PDF creation. Please wait...")
+    session = pdf_creation_sessions.pop(chat_id)
+    token = conversions.start(chat_id)
+    scheduler.submit(message.from_user.id, chat_id, len(session['images']), 'image_pdf', build_image_pdf, chat_id,
+                     session, token=token)
+
+def build_image_pdf(chat_id, session, token=None):
+    """
+    Collect the downloaded session images and send them back as one PDF (runs as a scheduled job).
+    The session's workspace is removed when the job ends, whatever the outcome.
+    """
+    token = token or CancelToken()
+    token.start_stage('render')
+    # Cancelling stops the downloads still running; the images on disk go with the workspace.
+    unregister = token.on_cancel(lambda: stop_session_downloads(session))
+    images_info_sorted = sorted(session['images'], key=lambda info: info['page_number'] if info['page_number'] is not None else float('inf'))
+
+    image_paths = []
+    try:
+        for info in images_info_sorted:
+            try:
+                image_paths.append(info['download'].result())
+            except Exception as e:
+                token.check()
+                log_message(f"Error downloading image for PDF: {str(e)}", "ERROR")
+                api_call(chat_id, 'send_message', chat_id, f"Error processing one of the images: {str(e)}")
+
+        token.check()
+        if len(image_paths) == 0:
+            api_call(chat_id, 'send_message', chat_id, "No valid images were received to create a PDF.")
+            return
+
+        pdf_path = os.path.join(session['workspace'], 'created.pdf')
+        with span('encode'):
+            write_jpeg_pdf(pdf_path, image_paths, resolution=100.0)
+        token.check()
+        with open(pdf_path, 'rb') as pdf_file, span('upload'):
+            api_call(chat_id, 'send_document', chat_id, pdf_file, caption="Here is your image PDF file.")
+        log_message(f"PDF created and sent to user {chat_id}")
+    except JobCancelled as e:
+        api_call(chat_id, 'send_message', chat_id, str(e))
+        raise
+    except Exception as e:
+        log_message(f"Error creating PDF: {str(e)}", "ERROR")
+        api_call(chat_id, 'send_message', chat_id, f"Error creating PDF: {str(e)}")
+    finally:
+        unregister()
+        conversions.finish(chat_id, token)
+        discard_image_session(session)
+
+@message_handler(commands=['cancel_create_pdf'])
+@safe_execution
+def cancel_pdf_creation(message):
+    chat_id = message.chat.id
+    if chat_id in pdf_creation_sessions:
+        discard_image_session(pdf_creation_sessions.pop(chat_id))
+        reply_to(message, "Image-to-PDF session cancelled.")
+    else:
+        reply_to(message, "No active image-to-PDF session found.")
+
+@message_handler(content_types=['photo'])
+@safe_execution
+def handle_photo_in_general(message):
+    chat_id = message.chat.id
+    if chat_id not in pdf_creation_sessions:
+        reply_to(message, "To create a PDF from images, please start a session with /start_create_pdf.")
+    else:
+        # A session restored after a restart has lost its next-step handler.
+        process_image_for_pdf(message)
@@ -0,0 +1,251 @@
+"""The job scheduler that runs conversions with per-user fairness and concurrency caps"""
+
+import contextvars
+import os
+import threading
+import time
+
+from pdfusion.cancel import JobCancelled
+from pdfusion.log import log_message
+from pdfusion.memory import memory_budget
+from pdfusion.metrics import metrics, Trace, current_trace, job_seconds, job_wait_seconds
+from pdfusion.outbound import edit_status, outbound
+
+# ---------------------------
+# Job scheduler: per-user fairness and concurrency caps for conversions
+# ---------------------------
+MAX_CONCURRENT_JOBS = int(os.environ.get('PDFUSION_MAX_JOBS', 4))
+MAX_JOBS_PER_USER = int(os.environ.get('PDFUSION_MAX_JOBS_PER_USER', 1))
+
+class Job:
+    """A queued conversion; cost is its estimated size in A4 pages and token the func's token argument, if any"""
+
+    def __init__(self, user_id, chat_id, cost, name, func, args, kwargs):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.cost = max(1, cost)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.token = kwargs.get('token')
+        self.finish_tag = 0.0
+        self.queue_message_id = None
+        self.last_position = None
+        self.started = False
+        # The job runs in the submitter's context, so spans land in the submitter's trace.
+        self.context = contextvars.copy_context()
+        self.submitted = time.perf_counter()
+
+class JobScheduler:
+    """
+    Runs jobs on MAX_CONCURRENT_JOBS worker threads with at most
+    MAX_JOBS_PER_USER running per user. Waiting jobs are ordered by weighted
+    fair queuing: every job gets a virtual finish time of
+    max(virtual clock, user's previous finish) + cost, and the smallest runnable
+    tag goes next. A user's fifth large PDF therefore queues behind their own
+    earlier jobs, while a one-page job from someone else starts almost at once.
+    A user's finish tag is forgotten once the virtual clock passes it (the
+    max() makes it irrelevant from then on), and every tag when the queue
+    drains, so user_finish only holds users with recent work.
+    """
+
+    def __init__(self, max_concurrent, max_per_user):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.running = 0
+        self.running_per_user = {}
+        self.virtual_time = 0.0
+        self.user_finish = {}
+        self.closed_reason = None  # set by close(): new jobs are cancelled as they arrive
+        self.cleaning = 0  # cancelled jobs taken off the queue whose cleanup is still running
+        self.started = False
+
+    def _ensure_started_locked(self):
+        if self.started:
+            return
+        self.started = True
+        for i in range(self.max_concurrent):
+            threading.Thread(target=self._worker, name=f"job-{i}", daemon=True).start()
+
+    def submit(self, user_id, chat_id, cost, name, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) as a job and tell the user if it has to wait.
+        Never blocks on Telegram: it is called from the asyncio core.
+        """
+        job = Job(user_id, chat_id, cost, name, func, args, kwargs)
+        with self.cond:
+            self._ensure_started_locked()
+            start_tag = max(self.virtual_time, self.user_finish.get(user_id, 0.0))
+            job.finish_tag = start_tag + job.cost
+            self.user_finish[user_id] = job.finish_tag
+            self.waiting.append(job)
+            must_wait = (self.running >= self.max_concurrent
+                         or self.running_per_user.get(user_id, 0) >= self.max_per_user)
+            self.cond.notify()
+        log_message(f"Queued {name} job for user {user_id} (cost {job.cost:.1f})", "DEBUG")
+        if job.token is not None:
+            # A cancelled job leaves the queue at once, so its files do not wait for a free worker.
+            job.token.on_cancel(self.wake)
+            if self.closed_reason is not None:
+                job.token.cancel(self.closed_reason)
+        if must_wait:
+            position = self.position(job)
+            if position is not None:
+                job.last_position = position
+                future = outbound.call(chat_id, 'send_message', chat_id,
+                                       f"The server is busy. Your request is queued at position {position}.")
+                future.add_done_callback(lambda future: self._queue_message_sent(job, future))
+        return job
+
+    def _queue_message_sent(self, job, future):
+        """Remember the queue message for position updates; if the job already started, say so now"""
+        error = future.exception()
+        if error is not None:
+            log_message(f"Could not send the queue position to chat {job.chat_id}: {error}", "WARNING")
+            return
+        with self.cond:
+            job.queue_message_id = future.result().message_id
+            started = job.started
+        if started:
+            edit_status(self._start_notice(job), job.chat_id, job.queue_message_id)
+
+    @staticmethod
+    def _start_notice(job):
+        cancelled = job.token is not None and job.token.cancelled
+        return job.token.reason if cancelled else "Your request has started."
+
+    def close(self, reason):
+        """Stop taking work (at shutdown): jobs submitted from now on are cancelled with reason"""
+        with self.cond:
+            self.closed_reason = reason
+
+    def wait_idle(self, timeout):
+        """Wait until no job is queued or running; returns False if that took longer than timeout seconds"""
+        # Polls rather than waiting on cond, so it never takes a wake-up meant for a worker.
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.cond:
+                if not self.waiting and not self.running and not self.cleaning:
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+
+    def position(self, job):
+        """1-based position of a waiting job, or None once it has started"""
+        with self.cond:
+            ordered = sorted(self.waiting, key=lambda j: j.finish_tag)
+        for i, queued in enumerate(ordered):
+            if queued is job:
+                return i + 1
+        return None
+
+    def wake(self):
+        """
+        Re-check waiting jobs, e.g. after memory was returned to the budget or a
+        queued job was cancelled. Cancelled jobs only clean up, so they leave the
+        queue at once and run on a thread of their own rather than wait until a
+        worker is free, which could take as long as the render deadline.
+        """
+        with self.cond:
+            cancelled = [job for job in self.waiting if job.token is not None and job.token.cancelled]
+            for job in cancelled:
+                self.waiting.remove(job)
+                job.started = True
+            self.cleaning += len(cancelled)
+            self.cond.notify_all()
+        if cancelled:
+            threading.Thread(target=self._clean_up, args=(cancelled,), name="job-cleanup", daemon=True).start()
+
+    def _clean_up(self, jobs):
+        for job in jobs:
+            try:
+                if job.queue_message_id is not None:
+                    edit_status(self._start_notice(job), job.chat_id, job.queue_message_id)
+                job.context.run(self._run, job)
+            finally:
+                with self.cond:
+                    self.cleaning -= 1
+        self._announce_positions()
+
+    def _pick_locked(self):
+        if self.running >= self.max_concurrent:
+            return None
+        if self.running and memory_budget.exhausted():
+            # Backpressure: let running jobs drain the memory budget first.
+            return None
+        runnable = [job for job in self.waiting if self.running_per_user.get(job.user_id, 0) < self.max_per_user]
+        if not runnable:
+            return None
+        job = min(runnable, key=lambda j: j.finish_tag)
+        self.waiting.remove(job)
+        job.started = True
+        self.virtual_time = max(self.virtual_time, job.finish_tag - job.cost)
+        for user_id in [u for u, tag in self.user_finish.items() if tag <= self.virtual_time]:
+            del self.user_finish[user_id]
+        self.running += 1
+        self.running_per_user[job.user_id] = self.running_per_user.get(job.user_id, 0) + 1
+        return job
+
+    def _announce_positions(self):
+        """Update the queue message of every waiting job whose position changed"""
+        with self.cond:
+            ordered = sorted(self.waiting, key=lambda j: j.finish_tag)
+        for i, job in enumerate(ordered):
+            if job.queue_message_id is not None and job.last_position != i + 1:
+                job.last_position = i + 1
+                edit_status(f"The server is busy. Your request is queued at position {i + 1}.",
+                            job.chat_id, job.queue_message_id)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                job = self._pick_locked()
+                while job is None:
+                    self.cond.wait()
+                    job = self._pick_locked()
+                # Read under the lock: a queue message that arrives later is updated by _queue_message_sent.
+                queue_message_id = job.queue_message_id
+            if queue_message_id is not None:
+                edit_status(self._start_notice(job), job.chat_id, queue_message_id)
+            self._announce_positions()
+            try:
+                job.context.run(self._run, job)
+            finally:
+                with self.cond:
+                    self.running -= 1
+                    self.running_per_user[job.user_id] -= 1
+                    if not self.running_per_user[job.user_id]:
+                        del self.running_per_user[job.user_id]
+                    if not self.running and not self.waiting:
+                        # Idle: move the clock past every tag, which makes them all irrelevant.
+                        self.virtual_time = max(self.user_finish.values(), default=self.virtual_time)
+                        self.user_finish.clear()
+                    self.cond.notify_all()
+
+    def _run(self, job):
+        trace = current_trace.get()
+        if trace is None:
+            trace = Trace()
+            current_trace.set(trace)
+        start = time.perf_counter()
+        job_wait_seconds.observe(start - job.submitted, job=job.name)
+        try:
+            log_message(f"Starting {job.name} job for user {job.user_id}", "DEBUG")
+            job.func(*job.args, **job.kwargs)
+        except JobCancelled as e:
+            log_message(f"Cancelled {job.name} job for user {job.user_id}: {e}")
+        except Exception as e:
+            log_message(f"Error in {job.name} job: {e}", level="ERROR")
+        finally:
+            elapsed = time.perf_counter() - start
+            job_seconds.observe(elapsed, job=job.name)
+            log_message(f"Finished {job.name} job for user {job.user_id} in {elapsed:.2f}s ({trace.summary()})")
+
+scheduler = JobScheduler(MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER)
+memory_budget.listeners.append(scheduler.wake)
+metrics.gauge('pdfusion_jobs_waiting', "Jobs queued in the scheduler", func=lambda: len(scheduler.waiting))
+metrics.gauge('pdfusion_jobs_running', "Jobs running in the scheduler", func=lambda: scheduler.running)
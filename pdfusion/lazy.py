@@ -0,0 +1,38 @@
+"""Deferred imports: heavy libraries load on first use of the feature that needs them"""
+
+import importlib
+import threading
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, then imports it.
+    Unlike importlib.util.LazyLoader this is safe when several threads make the
+    first access at once: the import runs under a lock and the others wait.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Import the module now (if not done yet) and return it"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
+
+def lazy_import(name):
+    """Return a LazyModule for name, e.g. `Image = lazy_import('PIL.Image')`"""
+    return LazyModule(name)
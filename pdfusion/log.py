@@ -0,0 +1,70 @@
+"""Levelled logging through a background writer thread, and the error-logging handler decorator"""
+
+import atexit
+import os
+import sys
+import threading
+from datetime import datetime
+from queue import Queue, Full
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('PDFUSION_LOG_LEVEL', 'INFO').upper(), LOG_LEVELS['INFO'])
+LOG_QUEUE_SIZE = 10000
+
+_log_queue = Queue(maxsize=LOG_QUEUE_SIZE)
+_dropped_log_lines = 0
+_writer_started = False
+_writer_lock = threading.Lock()
+
+def _log_writer():
+    """Write queued log lines to stdout, flushing whenever the queue runs empty"""
+    while True:
+        line = _log_queue.get()
+        sys.stdout.write(line)
+        if _log_queue.empty():
+            sys.stdout.flush()
+        _log_queue.task_done()
+
+def _start_writer():
+    """Start the writer thread with the first line logged, so importing the package starts no threads"""
+    global _writer_started
+    with _writer_lock:
+        if not _writer_started:
+            threading.Thread(target=_log_writer, name="log-writer", daemon=True).start()
+            atexit.register(_log_queue.join)
+            _writer_started = True
+
+def log_message(message, level="INFO"):
+    """
+    Log message with timestamp and level.
+    Levels below PDFUSION_LOG_LEVEL are dropped; other lines are written by a
+    background thread, so callers never wait on stdout. If the writer falls
+    LOG_QUEUE_SIZE lines behind, new lines are dropped and counted.
+    """
+    global _dropped_log_lines
+    if LOG_LEVELS.get(level, LOG_LEVELS['INFO']) < LOG_LEVEL:
+        return
+    if not _writer_started:
+        _start_writer()
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        _log_queue.put_nowait(f"[{timestamp}] [{level}] {message}\n")
+    except Full:
+        _dropped_log_lines += 1
+
+def log_queue_depth():
+    return _log_queue.qsize()
+
+def dropped_log_lines():
+    return _dropped_log_lines
+
+# ----------------------------------------------------
+# Safe Execution Decorator: Wrap functions so they log errors and continue.
+# ----------------------------------------------------
+def safe_execution(func):
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            log_message(f"Error in {func.__name__}: {e}", level="ERROR")
+    return wrapper
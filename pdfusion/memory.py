@@ -0,0 +1,72 @@
+"""The global memory budget for page bitmaps, and RSS of the bot and its workers"""
+
+import os
+import threading
+
+from pdfusion.metrics import metrics
+from pdfusion.pool import render_worker_pids
+
+# ---------------------------
+# Memory budget: bound the bitmaps being rendered across all jobs
+# ---------------------------
+MEMORY_BUDGET_BYTES = int(os.environ.get('PDFUSION_MEMORY_BUDGET_MB', 512)) * 1024 * 1024
+# '1' always renders one page per worker task; otherwise this kicks in for pages too large to batch.
+BOUNDED_MEMORY = os.environ.get('PDFUSION_BOUNDED_MEMORY', '0') == '1'
+SYSTEM_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+class MemoryBudget:
+    """
+    Global byte budget for decoded page bitmaps. Jobs reserve bytes before a
+    page range is rendered and give them back once the pages are encoded.
+    Listeners (the job scheduler) are woken whenever bytes are returned.
+    """
+
+    def __init__(self, total_bytes):
+        self.total = total_bytes
+        self.available = total_bytes
+        self.cond = threading.Condition()
+        self.listeners = []
+
+    def acquire(self, nbytes, blocking=True):
+        """Reserve nbytes (capped at the whole budget); returns the amount reserved or 0"""
+        nbytes = min(nbytes, self.total)
+        with self.cond:
+            while self.available < nbytes:
+                if not blocking:
+                    return 0
+                self.cond.wait()
+            self.available -= nbytes
+            return nbytes
+
+    def release(self, nbytes):
+        if not nbytes:
+            return
+        with self.cond:
+            self.available += nbytes
+            self.cond.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def exhausted(self):
+        """True when less than 5% of the budget is left, so no new work should start"""
+        return self.available < self.total // 20
+
+# The job scheduler adds itself to the listeners (see jobs.py).
+memory_budget = MemoryBudget(MEMORY_BUDGET_BYTES)
+
+def process_tree_rss():
+    """Resident memory of the bot process plus its render workers in bytes (0 where /proc is missing)"""
+    pids = [os.getpid()] + render_worker_pids()
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * SYSTEM_PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+metrics.gauge('pdfusion_memory_budget_available_bytes', "Unreserved bytes of the render memory budget",
+              func=lambda: memory_budget.available)
+metrics.gauge('pdfusion_process_rss_bytes', "Resident memory of the bot and its render workers",
+              func=process_tree_rss)
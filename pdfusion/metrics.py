@@ -0,0 +1,198 @@
+"""Metrics in the Prometheus text format, per-job timing spans and the /metrics server"""
+
+import bisect
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from pdfusion.log import log_message, log_queue_depth, dropped_log_lines
+
+# ---------------------------
+# Metrics: counters, gauges and histograms in the Prometheus text format, plus per-job timing spans
+# ---------------------------
+METRICS_HOST = os.environ.get('PDFUSION_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('PDFUSION_METRICS_PORT', 9464))  # 0 disables the /metrics endpoint
+
+class Metric:
+    """
+    Base for a metric family. Samples are keyed by label values, in the order
+    of labelnames. A metric created with func reads its value at scrape time:
+    func returns a number, or a dict from label-value tuples to numbers.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), func=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        """Yield (suffix, label text, value) for every sample"""
+        if self.func is not None:
+            value = self.func()
+            items = value.items() if isinstance(value, dict) else [((), value)]
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        for key, value in items:
+            yield '', self._labels(key), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            value = float(value)
+            lines.append(f'{self.name}{suffix}{labels} {int(value) if value.is_integer() else value!r}')
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum of observations.
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts)) for key, counts in self.values.items()]
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '_bucket', self._labels(key, [('le', bound)]), cumulative
+            yield '_sum', self._labels(key), counts[-1]
+            yield '_count', self._labels(key), cumulative
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=(), func=None):
+        return self._register(Counter(name, help, labelnames, func))
+
+    def gauge(self, name, help, labelnames=(), func=None):
+        return self._register(Gauge(name, help, labelnames, func))
+
+    def histogram(self, name, help, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram('pdfusion_stage_seconds', "Time spent in each pipeline stage", ['stage'])
+job_seconds = metrics.histogram('pdfusion_job_seconds', "Run time of scheduled jobs", ['job'])
+job_wait_seconds = metrics.histogram('pdfusion_job_wait_seconds', "Time jobs spent queued before starting", ['job'])
+telegram_request_seconds = metrics.histogram('pdfusion_telegram_request_seconds', "Bot API call latency",
+                                             ['method'])
+telegram_requests = metrics.counter('pdfusion_telegram_requests_total', "Bot API calls by outcome",
+                                    ['method', 'outcome'])
+pages_rendered = metrics.counter('pdfusion_pages_rendered_total', "Pages rendered and encoded")
+pages_extracted = metrics.counter('pdfusion_pages_extracted_total',
+                                  "Pages sent from their embedded JPEG instead of being rendered")
+metrics.gauge('pdfusion_log_queue_depth', "Log lines waiting to be written", func=log_queue_depth)
+metrics.counter('pdfusion_log_lines_dropped_total', "Log lines dropped because the writer fell behind",
+                func=dropped_log_lines)
+
+class Trace:
+    """Per-job totals of the timing spans recorded while it is the current trace"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            total, count = self.totals.get(stage, (0.0, 0))
+            self.totals[stage] = (total + seconds, count + 1)
+
+    def summary(self):
+        with self.lock:
+            return ', '.join(f"{stage} {total:.2f}s/{count}" for stage, (total, count) in self.totals.items())
+
+# Set for every async handler and scheduled job; scheduler.submit and AsyncCore.run_io carry it along.
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def record_span(stage, seconds, trace=None):
+    stage_seconds.observe(seconds, stage=stage)
+    trace = trace or current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+@contextlib.contextmanager
+def span(stage):
+    """Time a block as one span of stage: download, parse, render, encode, extract, upload, progress_edit, ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urlparse(self.path).path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics on a background thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    log_message(f"Metrics available at http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,115 @@
+"""Request options: page ranges, thumbnails and contact sheets"""
+
+import math
+import re
+
+from pdfusion.encoding import ENCODING_PRESETS, get_user_preset
+
+# ---------------------------
+# Request options: page ranges, thumbnails and contact sheets
+# ---------------------------
+SHEET_PAGES = 16  # pages per contact sheet when 'sheet' is given without a number
+MAX_SHEET_PAGES = 36
+DEFAULT_RENDER_OPTIONS = {'pages': None, 'thumbnails': False, 'sheet': 0}
+CAPTION_OPTIONS_PREFIX = '/opts'  # marks a caption as options even if it does not parse
+PAGE_RANGE = re.compile(r'(\d+)(?:-(\d+))?$')
+RENDER_OPTIONS_HELP = ("Options: page ranges like 10-25 or pages=1-3,7, 'thumbs' for small previews, "
+                       f"'sheet' or 'sheet=N' to tile {SHEET_PAGES} (or N) pages per image.")
+
+def parse_render_options(words, bare_ranges=True):
+    """
+    Parse the options after a /process_url link or in a PDF's caption, e.g.
+    ['10-25', 'thumbs'], ['pages=1-3,7'] or ['sheet=9']. Without bare_ranges,
+    page ranges only count after 'pages='. Raises ValueError with a message for the user.
+    """
+    options = dict(DEFAULT_RENDER_OPTIONS)
+    for word in words:
+        word = word.lower()
+        if word in ('thumbs', 'thumbnails'):
+            options['thumbnails'] = True
+        elif word == 'sheet' or word.startswith('sheet='):
+            size = word.partition('=')[2] or str(SHEET_PAGES)
+            if not size.isdigit() or not 2 <= int(size) <= MAX_SHEET_PAGES:
+                raise ValueError(f"A contact sheet holds 2 to {MAX_SHEET_PAGES} pages.")
+            options['sheet'] = int(size)
+        elif bare_ranges or word.startswith('pages='):
+            ranges = []
+            for part in word.removeprefix('pages=').split(','):
+                match = PAGE_RANGE.match(part)
+                if match is None:
+                    raise ValueError(f"Unknown option '{word}'. {RENDER_OPTIONS_HELP}")
+                first = int(match.group(1))
+                last = int(match.group(2) or first)
+                if first < 1 or last < first:
+                    raise ValueError(f"Invalid page range '{part}'.")
+                ranges.append([first, last])
+            options['pages'] = (options['pages'] or []) + ranges
+        else:
+            raise ValueError(f"Unknown option '{word}'. {RENDER_OPTIONS_HELP}")
+    return options
+
+def parse_caption_options(caption):
+    """
+    Options from a PDF's caption. After a leading /opts the caption is parsed like
+    parse_render_options, errors included; any other caption counts as options only
+    if every word is one, so an ordinary caption such as "Q3 report" is ignored.
+    Pages need 'pages=' there, or a caption such as "2024" would pick page 2024.
+    """
+    words = (caption or '').split()
+    if words and words[0].lower() == CAPTION_OPTIONS_PREFIX:
+        return parse_render_options(words[1:])
+    try:
+        return parse_render_options(words, bare_ranges=False)
+    except ValueError:
+        return dict(DEFAULT_RENDER_OPTIONS)
+
+def request_preset(options, user_id):
+    """Encoding preset for a request: 'thumbnail' if asked for, else the user's preset"""
+    return 'thumbnail' if options['thumbnails'] else get_user_preset(user_id)
+
+def select_pages(options, total_pages):
+    """The 0-based pages a request asks for, in order; raises ValueError if none exist"""
+    if options['pages'] is None:
+        return list(range(total_pages))
+    pages = sorted({page - 1 for first, last in options['pages']
+                    for page in range(first, min(last, total_pages) + 1)})
+    if not pages:
+        raise ValueError(f"The requested pages are not in this {total_pages}-page document.")
+    return pages
+
+def wants_early_preview(options):
+    """Whether page 1 would be the first photo of the request (see send_first_page_preview)"""
+    return not options['sheet'] and (options['pages'] is None or min(r[0] for r in options['pages']) == 1)
+
+def format_page_ranges(pages):
+    """'1-3, 7' for the 0-based pages [0, 1, 2, 6]"""
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page - 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return ', '.join(f'{a + 1}-{b + 1}' if a != b else f'{a + 1}' for a, b in runs)
+
+def page_captions(pages, total_pages):
+    return [f'Page {page + 1} of {total_pages}' for page in pages]
+
+def sheet_captions(sheets, total_pages):
+    return [f'Pages {format_page_ranges(sheet)} of {total_pages}' for sheet in sheets]
+
+SHEET_LABEL_HEIGHT = 16
+
+def sheet_layout(preset_name, sheet_size):
+    """(columns, rows, cell_width, cell_height) of a contact sheet whose long side fits the preset's max_side"""
+    columns = math.ceil(math.sqrt(sheet_size))
+    rows = math.ceil(sheet_size / columns)
+    max_side = ENCODING_PRESETS[preset_name]['max_side']
+    # Cells are shaped for portrait A4 pages plus a label line.
+    cell_width = min(max_side // columns, int((max_side / rows - SHEET_LABEL_HEIGHT) / 1.42))
+    return columns, rows, cell_width, int(cell_width * 1.42) + SHEET_LABEL_HEIGHT
+
+def sheet_dpi(info, preset_name, sheet_size):
+    """DPI at which a page fills one cell of a contact sheet"""
+    _, _, cell_width, cell_height = sheet_layout(preset_name, sheet_size)
+    dpi = min(cell_width / (info['width'] / 72), (cell_height - SHEET_LABEL_HEIGHT) / (info['height'] / 72))
+    return max(20, min(ENCODING_PRESETS[preset_name]['dpi'], int(dpi)))
@@ -0,0 +1,274 @@
+"""The outbound dispatcher: every Bot API call goes through one rate-limited queue"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+
+from pdfusion import telegram
+from pdfusion.log import log_message
+from pdfusion.metrics import (metrics, current_trace, record_span, telegram_request_seconds,
+                              telegram_requests)
+
+# ---------------------------
+# Outbound dispatcher: every Telegram send goes through one rate-limited queue
+# ---------------------------
+OUTBOUND_WORKERS = int(os.environ.get('PDFUSION_OUTBOUND_WORKERS', 8))
+GLOBAL_SENDS_PER_SECOND = float(os.environ.get('PDFUSION_GLOBAL_RATE', 25))
+CHAT_SENDS_PER_SECOND = float(os.environ.get('PDFUSION_CHAT_RATE', 1))
+CHAT_SEND_BURST = int(os.environ.get('PDFUSION_CHAT_BURST', 3))
+MAX_SEND_RETRIES = 5
+BUCKET_PRUNE_INTERVAL = 60  # seconds between sweeps that forget idle chats' full token buckets
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second, up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Stop handing out tokens for the given time (used for Telegram's retry_after)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_full(self, now):
+        """True if the bucket is back at capacity and unblocked, i.e. no different from a new one"""
+        return self.wait_time(now) == 0.0 and self.tokens >= self.capacity
+
+class OutboundRequest:
+    """A queued Bot API call; the caller waits on future"""
+
+    def __init__(self, chat_id, method, args, kwargs, coalesce_key=None):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.attempts = 0
+        self.future = Future()
+        self.trace = current_trace.get()
+
+class OutboundDispatcher:
+    """
+    Central queue for outgoing Telegram calls.
+    - Token buckets limit sends per chat and globally.
+    - Chats are served round-robin, one request in flight per chat, so a long
+      job for one user cannot starve the others and per-chat order is kept.
+    - 429 responses pause the chat for retry_after and retry the request.
+    - Status edits of the same message are coalesced: only the newest text is sent.
+    """
+
+    def __init__(self, workers, global_rate, chat_rate, chat_burst):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.cond = threading.Condition()
+        self.queues = {}         # chat_id -> deque of OutboundRequest
+        self.ready = deque()     # chats with queued requests and none in flight, in serving order
+        self.busy = set()        # chats with a request in flight
+        self.buckets = {}        # chat_id -> TokenBucket
+        self.pending_edits = {}  # (chat_id, message_id) -> queued edit request
+        self.last_prune = time.monotonic()
+        self.started = False
+
+    def _ensure_started_locked(self):
+        if self.started:
+            return
+        self.started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"outbound-{i}", daemon=True).start()
+
+    def _bucket(self, chat_id):
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_buckets_locked(self, now):
+        """Drop the buckets of idle chats that have refilled, so buckets does not grow with every chat ever served"""
+        if now - self.last_prune < BUCKET_PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        for chat_id, bucket in list(self.buckets.items()):
+            if chat_id not in self.busy and chat_id not in self.queues and bucket.is_full(now):
+                del self.buckets[chat_id]
+
+    def _enqueue_locked(self, request, front=False):
+        self._ensure_started_locked()
+        queue = self.queues.setdefault(request.chat_id, deque())
+        if not queue and request.chat_id not in self.busy:
+            self.ready.append(request.chat_id)
+        if front:
+            queue.appendleft(request)
+        else:
+            queue.append(request)
+        self.cond.notify()
+
+    def call(self, chat_id, method, *args, **kwargs):
+        """Queue bot.<method>(*args, **kwargs) for chat_id and return a Future for its result"""
+        request = OutboundRequest(chat_id, method, args, kwargs)
+        with self.cond:
+            self._enqueue_locked(request)
+        return request.future
+
+    def edit_text(self, text, chat_id, message_id, **kwargs):
+        """Queue a message edit, replacing the text of an edit to the same message that is still queued"""
+        key = (chat_id, message_id)
+        with self.cond:
+            queued = self.pending_edits.get(key)
+            if queued is not None:
+                queued.args = (text, chat_id, message_id)
+                queued.kwargs = kwargs
+                return queued.future
+            request = OutboundRequest(chat_id, 'edit_message_text', (text, chat_id, message_id), kwargs, coalesce_key=key)
+            self.pending_edits[key] = request
+            self._enqueue_locked(request)
+        request.future.add_done_callback(_log_failed_edit)
+        return request.future
+
+    def wait_idle(self, timeout):
+        """Wait until every queued call was sent; returns False if that took longer than timeout seconds"""
+        # Polls rather than waiting on cond, so it never takes a wake-up meant for a worker.
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.cond:
+                if not self.queues and not self.busy:
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+
+    def _next_locked(self):
+        """Return (request, None) for the next sendable request, or (None, seconds to wait)"""
+        now = time.monotonic()
+        self._prune_buckets_locked(now)
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait:
+            return None, global_wait
+        wait = None
+        for _ in range(len(self.ready)):
+            chat_id = self.ready.popleft()
+            bucket = self._bucket(chat_id)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait:
+                self.ready.append(chat_id)
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+                continue
+            queue = self.queues[chat_id]
+            request = queue.popleft()
+            if not queue:
+                del self.queues[chat_id]
+            if request.coalesce_key is not None:
+                self.pending_edits.pop(request.coalesce_key, None)
+            bucket.take()
+            self.global_bucket.take()
+            self.busy.add(chat_id)
+            return request, None
+        return None, wait
+
+    def _release_locked(self, chat_id):
+        self.busy.discard(chat_id)
+        if self.queues.get(chat_id):
+            self.ready.append(chat_id)
+        self.cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                request, wait = self._next_locked()
+                while request is None:
+                    self.cond.wait(wait)
+                    request, wait = self._next_locked()
+            self._execute(request)
+
+    def _execute(self, request):
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            result = getattr(telegram.bot, request.method)(*request.args, **request.kwargs)
+        except ApiTelegramException as e:
+            outcome = str(e.error_code)
+            if e.error_code == 429 and request.attempts < MAX_SEND_RETRIES:
+                self._retry_later(request, e)
+                return
+            request.future.set_exception(e)
+        except Exception as e:
+            outcome = 'error'
+            request.future.set_exception(e)
+        else:
+            request.future.set_result(result)
+        finally:
+            elapsed = time.perf_counter() - start
+            telegram_request_seconds.observe(elapsed, method=request.method)
+            telegram_requests.inc(method=request.method, outcome=outcome)
+            if request.method == 'edit_message_text':
+                record_span('progress_edit', elapsed, request.trace)
+        with self.cond:
+            self._release_locked(request.chat_id)
+
+    def _retry_later(self, request, error):
+        retry_after = (error.result_json or {}).get('parameters', {}).get('retry_after', 1)
+        log_message(f"Rate limited on {request.method} for chat {request.chat_id}, retrying in {retry_after}s", "WARNING")
+        # The failed attempt read the uploads to EOF; without a rewind the retry would send empty files.
+        _rewind_uploads(request.args, request.kwargs)
+        with self.cond:
+            self._bucket(request.chat_id).block(retry_after)
+            request.attempts += 1
+            key = request.coalesce_key
+            if key is not None and key in self.pending_edits:
+                # A newer edit of the same message is already queued; this one is stale.
+                request.future.set_result(None)
+            else:
+                if key is not None:
+                    self.pending_edits[key] = request
+                self._enqueue_locked(request, front=True)
+            self._release_locked(request.chat_id)
+
+def _rewind_uploads(args, kwargs):
+    """seek(0) every file-like argument of a request, including the media of an album's InputMedia items"""
+    for value in (*args, *kwargs.values()):
+        for item in (value if isinstance(value, (list, tuple)) else [value]):
+            upload = getattr(item, 'media', item)
+            if hasattr(upload, 'seek'):
+                upload.seek(0)
+
+def _log_failed_edit(future):
+    error = future.exception()
+    if error is not None and 'message is not modified' not in str(error):
+        log_message(f"Error updating status message: {error}", level="ERROR")
+
+outbound = OutboundDispatcher(OUTBOUND_WORKERS, GLOBAL_SENDS_PER_SECOND, CHAT_SENDS_PER_SECOND, CHAT_SEND_BURST)
+metrics.gauge('pdfusion_outbound_queued', "Bot API calls waiting in the outbound dispatcher",
+              func=lambda: sum(len(queue) for queue in list(outbound.queues.values())))
+metrics.gauge('pdfusion_outbound_busy_chats', "Chats with a Bot API call in flight", func=lambda: len(outbound.busy))
+
+def api_call(chat_id, method, *args, **kwargs):
+    """Send a Bot API request through the outbound dispatcher and wait for its result"""
+    return outbound.call(chat_id, method, *args, **kwargs).result()
+
+def reply_to(message, text, **kwargs):
+    return api_call(message.chat.id, 'reply_to', message, text, **kwargs)
+
+def edit_status(text, chat_id, message_id):
+    """Queue a status edit without waiting; superseded edits of the same message are dropped"""
+    return outbound.edit_text(text, chat_id, message_id)
@@ -0,0 +1,53 @@
+"""The process pool that renders pages on every CPU core"""
+
+import importlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from pdfusion.log import log_message
+
+# ---------------------------
+# Multi-core rendering: a process pool renders page ranges ahead of delivery
+# ---------------------------
+RENDER_WORKERS = max(1, int(os.environ.get('PDFUSION_RENDER_WORKERS', os.cpu_count() or 1)))
+# Maximum number of batches per job that are rendering or waiting to be sent.
+RENDER_WINDOW = max(2, int(os.environ.get('PDFUSION_RENDER_WINDOW', RENDER_WORKERS * 2)))
+# Workers are never forked from the bot itself: its other threads (asyncio core, dispatcher, jobs,
+# log writer, warm-up imports) may hold locks at the moment of the fork, which deadlocks the child.
+RENDER_START_METHOD = os.environ.get('PDFUSION_RENDER_START_METHOD', 'forkserver')
+if RENDER_START_METHOD not in multiprocessing.get_all_start_methods():
+    RENDER_START_METHOD = 'spawn'
+# Imported by every new worker before its first task
+RENDER_WORKER_PRELOAD = ('pdf2image', 'PIL.Image', 'PIL.ImageDraw', 'PIL.ImageChops', 'PyPDF2', 'pdfusion.rendering')
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def _init_render_worker():
+    for name in RENDER_WORKER_PRELOAD:
+        importlib.import_module(name)
+
+def get_render_pool():
+    """Return the shared rendering process pool, creating it on first use"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            log_message(f"Starting render pool with {RENDER_WORKERS} workers ({RENDER_START_METHOD})")
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                               mp_context=multiprocessing.get_context(RENDER_START_METHOD),
+                                               initializer=_init_render_worker)
+        return _render_pool
+
+def render_worker_pids():
+    """Process ids of the running render workers (none before the pool has started)"""
+    if _render_pool is None:
+        return []
+    return list(_render_pool._processes or {})
+
+def start_render_workers():
+    """Start every render worker now rather than when the first pages are rendered"""
+    pool = get_render_pool()
+    for future in [pool.submit(os.getpid) for _ in range(RENDER_WORKERS)]:
+        future.result()
@@ -0,0 +1,235 @@
+"""Pre-flight inspection: estimate a PDF's render cost from its xref and page tree, before rendering anything"""
+
+import contextlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from pdfusion.lazy import lazy_import
+from pdfusion.log import log_message
+from pdfusion.metrics import span
+
+PyPDF2 = lazy_import('PyPDF2')
+
+# ---------------------------
+# Pre-flight: page sizes and likely scanned pages, read without touching content streams or images
+# ---------------------------
+A4_AREA = 595.0 * 842.0  # square points; rendering one A4 page is one unit of cost
+# Cost of a page that is one embedded JPEG, sent without rasterizing (a guess until the page is opened)
+IMAGE_PAGE_COST = 0.2
+# Documents whose selected pages cost at most this much render in the job's own thread, without the pool
+FAST_PATH_COST = float(os.environ.get('PDFUSION_FAST_PATH_COST', 4))
+
+class PdfInspection:
+    """
+    What pre-flight learned about a document: every page's size in points as
+    displayed (after /Rotate), and the 0-based pages whose only resource is a
+    single XObject, which are probably scans stored as one image.
+    """
+
+    def __init__(self, sizes, image_pages=()):
+        self.sizes = sizes
+        self.image_pages = frozenset(image_pages)
+
+    @classmethod
+    def from_info(cls, info):
+        """A uniform estimate from get_pdf_info's first-page size, for files PyPDF2 cannot read"""
+        return cls([(info['width'], info['height'])] * info['pages'])
+
+    @property
+    def pages(self):
+        return len(self.sizes)
+
+    def _info(self, size):
+        width, height = size
+        return {'pages': self.pages, 'width': width, 'height': height}
+
+    @property
+    def info(self):
+        """{'pages', 'width', 'height'} for the first page, like get_pdf_info"""
+        return self._info(self.sizes[0] if self.sizes else (612.0, 792.0))
+
+    def largest_page(self, pages):
+        """The same for the largest of the 0-based pages, which sizes the memory a render reserves"""
+        return self._info(max((self.sizes[page] for page in pages), key=lambda size: size[0] * size[1],
+                              default=(612.0, 792.0)))
+
+    def cost(self, pages):
+        """Estimated cost of the 0-based pages in A4 pages: page area for rendered pages, less for image pages"""
+        return sum(IMAGE_PAGE_COST if page in self.image_pages
+                   else max(1.0, self.sizes[page][0] * self.sizes[page][1] / A4_AREA)
+                   for page in pages)
+
+    def route(self, pages):
+        """'direct' for documents cheap enough to render in the job's thread, else 'parallel' (the render pool)"""
+        return 'direct' if self.cost(pages) <= FAST_PATH_COST else 'parallel'
+
+@contextlib.contextmanager
+def open_reader(pdf_path):
+    """
+    A PdfReader over the open file. Given a path, PyPDF2 would read the whole
+    file into memory; over a file it only reads the xref, then each object on use.
+    """
+    with open(pdf_path, 'rb') as f:
+        yield PyPDF2.PdfReader(f)
+
+def _resolve(obj):
+    return obj.get_object() if obj is not None else None
+
+def _page_layout(page):
+    """(width, height, rotation) of a page's media box, which is what poppler renders"""
+    box = page.mediabox
+    width, height = float(box.width), float(box.height)
+    rotation = int(_resolve(page.get('/Rotate')) or 0) % 360
+    if rotation in (90, 270):
+        width, height = height, width
+    return abs(width), abs(height), rotation
+
+def _single_xobject(page):
+    """The page's XObject dictionary if it names exactly one XObject and the page uses no fonts, else None"""
+    resources = _resolve(page.get('/Resources')) or {}
+    xobjects = _resolve(resources.get('/XObject')) or {}
+    if len(xobjects) != 1 or '/Font' in resources:
+        return None
+    return xobjects
+
+def inspect_pdf(pdf_path):
+    """
+    Read a PDF's xref and page tree (no content streams, no image data) and
+    return a PdfInspection, or None if PyPDF2 cannot read the file; poppler is
+    more forgiving, so callers fall back to pdfinfo.
+    """
+    try:
+        with span('parse'), open_reader(pdf_path) as reader:
+            sizes = []
+            image_pages = []
+            for i, page in enumerate(reader.pages):
+                width, height, rotation = _page_layout(page)
+                sizes.append((width, height))
+                if not rotation and _single_xobject(page) is not None:
+                    image_pages.append(i)
+        return PdfInspection(sizes, image_pages)
+    except Exception as e:
+        log_message(f"Pre-flight inspection of {pdf_path} failed, using pdfinfo: {e}", "WARNING")
+        return None
+
+# ---------------------------
+# Image pages: a page that only paints one JPEG over itself can be sent as that JPEG
+# ---------------------------
+_NUMBER = rb'([-+]?(?:\d+\.?\d*|\.\d+))'
+# q a b c d e f cm /Name Do Q, the whole content stream of a typical scanned page
+FULL_PAGE_IMAGE = re.compile(rb'\s*q\s+' + rb'\s+'.join([_NUMBER] * 6) +
+                             rb'\s*cm\s*/([^\s/\[\]<>(){}%]+)\s*Do\s*Q\s*$')
+MAX_CONTENT_BYTES = 1024  # anything longer draws more than one image
+
+INHERITABLE = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+MAX_TREE_DEPTH = 64  # deeper page trees are malformed (or cyclic)
+PAGE_TREE_CACHE_SIZE = 4  # documents whose page order a process remembers
+
+# Key: (path, inode, size, mtime), Value: [(page (idnum, generation), ancestor /Pages (idnum, generation)s)]
+_page_trees = OrderedDict()
+_page_trees_lock = threading.Lock()
+
+def _reference(obj):
+    return obj.idnum, obj.generation
+
+def _walk_page_tree(reader):
+    """Every page's reference and its ancestors' references, in page order; reads each node of the tree once"""
+    pages = []
+    stack = [(reader.trailer['/Root'].raw_get('/Pages'), ())]
+    while stack:
+        node_ref, ancestors = stack.pop()
+        node = node_ref.get_object()
+        if '/Kids' not in node:
+            pages.append((_reference(node_ref), ancestors))
+            continue
+        if len(ancestors) >= MAX_TREE_DEPTH:
+            raise ValueError("Page tree is too deep")
+        ancestors += (_reference(node_ref),)
+        stack.extend((kid_ref, ancestors) for kid_ref in reversed(node['/Kids']))
+    return pages
+
+def _page_tree(reader):
+    """
+    _walk_page_tree for the reader's file, remembered per document: render
+    workers open a new reader for every batch, and on a document of thousands
+    of pages walking the tree costs far more than the batch's pages.
+    """
+    try:
+        stat = os.fstat(reader.stream.fileno())
+        key = (reader.stream.name, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    except (AttributeError, OSError, ValueError):
+        return _walk_page_tree(reader)
+    with _page_trees_lock:
+        if key in _page_trees:
+            _page_trees.move_to_end(key)
+            return _page_trees[key]
+    pages = _walk_page_tree(reader)
+    with _page_trees_lock:
+        _page_trees[key] = pages
+        while len(_page_trees) > PAGE_TREE_CACHE_SIZE:
+            _page_trees.popitem(last=False)
+    return pages
+
+def find_page(reader, page_number):
+    """
+    The 1-based page as a PageObject with the attributes it inherits, without
+    reader.pages: PyPDF2 flattens the whole tree for that on every new reader,
+    and copies inherited attributes into sibling branches.
+    """
+    if page_number < 1:
+        raise IndexError(f"Page {page_number} is not in the page tree")
+    (idnum, generation), ancestors = _page_tree(reader)[page_number - 1]
+    inherited = {}
+    for ancestor in ancestors:
+        node = reader.get_object(PyPDF2.generic.IndirectObject(*ancestor, reader))
+        inherited.update((key, node.raw_get(key)) for key in INHERITABLE if key in node)
+    page_ref = PyPDF2.generic.IndirectObject(idnum, generation, reader)
+    page = PyPDF2.PageObject(reader, page_ref)
+    page.update(page_ref.get_object())
+    for key, value in inherited.items():
+        if key not in page:
+            page[PyPDF2.generic.NameObject(key)] = value
+    return page
+
+def page_jpeg(reader, page_number):
+    """
+    Return (jpeg_data, (page_width, page_height)) if the 1-based page does
+    nothing but paint one unmasked RGB or gray /DCTDecode image over its whole
+    media box, else None. Only that page's objects (and its ancestors in the
+    page tree) are read.
+    """
+    page = find_page(reader, page_number)
+    width, height, rotation = _page_layout(page)
+    xobjects = _single_xobject(page)
+    if rotation or xobjects is None:
+        return None
+
+    contents = _resolve(page.get('/Contents'))
+    if isinstance(contents, list):
+        streams = [_resolve(stream) for stream in contents]
+    else:
+        streams = [contents] if contents is not None else []
+    if sum(int(_resolve(stream.get('/Length')) or 0) for stream in streams) > MAX_CONTENT_BYTES:
+        return None
+    match = FULL_PAGE_IMAGE.match(b' '.join(stream.get_data() for stream in streams))
+    if match is None:
+        return None
+    a, b, c, d, e, f = (float(value) for value in match.groups()[:6])
+    name = '/' + match.group(7).decode('latin-1')
+    box = page.mediabox
+    corners = ((e, float(box.left)), (f, float(box.bottom)), (e + a, float(box.right)), (f + d, float(box.top)))
+    if name not in xobjects or b or c or any(abs(drawn - edge) > 1 for drawn, edge in corners):
+        return None
+
+    image = xobjects[name]
+    filters = _resolve(image.get('/Filter'))
+    if isinstance(filters, list):
+        filters = filters[0] if len(filters) == 1 else None
+    if (image.get('/Subtype') != '/Image' or filters != '/DCTDecode'
+            or _resolve(image.get('/ColorSpace')) not in ('/DeviceRGB', '/DeviceGray')
+            or any(key in image for key in ('/SMask', '/Mask', '/Decode', '/ImageMask'))):
+        return None
+    # DCTDecode data comes back as stored: the JPEG file itself.
+    return image.get_data(), (width, height)
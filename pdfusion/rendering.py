@@ -0,0 +1,291 @@
+"""Rendering pages with poppler in the render pool, delivered in document order"""
+
+import contextlib
+import io
+import os
+import re
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from pdfusion.cancel import JobCancelled
+from pdfusion.encoding import DEFAULT_PRESET, ENCODING_PRESETS, encode_page
+from pdfusion.lazy import lazy_import
+from pdfusion.memory import BOUNDED_MEMORY, memory_budget
+from pdfusion.metrics import span, record_span, pages_extracted, pages_rendered
+from pdfusion.options import SHEET_LABEL_HEIGHT, sheet_layout
+from pdfusion.pool import RENDER_WINDOW, get_render_pool
+from pdfusion.preflight import PdfInspection, inspect_pdf, open_reader, page_jpeg
+
+pdf2image = lazy_import('pdf2image')
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+
+# ---------------------------
+# Rendering engine: render page ranges straight from the source PDF
+# ---------------------------
+RENDER_DPI = 200  # pdf2image's default, kept so output matches previous releases
+CANCEL_POLL_SECONDS = 0.5  # how often a job waiting on a batch checks its cancel token
+
+def get_pdf_info(pdf_path):
+    """
+    Return {'pages', 'width', 'height'} using poppler's pdfinfo (no full parse in Python).
+    Width and height are the first page's size in points.
+    """
+    with span('parse'):
+        info = pdf2image.pdfinfo_from_path(pdf_path)
+    width, height = 612.0, 792.0  # US letter when pdfinfo cannot tell
+    match = re.match(r'([\d.]+) x ([\d.]+) pts', info.get("Page size", ""))
+    if match:
+        width, height = float(match.group(1)), float(match.group(2))
+    return {'pages': int(info["Pages"]), 'width': width, 'height': height}
+
+def get_page_count(pdf_path):
+    """Return the number of pages using poppler's pdfinfo (no full parse in Python)"""
+    return get_pdf_info(pdf_path)['pages']
+
+def inspect_document(pdf_path):
+    """Pre-flight inspection of a PDF, or a uniform estimate from pdfinfo if PyPDF2 cannot read it"""
+    return inspect_pdf(pdf_path) or PdfInspection.from_info(get_pdf_info(pdf_path))
+
+def render_page_files(pdf_path, first_page, last_page, output_folder, dpi=RENDER_DPI, timeout=None):
+    """
+    Render pages first_page..last_page with one pdftoppm run into output_folder
+    and return the image files in page order, without decoding any of them.
+    With timeout (seconds), a pdftoppm that runs longer is killed and
+    pdf2image's PDFPopplerTimeoutError raised.
+    """
+    paths = pdf2image.convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                                        output_folder=output_folder, paths_only=True, timeout=timeout)
+    if len(paths) != last_page - first_page + 1:
+        raise RuntimeError(f"pdftoppm wrote {len(paths)} images for pages {first_page}-{last_page}")
+    return paths
+
+def render_folder(pdf_path):
+    """
+    Scratch directory for page images next to the PDF, so inside the job's
+    workspace and removed with it even if the worker dies mid-batch.
+    """
+    return tempfile.TemporaryDirectory(prefix='render_', dir=os.path.dirname(os.path.abspath(pdf_path)))
+
+def estimate_page_bytes(info, dpi=RENDER_DPI):
+    """Size of one decoded RGB page bitmap at the given DPI"""
+    return int(info['width'] / 72 * dpi) * int(info['height'] / 72 * dpi) * 3
+
+EXIF_ORIENTATION = 0x0112
+
+def extract_page(reader, page_number, dpi=RENDER_DPI, preset_name=DEFAULT_PRESET):
+    """
+    Encode a page that only shows one embedded JPEG from that JPEG instead of
+    rasterizing the page; returns (data, file_extension), or None to render it.
+    The JPEG is sent as it is when it is no larger than the render would be and
+    fits the preset; otherwise it is decoded at a reduced scale and re-encoded.
+    """
+    try:
+        embedded = page_jpeg(reader, page_number)
+        if embedded is None:
+            return None
+        data, (page_width, page_height) = embedded
+        image = Image.open(io.BytesIO(data))
+        if image.mode not in ('L', 'RGB'):
+            return None
+        preset = ENCODING_PRESETS[preset_name]
+        size = (max(1, int(page_width / 72 * dpi)), max(1, int(page_height / 72 * dpi)))
+        # PDF viewers ignore EXIF rotation but Telegram applies it, so only upright JPEGs pass through.
+        if (image.width <= size[0] * 1.1 and image.height <= size[1] * 1.1
+                and max(image.size) <= preset['max_side'] and len(data) <= preset['target_bytes']
+                and 'JPEG' in preset['formats'] and image.getexif().get(EXIF_ORIENTATION, 1) == 1):
+            return data, 'jpg'
+        image.draft(image.mode, size)  # decode at 1/2, 1/4 or 1/8 scale when that is still large enough
+        image.thumbnail(size)
+        return encode_page(image, preset_name)
+    except Exception:
+        return None
+
+# ---------------------------
+# Render workers: entry points run in the render pool, results delivered in document order
+# ---------------------------
+
+def render_range_encoded(pdf_path, first_page, last_page, dpi=RENDER_DPI, preset_name=DEFAULT_PRESET,
+                         image_pages=(), timeout=None):
+    """
+    Worker entry point: render a page range and return (pages, timings), each
+    page as (data, file_extension) and each timing as (render_seconds, encode_seconds).
+    The 1-based image_pages (from pre-flight) are first tried with extract_page;
+    an extracted page's timing is (None, extract_seconds). Every run of
+    consecutive pages left is rendered by one pdftoppm into a render folder,
+    then the images are opened, encoded and deleted one at a time, so a worker
+    holds at most one decoded bitmap.
+    timeout bounds each pdftoppm run (see render_page_files).
+    """
+    encoded = {}
+    timings = {}
+    with open_reader(pdf_path) if image_pages else contextlib.nullcontext() as reader:
+        for page in image_pages:
+            start = time.perf_counter()
+            result = extract_page(reader, page, dpi, preset_name)
+            if result is not None:
+                encoded[page] = result
+                timings[page] = (None, time.perf_counter() - start)
+    rendered = [page for page in range(first_page, last_page + 1) if page not in encoded]
+    if rendered:
+        with render_folder(pdf_path) as folder:
+            for run in page_batches(rendered, len(rendered)):
+                start = time.perf_counter()
+                paths = render_page_files(pdf_path, run[0], run[-1], folder, dpi, timeout)
+                render_seconds = (time.perf_counter() - start) / len(run)
+                for page, path in zip(run, paths):
+                    start = time.perf_counter()
+                    with Image.open(path) as image:
+                        encoded[page] = encode_page(image, preset_name)
+                    os.remove(path)
+                    timings[page] = (render_seconds, time.perf_counter() - start)
+    pages = range(first_page, last_page + 1)
+    return [encoded[page] for page in pages], [timings[page] for page in pages]
+
+def render_contact_sheet(pdf_path, pages, dpi=RENDER_DPI, preset_name=DEFAULT_PRESET, timeout=None):
+    """
+    Worker entry point: render the 1-based pages (one pdftoppm per run of
+    consecutive pages, like render_range_encoded) and tile them one at a time
+    into one labelled image; returns ([(data, file_extension)], timings) like
+    render_range_encoded, with one timing per page.
+    """
+    columns, rows, cell_width, cell_height = sheet_layout(preset_name, len(pages))
+    sheet = Image.new('RGB', (cell_width * columns, cell_height * rows), 'white')
+    draw = ImageDraw.Draw(sheet)
+    timings = []
+    with render_folder(pdf_path) as folder:
+        for run in page_batches(pages, len(pages)):
+            start = time.perf_counter()
+            paths = render_page_files(pdf_path, run[0], run[-1], folder, dpi, timeout)
+            render_seconds = (time.perf_counter() - start) / len(run)
+            for page, path in zip(run, paths):
+                start = time.perf_counter()
+                i = len(timings)
+                with Image.open(path) as image:
+                    image.thumbnail((cell_width - 8, cell_height - SHEET_LABEL_HEIGHT - 8))
+                    x = (i % columns) * cell_width + (cell_width - image.width) // 2
+                    y = (i // columns) * cell_height + 4
+                    sheet.paste(image, (x, y))
+                    draw.rectangle([x - 1, y - 1, x + image.width, y + image.height], outline='gray')
+                    draw.text((x, y + image.height + 2), str(page), fill='black')
+                os.remove(path)
+                timings.append([render_seconds + time.perf_counter() - start, 0.0])
+    start = time.perf_counter()
+    data = encode_page(sheet, preset_name)
+    timings[-1][1] = time.perf_counter() - start
+    return [data], [tuple(timing) for timing in timings]
+
+def record_render_timings(timings):
+    """Record the spans measured in a render worker (the worker process has no metrics of its own)"""
+    for render_seconds, encode_seconds in timings:
+        if render_seconds is None:
+            record_span('extract', encode_seconds)
+            pages_extracted.inc()
+        else:
+            record_span('render', render_seconds)
+            record_span('encode', encode_seconds)
+            pages_rendered.inc()
+
+def page_batches(pages, batch_size):
+    """Split 0-based pages into runs of consecutive pages, at most batch_size long"""
+    batches = []
+    for page in pages:
+        if batches and len(batches[-1]) < batch_size and batches[-1][-1] == page - 1:
+            batches[-1].append(page)
+        else:
+            batches.append([page])
+    return batches
+
+def run_inline(func, *args):
+    """Run func now in this thread and return its outcome as a finished Future, as the pool would"""
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def wait_for_batch(future, token=None):
+    """
+    future.result(), but with a token the wait wakes every CANCEL_POLL_SECONDS
+    to check it, so /cancel and the stage deadline interrupt a batch that hangs.
+    """
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_SECONDS if token is not None else None)
+        except FutureTimeout:
+            try:
+                token.check()
+            except JobCancelled:
+                future.cancel()
+                raise
+
+def render_pages_ordered(pdf_path, pages, batch_size=5, page_bytes=0, dpi=RENDER_DPI,
+                         preset_name=DEFAULT_PRESET, sheet_size=0, image_pages=frozenset(), direct=False,
+                         token=None):
+    """
+    Yield (data, file_extension) for the 0-based pages in order while the pool
+    renders ahead; with sheet_size, yield one contact sheet per sheet_size pages.
+    Batches are submitted in order and delivered from the head of the queue, so
+    a fast worker never overtakes a slow one. At most RENDER_WINDOW batches are
+    held at once, which keeps memory flat regardless of document size.
+    Each batch reserves page_bytes per page it holds from the global memory budget.
+    A job only blocks on the budget when it has nothing in flight, so jobs waiting
+    for memory never hold reservations another job needs.
+    image_pages are the 0-based pages pre-flight found may be a single JPEG.
+    With direct, pages render one at a time in the calling thread instead: for
+    a small document that beats waiting behind other jobs' batches in the pool.
+    With token (a CancelToken), waits for a batch are interrupted by /cancel and
+    the stage deadline, and every pdftoppm run is limited to the time left.
+    """
+    if direct:
+        submit, window, batch_size = run_inline, 1, 1
+    else:
+        submit, window = get_render_pool().submit, RENDER_WINDOW
+    if BOUNDED_MEMORY or page_bytes * batch_size * window > memory_budget.total // 2:
+        batch_size = 1
+    if sheet_size:
+        batches = deque(pages[i:i + sheet_size] for i in range(0, len(pages), sheet_size))
+    else:
+        batches = deque(page_batches(pages, batch_size))
+    in_flight = deque()
+
+    def submit_next(blocking):
+        if not batches:
+            return False
+        batch = batches[0]
+        # A sheet worker holds one page bitmap and the sheet itself.
+        reserved = memory_budget.acquire(page_bytes * (2 if sheet_size else len(batch)), blocking)
+        if page_bytes and not reserved:
+            return False
+        batches.popleft()
+        remaining = token.remaining() if token is not None else None
+        timeout = None if remaining is None else max(1, int(remaining))
+        if sheet_size:
+            future = submit(render_contact_sheet, pdf_path, [page + 1 for page in batch], dpi, preset_name,
+                            timeout)
+        else:
+            future = submit(render_range_encoded, pdf_path, batch[0] + 1, batch[-1] + 1, dpi, preset_name,
+                            [page + 1 for page in batch if page in image_pages], timeout)
+        in_flight.append((reserved, future))
+        return True
+
+    try:
+        while True:
+            while len(in_flight) < window and submit_next(blocking=not in_flight):
+                pass
+            if not in_flight:
+                break
+            reserved, future = in_flight.popleft()
+            try:
+                results, timings = wait_for_batch(future, token)
+            finally:
+                memory_budget.release(reserved)
+            record_render_timings(timings)
+            yield from results
+    finally:
+        for reserved, future in in_flight:
+            future.cancel()
+            memory_budget.release(reserved)
@@ -0,0 +1,235 @@
+"""Per-chat session stores with idle TTL, size limits, LRU eviction and optional persistence"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from pdfusion.log import log_message
+from pdfusion.metrics import metrics
+
+# ---------------------------
+# Session store: idle TTL, size limits, LRU eviction and optional persistence
+# ---------------------------
+SESSION_IDLE_TTL = int(os.environ.get('PDFUSION_SESSION_TTL', 6 * 3600))  # seconds
+SESSION_MAX_TOTAL_BYTES = int(os.environ.get('PDFUSION_SESSION_MAX_MB', 256)) * 1024 * 1024
+# Path of an SQLite file to keep sessions across restarts; empty keeps them in memory only.
+SESSION_DB_PATH = os.environ.get('PDFUSION_SESSION_DB', '')
+SESSION_SWEEP_INTERVAL = 60
+
+_session_db = None
+_session_db_lock = threading.Lock()
+
+def get_session_db():
+    """Open the session database on first use (None when persistence is off)"""
+    global _session_db
+    with _session_db_lock:
+        if _session_db is None and SESSION_DB_PATH:
+            _session_db = sqlite3.connect(SESSION_DB_PATH, check_same_thread=False)
+            _session_db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "kind TEXT, chat_id INTEGER, data TEXT, updated REAL, PRIMARY KEY (kind, chat_id))"
+            )
+            _session_db.commit()
+        return _session_db
+
+class SessionFull(Exception):
+    """Raised when an addition would push a session over its size limit"""
+
+class SessionStore:
+    """
+    Per-chat session state with a dict-like interface.
+    - Sessions idle for longer than the TTL are evicted.
+    - Each session has a byte limit; check_room() is called before growing it.
+    - When all sessions of every store together exceed SESSION_MAX_TOTAL_BYTES,
+      the least recently used sessions of this store are evicted.
+    - With SESSION_DB_PATH set, sessions are written through to SQLite and
+      restored lazily on first access after a restart.
+    size_of, serialize and deserialize describe the session values; on_evict
+    releases resources of sessions dropped by the store (not of popped ones).
+    """
+
+    all_stores = []
+
+    def __init__(self, kind, max_session_bytes, size_of, serialize, deserialize, on_evict=None, ttl=SESSION_IDLE_TTL):
+        self.kind = kind
+        self.max_session_bytes = max_session_bytes
+        self.size_of = size_of
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self.on_evict = on_evict
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.sessions = OrderedDict()  # chat_id -> [value, last_used, size], least recently used first
+        self.persisted = None          # chat_id -> (data, updated) not yet restored
+        self.last_sweep = time.time()
+        self.evictions = 0
+        SessionStore.all_stores.append(self)
+
+    # Persistence -----------------------------------------------------------
+
+    def _load_persisted_locked(self):
+        if self.persisted is not None:
+            return
+        self.persisted = {}
+        db = get_session_db()
+        if db is None:
+            return
+        with _session_db_lock:
+            rows = db.execute("SELECT chat_id, data, updated FROM sessions WHERE kind = ?", (self.kind,)).fetchall()
+        for chat_id, data, updated in rows:
+            self.persisted[chat_id] = (data, updated)
+        if rows:
+            log_message(f"Found {len(rows)} persisted {self.kind} sessions")
+
+    def _write_locked(self, chat_id):
+        db = get_session_db()
+        if db is None:
+            return
+        value, last_used, _ = self.sessions[chat_id]
+        data = json.dumps(self.serialize(value))
+        with _session_db_lock:
+            db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", (self.kind, chat_id, data, last_used))
+            db.commit()
+
+    def _delete_persisted_locked(self, chat_id):
+        db = get_session_db()
+        if db is None:
+            return
+        with _session_db_lock:
+            db.execute("DELETE FROM sessions WHERE kind = ? AND chat_id = ?", (self.kind, chat_id))
+            db.commit()
+
+    def _restore_locked(self, chat_id):
+        self._load_persisted_locked()
+        if chat_id not in self.persisted:
+            return
+        data, updated = self.persisted.pop(chat_id)
+        if time.time() - updated > self.ttl:
+            self._delete_persisted_locked(chat_id)
+            return
+        try:
+            value = self.deserialize(chat_id, json.loads(data))
+        except Exception as e:
+            log_message(f"Dropping unreadable {self.kind} session of chat {chat_id}: {e}", "WARNING")
+            self._delete_persisted_locked(chat_id)
+            return
+        self.sessions[chat_id] = [value, updated, self.size_of(value)]
+        log_message(f"Restored {self.kind} session of chat {chat_id}")
+
+    # Eviction --------------------------------------------------------------
+
+    def _evict_locked(self, chat_id, reason):
+        value, _, size = self.sessions.pop(chat_id)
+        self._delete_persisted_locked(chat_id)
+        self.evictions += 1
+        log_message(f"Evicted {self.kind} session of chat {chat_id} ({reason}, {size} bytes)")
+        if self.on_evict is not None:
+            try:
+                self.on_evict(value)
+            except Exception as e:
+                log_message(f"Error releasing evicted session: {e}", "ERROR")
+
+    def _sweep_locked(self, force=False):
+        now = time.time()
+        if not force and now - self.last_sweep < SESSION_SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+        for chat_id in [c for c, entry in self.sessions.items() if now - entry[1] > self.ttl]:
+            self._evict_locked(chat_id, "idle")
+
+    def _enforce_total_locked(self, keep):
+        while total_session_bytes() > SESSION_MAX_TOTAL_BYTES:
+            victim = next((c for c in self.sessions if c != keep), None)
+            if victim is None:
+                return
+            self._evict_locked(victim, "memory cap")
+
+    # Dict-like interface ---------------------------------------------------
+
+    def _entry(self, chat_id):
+        with self.lock:
+            self._sweep_locked()
+            if chat_id not in self.sessions:
+                self._restore_locked(chat_id)
+            entry = self.sessions.get(chat_id)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                self._evict_locked(chat_id, "idle")
+                return None
+            return entry
+
+    def __contains__(self, chat_id):
+        return self._entry(chat_id) is not None
+
+    def __getitem__(self, chat_id):
+        entry = self._entry(chat_id)
+        if entry is None:
+            raise KeyError(chat_id)
+        return entry[0]
+
+    def get(self, chat_id, default=None):
+        entry = self._entry(chat_id)
+        return default if entry is None else entry[0]
+
+    def __setitem__(self, chat_id, value):
+        with self.lock:
+            self._load_persisted_locked()
+            self.persisted.pop(chat_id, None)
+            self.sessions[chat_id] = [value, time.time(), self.size_of(value)]
+            self.sessions.move_to_end(chat_id)
+            self._write_locked(chat_id)
+            self._sweep_locked()
+            self._enforce_total_locked(chat_id)
+
+    def pop(self, chat_id, *default):
+        with self.lock:
+            entry = self._entry(chat_id)
+            if entry is None:
+                if default:
+                    return default[0]
+                raise KeyError(chat_id)
+            del self.sessions[chat_id]
+            self._delete_persisted_locked(chat_id)
+            return entry[0]
+
+    def __delitem__(self, chat_id):
+        self.pop(chat_id)
+
+    def check_room(self, chat_id, extra_bytes):
+        """Raise SessionFull if adding extra_bytes would exceed the per-session limit"""
+        entry = self._entry(chat_id)
+        if entry is not None and entry[2] + extra_bytes > self.max_session_bytes:
+            raise SessionFull(f"{self.kind} session of chat {chat_id} is full")
+
+    def touch(self, chat_id):
+        """Record that a session was modified in place: refresh size, recency and the persisted copy"""
+        with self.lock:
+            entry = self.sessions.get(chat_id)
+            if entry is None:
+                return
+            entry[1] = time.time()
+            entry[2] = self.size_of(entry[0])
+            self.sessions.move_to_end(chat_id)
+            self._write_locked(chat_id)
+            self._enforce_total_locked(chat_id)
+
+    def stats(self):
+        """Live session count and bytes held, for monitoring"""
+        with self.lock:
+            self._sweep_locked(force=True)
+            return {'sessions': len(self.sessions),
+                    'bytes': sum(entry[2] for entry in self.sessions.values()),
+                    'evictions': self.evictions}
+
+def total_session_bytes():
+    return sum(entry[2] for store in SessionStore.all_stores for entry in list(store.sessions.values()))
+
+def session_stat(name):
+    return lambda: {(store.kind,): store.stats()[name] for store in SessionStore.all_stores}
+
+metrics.gauge('pdfusion_sessions', "Live sessions", ['kind'], func=session_stat('sessions'))
+metrics.gauge('pdfusion_session_bytes', "Bytes held by live sessions", ['kind'], func=session_stat('bytes'))
+metrics.counter('pdfusion_session_evictions_total', "Sessions evicted for idleness or size", ['kind'],
+                func=session_stat('evictions'))
@@ -0,0 +1,28 @@
+"""The TeleBot instance and the registry of the bot's message handlers"""
+
+import telebot
+
+# Initialize bot with your token
+BOT_TOKEN = '7354040523:AAEv0KorMBV6r09fpQGFpxwK2FVbeokta_Q'
+
+# Set by create_bot() at startup. Other modules look it up as telegram.bot at
+# call time, so the benchmarks can put a stand-in here.
+bot = None
+
+# (handler, filters) pairs in definition order, registered on the bot by create_bot()
+_handlers = []
+
+def message_handler(**filters):
+    """Like bot.message_handler, but only records the handler, so feature modules import without a bot"""
+    def decorator(func):
+        _handlers.append((func, filters))
+        return func
+    return decorator
+
+def create_bot(token=BOT_TOKEN):
+    """Create the bot and register every recorded handler on it, in the order they were defined"""
+    global bot
+    bot = telebot.TeleBot(token)
+    for func, filters in _handlers:
+        bot.register_message_handler(func, **filters)
+    return bot
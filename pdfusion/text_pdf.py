@@ -0,0 +1,230 @@
+"""Text-to-PDF: lay out chat messages, including Persian text, into a PDF"""
+
+import os
+import re
+import tempfile
+import threading
+
+from pdfusion import telegram
+from pdfusion.cancel import CancelToken, JobCancelled, conversions
+from pdfusion.jobs import scheduler
+from pdfusion.lazy import lazy_import
+from pdfusion.log import log_message, safe_execution
+from pdfusion.metrics import span
+from pdfusion.outbound import api_call, reply_to
+from pdfusion.sessions import SessionFull, SessionStore
+from pdfusion.telegram import message_handler
+from pdfusion.workspace import temp_dir, workspace
+
+fpdf = lazy_import('fpdf')
+arabic_reshaper = lazy_import('arabic_reshaper')
+bidi = lazy_import('bidi.algorithm')
+
+# ---------------------------
+# New Code: Text to PDF Creation
+# ---------------------------
+TEXT_SESSION_MAX_BYTES = 5 * 1024 * 1024
+TEXT_CHARS_PER_PAGE = 3000  # rough capacity of one page, used to estimate job cost
+
+TEXT_FONT_FAMILY = 'Vazir'
+TEXT_FONT_PATH = 'Vazir.ttf'  # supports both English and Persian
+TEXT_FONT_SIZE = 14
+ARABIC_SCRIPT = re.compile('[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]')
+FIRST_LETTER = re.compile(r'[^\W\d_]')
+
+_text_font = None
+_text_font_lock = threading.Lock()
+
+def load_text_font():
+    """
+    Parse the TTF metrics once per process. fpdf's add_font re-reads them for
+    every document; new documents get a copy of the parsed entry instead.
+    The glyph subset is still built per document when it is written.
+    """
+    global _text_font
+    with _text_font_lock:
+        if _text_font is None:
+            log_message(f"Loading text font {TEXT_FONT_PATH}")
+            pdf = fpdf.FPDF()
+            pdf.add_font(TEXT_FONT_FAMILY, '', TEXT_FONT_PATH, uni=True)
+            _text_font = (pdf.fonts[TEXT_FONT_FAMILY.lower()], pdf.font_files)
+        return _text_font
+
+class TextPdfBuilder:
+    """
+    Lays out text messages into a PDF as they are added, so finishing a
+    session only has to write the file.
+    Messages with Arabic-script text are reshaped, wrapped in logical order and
+    then reordered line by line, so mixed Persian/English paragraphs wrap
+    correctly. The paragraph direction follows its first letter.
+    """
+
+    def __init__(self):
+        font, font_files = load_text_font()
+        fontkey = TEXT_FONT_FAMILY.lower()
+        self.pdf = fpdf.FPDF()
+        self.pdf.fonts[fontkey] = dict(font, i=len(self.pdf.fonts) + 1, subset=list(range(0, 32)))
+        for name, entry in font_files.items():
+            self.pdf.font_files[name] = dict(entry)
+        self.pdf.add_page()
+        self.pdf.set_font(TEXT_FONT_FAMILY, '', TEXT_FONT_SIZE)
+        self.line_width = self.pdf.w - self.pdf.l_margin - self.pdf.r_margin - 2 * self.pdf.c_margin
+        self.messages = []
+        self.char_count = 0
+
+    def _split_word(self, word):
+        """Break a word wider than a line at the characters where it overflows, as multi_cell does"""
+        pieces, current, width = [], '', 0
+        for char in word:
+            char_width = self.pdf.get_string_width(char)
+            if current and width + char_width > self.line_width:
+                pieces.append(current)
+                current, width = '', 0
+            current += char
+            width += char_width
+        pieces.append(current)
+        return pieces
+
+    def _wrap(self, text):
+        """Break logically ordered text into lines that fit the page width"""
+        lines, current = [], ''
+        for word in text.split(' '):
+            if self.pdf.get_string_width(word) > self.line_width:
+                # An over-long word (a URL, a long number) starts its own line and is cut to fit.
+                *full_lines, word = self._split_word(word)
+                if current:
+                    lines.append(current)
+                lines.extend(full_lines)
+                current = word
+                continue
+            candidate = f"{current} {word}" if current else word
+            if current and self.pdf.get_string_width(candidate) > self.line_width:
+                lines.append(current)
+                current = word
+            else:
+                current = candidate
+        lines.append(current)
+        return lines
+
+    def _add_rtl_paragraph(self, paragraph):
+        first_letter = FIRST_LETTER.search(paragraph)
+        rtl = first_letter is None or bool(ARABIC_SCRIPT.match(first_letter.group()))
+        base_dir, align = ('R', 'R') if rtl else ('L', 'L')
+        for line in self._wrap(arabic_reshaper.reshape(paragraph)):
+            self.pdf.cell(0, 10, bidi.get_display(line, base_dir=base_dir), ln=1, align=align)
+
+    def add_text(self, text):
+        """Append one message to the document"""
+        self.messages.append(text)
+        self.char_count += len(text)
+        if ARABIC_SCRIPT.search(text):
+            for paragraph in text.split('\n'):
+                self._add_rtl_paragraph(paragraph)
+        else:
+            self.pdf.multi_cell(0, 10, text, align='L')
+        self.pdf.ln(5)
+
+    def output(self, pdf_path):
+        self.pdf.output(pdf_path)
+        return pdf_path
+
+def text_session_size(builder):
+    """Bytes held by a text session: the messages plus the laid-out page content"""
+    return (sum(len(text.encode('utf-8')) for text in builder.messages)
+            + sum(len(page) for page in builder.pdf.pages.values()))
+
+def deserialize_text_session(chat_id, messages):
+    builder = TextPdfBuilder()
+    for text in messages:
+        builder.add_text(text)
+    return builder
+
+# Session store keeping track of text-to-PDF sessions.
+# Key: chat_id, Value: TextPdfBuilder that lays out each message as it arrives
+text_pdf_sessions = SessionStore('text', TEXT_SESSION_MAX_BYTES, text_session_size,
+                                 lambda builder: builder.messages, deserialize_text_session)
+
+@message_handler(commands=['start_text_pdf'])
+@safe_execution
+def start_text_pdf(message):
+    chat_id = message.chat.id
+    text_pdf_sessions[chat_id] = TextPdfBuilder()  # start a new text session
+    api_call(chat_id, 'send_message', chat_id, "Text-to-PDF session started.\nPlease send me your text (English or Persian). You may send multiple messages. When finished, type /done_text_pdf.")
+    telegram.bot.register_next_step_handler(message, process_text_for_pdf)
+
+@safe_execution
+def process_text_for_pdf(message):
+    chat_id = message.chat.id
+    if message.text.strip() == '/done_text_pdf':
+        finish_text_pdf(message)
+        return
+    if chat_id not in text_pdf_sessions:
+        api_call(chat_id, 'send_message', chat_id, "No active text session found. Start with /start_text_pdf.")
+        return
+    try:
+        text_pdf_sessions.check_room(chat_id, 2 * len(message.text.encode('utf-8')))
+    except SessionFull:
+        api_call(chat_id, 'send_message', chat_id, "This PDF has reached the maximum size. Type /done_text_pdf to create it.")
+        telegram.bot.register_next_step_handler(message, process_text_for_pdf)
+        return
+    text_pdf_sessions[chat_id].add_text(message.text)
+    text_pdf_sessions.touch(chat_id)
+    api_call(chat_id, 'send_message', chat_id, "Text added. Send more text or type /done_text_pdf to finish.")
+    telegram.bot.register_next_step_handler(message, process_text_for_pdf)
+
+@message_handler(commands=['done_text_pdf'])
+@safe_execution
+def finish_text_pdf(message):
+    chat_id = message.chat.id
+    if chat_id not in text_pdf_sessions or len(text_pdf_sessions[chat_id].messages) == 0:
+        reply_to(message, "No text received for PDF creation. Start with /start_text_pdf.")
+        return
+    api_call(chat_id, 'send_message', chat_id, "Finishing text-to-PDF creation. Please wait...")
+    builder = text_pdf_sessions.pop(chat_id)
+    cost = max(1, builder.char_count // TEXT_CHARS_PER_PAGE)
+    token = conversions.start(chat_id)
+    scheduler.submit(message.from_user.id, chat_id, cost, 'text_pdf', build_text_pdf, chat_id, builder, token=token)
+
+def build_text_pdf(chat_id, builder, token=None):
+    """Write the laid-out text and send it back as a PDF (runs as a scheduled job)"""
+    token = token or CancelToken()
+    try:
+        token.start_stage('render')
+        token.check()
+        with workspace('text') as scratch:
+            with span('encode'):
+                pdf_path = builder.output(os.path.join(scratch, 'text.pdf'))
+            token.check()
+            with open(pdf_path, 'rb') as pdf_file, span('upload'):
+                api_call(chat_id, 'send_document', chat_id, pdf_file, caption="Here is your text PDF file.")
+    except JobCancelled as e:
+        api_call(chat_id, 'send_message', chat_id, str(e))
+        raise
+    finally:
+        conversions.finish(chat_id, token)
+
+@message_handler(commands=['cancel_text_pdf'])
+@safe_execution
+def cancel_text_pdf(message):
+    chat_id = message.chat.id
+    if chat_id in text_pdf_sessions:
+        del text_pdf_sessions[chat_id]
+        reply_to(message, "Text-to-PDF session cancelled.")
+    else:
+        reply_to(message, "No active text-to-PDF session found.")
+
+def create_text_pdf(text_lines, chat_id):
+    """
+    Create a PDF from the given list of text lines.
+    This function uses Vazir.ttf (which supports both English and Persian).
+    Make sure the Vazir.ttf file is in the same directory as the script.
+    """
+    builder = TextPdfBuilder()
+    for line in text_lines:
+        builder.add_text(line)
+    fd, pdf_path = tempfile.mkstemp(prefix=f"text_pdf_{chat_id}_", suffix='.pdf', dir=temp_dir())
+    os.close(fd)
+    return builder.output(pdf_path)
+# ---------------------------
+# End of New Code: Text to PDF Creation
+# ---------------------------
@@ -0,0 +1,129 @@
+"""Webhook server: receive updates over HTTP instead of long polling"""
+
+import os
+import signal
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from queue import Queue, Full
+
+from telebot.types import Update
+
+from pdfusion import telegram
+from pdfusion.log import log_message
+from pdfusion.metrics import metrics
+
+# ---------------------------
+# Webhook server: receive updates over HTTP instead of long polling
+# ---------------------------
+RUN_MODE = os.environ.get('PDFUSION_MODE', 'polling')  # 'polling' or 'webhook'
+WEBHOOK_URL = os.environ.get('PDFUSION_WEBHOOK_URL', '')  # public HTTPS URL Telegram posts to; empty skips set_webhook
+WEBHOOK_HOST = os.environ.get('PDFUSION_WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('PDFUSION_WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.environ.get('PDFUSION_WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('PDFUSION_WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.environ.get('PDFUSION_WEBHOOK_WORKERS', 8))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('PDFUSION_WEBHOOK_QUEUE_SIZE', 1000))
+
+class WebhookServer:
+    """
+    Local HTTP server for Telegram updates. Every POST is acknowledged as soon
+    as its body is queued; a bounded pool of worker threads parses the updates
+    and runs the bot's handlers. A full queue answers 503 so Telegram retries
+    later instead of the server buffering without limit.
+    """
+
+    def __init__(self, host, port, path, secret, workers, queue_size):
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.updates = Queue(maxsize=queue_size)
+        metrics.gauge('pdfusion_webhook_queue_depth', "Updates received and not yet handled", func=self.updates.qsize)
+        self.threads = []
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _make_handler(self):
+        server = self
+
+        class UpdateHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_error(404)
+                    return
+                if server.secret and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != server.secret:
+                    self.send_error(403)
+                    return
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    server.updates.put_nowait(body)
+                except Full:
+                    log_message("Webhook queue is full, asking Telegram to retry", "WARNING")
+                    self.send_error(503)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass  # requests are counted by the bot's own logging
+
+        return UpdateHandler
+
+    def _worker(self):
+        while True:
+            body = self.updates.get()
+            if body is None:
+                return
+            try:
+                update = Update.de_json(body.decode('utf-8'))
+                telegram.bot.process_new_updates([update])
+            except Exception as e:
+                log_message(f"Error handling webhook update: {e}", level="ERROR")
+
+    def serve(self):
+        """Run until shutdown() is called; handlers run on this server's worker pool"""
+        telegram.bot.threaded = False  # the worker pool below replaces telebot's own threads
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"webhook-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        host, port = self.httpd.server_address[:2]
+        log_message(f"Webhook server listening on {host}:{port}{self.path}")
+        self.httpd.serve_forever()
+
+    def shutdown(self, on_stop=None):
+        """
+        Stop accepting updates and let the workers finish the queued ones. The
+        handlers hand their work to the asyncio core and the job scheduler, so
+        on_stop (app.stop_work) then winds those down before the process exits.
+        """
+        log_message("Shutting down webhook server")
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for _ in self.threads:
+            self.updates.put(None)
+        for thread in self.threads:
+            thread.join()
+        if on_stop is not None:
+            on_stop()
+        log_message("Webhook server stopped")
+
+def run_webhook(on_stop=None):
+    """
+    Register the webhook with Telegram (if a public URL is configured) and serve
+    updates until SIGTERM or SIGINT; on_stop runs after the last update is handled.
+    """
+    server = WebhookServer(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+                           WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    if WEBHOOK_URL:
+        telegram.bot.remove_webhook()
+        telegram.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None,
+                        max_connections=WEBHOOK_WORKERS)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever to return, so it cannot run on the serving thread.
+        threading.Thread(target=server.shutdown, args=(on_stop,), name="webhook-shutdown").start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    server.serve()
@@ -0,0 +1,53 @@
+"""Per-request scratch directories under temp/"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+
+from pdfusion.log import log_message
+
+# ---------------------------
+# Scratch workspaces: a private temp directory per request
+# ---------------------------
+TEMP_DIR = 'temp'
+
+# Workspaces not yet removed, so shutdown can clean up after requests it interrupted
+_live_workspaces = set()
+_live_lock = threading.Lock()
+
+def temp_dir():
+    """The directory for temporary files, created on first use"""
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    return TEMP_DIR
+
+def new_workspace(prefix):
+    """Create a collision-free scratch directory under temp/; delete it with remove_workspace"""
+    path = tempfile.mkdtemp(prefix=f"{prefix}_", dir=temp_dir())
+    with _live_lock:
+        _live_workspaces.add(path)
+    return path
+
+def remove_workspace(path):
+    shutil.rmtree(path, ignore_errors=True)
+    with _live_lock:
+        _live_workspaces.discard(path)
+    log_message(f"Removed workspace {path}", "DEBUG")
+
+def remove_all_workspaces():
+    """Remove every workspace still on disk (at shutdown); returns how many there were"""
+    with _live_lock:
+        paths = list(_live_workspaces)
+    for path in paths:
+        remove_workspace(path)
+    return len(paths)
+
+@contextlib.contextmanager
+def workspace(prefix):
+    """Scratch directory that is removed with everything in it when the block exits"""
+    path = new_workspace(prefix)
+    try:
+        yield path
+    finally:
+        remove_workspace(path)
@@ -0,0 +1,44 @@
+"""
+POST recorded Telegram updates to a locally running webhook server.
+
+The input is a JSON file holding one update object or a list of them, e.g. as
+returned in the "result" field of getUpdates.
+
+Usage:
+    PDFUSION_MODE=webhook PDFUSION_WEBHOOK_PORT=8443 python -m pdfusion
+    python scripts/post_updates.py updates.json --url http://127.0.0.1:8443/telegram
+"""
+
+import argparse
+import json
+import time
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('updates', help="JSON file with one update or a list of updates")
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default='', help="value of PDFUSION_WEBHOOK_SECRET, if set")
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait between updates")
+    args = parser.parse_args()
+
+    with open(args.updates, 'r', encoding='utf-8') as f:
+        updates = json.load(f)
+    if isinstance(updates, dict):
+        updates = updates.get('result', [updates]) if 'update_id' not in updates else [updates]
+
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret} if args.secret else {}
+    with requests.Session() as session:
+        for update in updates:
+            start = time.perf_counter()
+            response = session.post(args.url, json=update, headers=headers, timeout=10)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"update {update.get('update_id')}: HTTP {response.status_code} in {elapsed:.1f}ms")
+            if args.delay:
+                time.sleep(args.delay)
+
+
+if __name__ == '__main__':
+    main()
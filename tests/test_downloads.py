@@ -0,0 +1,219 @@
+"""The asyncio HTTP client and URL downloads, against a local http.server"""
+
+import os
+import re
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from pdfusion import downloads
+
+BODY = bytes(range(256)) * 400  # 100KB
+CHANGED_BODY = bytes(reversed(range(256))) * 400
+
+class PdfHandler(BaseHTTPRequestHandler):
+    """
+    Serves the server's body at /file.pdf, with its etag, and a redirect to it
+    at /redirect. Range requests are honoured, and so is If-Range. The server's
+    behaviour dict switches on the faults under test; every request is recorded
+    in its requests list as (method, path, Range header, If-Range header).
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head):
+        server, behaviour = self.server, self.server.behaviour
+        server.requests.append((self.command, self.path, self.headers.get('Range'), self.headers.get('If-Range')))
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/file.pdf')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if_range = self.headers.get('If-Range')
+        if match and not behaviour.get('ignore_range') and (if_range is None or if_range == server.etag):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(server.body) - 1
+            body = server.body[start:end + 1]
+            if behaviour.get('wrong_content_range'):
+                start = 0  # claims a different range than the one sent
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(server.body)}')
+        else:
+            self.send_response(200)
+            body = server.body
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Accept-Ranges', 'bytes')
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        if behaviour.get('chunked'):
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            if not head:
+                for i in range(0, len(body), 7000):
+                    chunk = body[i:i + 7000]
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if head:
+            return
+        if behaviour.get('truncate') and not match:
+            # Cut the first full response short; the client has to resume.
+            behaviour['truncate'] = False
+            self.wfile.write(body[:len(body) // 3])
+            self.close_connection = True
+            if behaviour.get('change_after_truncate'):
+                server.body, server.etag = CHANGED_BODY, '"v2"'
+            return
+        self.wfile.write(body)
+
+class DownloadTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), PdfHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.behaviour = {}
+        self.server.requests = []
+        self.server.body, self.server.etag = BODY, '"v1"'
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.destination = os.path.join(scratch.name, 'document.pdf')
+
+    async def asyncTearDown(self):
+        # Pooled connections belong to this test's event loop.
+        for idle in downloads._idle_connections.values():
+            for reader, writer in idle:
+                writer.close()
+        downloads._idle_connections.clear()
+
+    async def download(self, path='/file.pdf'):
+        progress = [p async for p in downloads.download_file_in_chunks(self.base_url + path, self.destination)]
+        with open(self.destination, 'rb') as f:
+            return f.read(), progress
+
+    def gets(self):
+        """(Range, If-Range) of every GET for the file"""
+        return [(byte_range, if_range) for method, path, byte_range, if_range in self.server.requests
+                if method == 'GET' and path == '/file.pdf']
+
+    async def test_chunked_body(self):
+        self.server.behaviour['chunked'] = True
+        async with downloads.http_request('GET', self.base_url + '/file.pdf') as response:
+            self.assertTrue(response.chunked)
+            self.assertEqual(await response.read(), BODY)
+        data, progress = await self.download()
+        self.assertEqual(data, BODY)
+        self.assertEqual(progress[-1][0], len(BODY))
+
+    async def test_redirect(self):
+        async with downloads.http_request('GET', self.base_url + '/redirect') as response:
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.url, self.base_url + '/file.pdf')
+            self.assertEqual(await response.read(), BODY)
+        data, _ = await self.download('/redirect')
+        self.assertEqual(data, BODY)
+
+    async def test_pooled_connection_is_reused(self):
+        for _ in range(2):
+            async with downloads.http_request('GET', self.base_url + '/file.pdf') as response:
+                await response.read()
+        self.assertEqual(sum(len(idle) for idle in downloads._idle_connections.values()), 1)
+
+    async def test_resume_after_truncated_body(self):
+        self.server.behaviour['truncate'] = True
+        data, _ = await self.download()
+        self.assertEqual(data, BODY)
+        self.assertEqual(self.gets(), [(None, None), (f'bytes={len(BODY) // 3}-', '"v1"')])
+
+    async def test_resume_after_redirect(self):
+        self.server.behaviour['truncate'] = True
+        data, _ = await self.download('/redirect')
+        self.assertEqual(data, BODY)
+        self.assertEqual(self.gets()[-1], (f'bytes={len(BODY) // 3}-', '"v1"'))
+
+    async def test_file_changed_before_resume(self):
+        self.server.behaviour.update(truncate=True, change_after_truncate=True)
+        data, _ = await self.download()
+        self.assertEqual(data, CHANGED_BODY)
+
+    async def test_no_validator_starts_over(self):
+        self.server.etag = None
+        self.server.behaviour['truncate'] = True
+        data, _ = await self.download()
+        self.assertEqual(data, BODY)
+        self.assertEqual(self.gets(), [(None, None), (None, None)])
+
+    async def test_mismatched_content_range_starts_over(self):
+        self.server.behaviour.update(truncate=True, wrong_content_range=True)
+        data, _ = await self.download()
+        self.assertEqual(data, BODY)
+        self.assertEqual(self.gets()[-1], (None, None))
+
+    async def test_restart_when_range_is_ignored(self):
+        self.server.behaviour.update(truncate=True, ignore_range=True)
+        data, _ = await self.download()
+        self.assertEqual(data, BODY)
+        self.assertEqual(len(self.gets()), 2)
+
+    async def test_ranged_download(self):
+        with mock.patch.object(downloads, 'DOWNLOAD_SEGMENT_SIZE', 16 * 1024), \
+                mock.patch.object(downloads, 'RANGED_DOWNLOAD_MIN_SIZE', 32 * 1024):
+            data, _ = await self.download()
+        self.assertEqual(data, BODY)
+        self.assertEqual(len(self.gets()), 7)
+        self.assertTrue(all(byte_range and if_range == '"v1"' for byte_range, if_range in self.gets()))
+
+    async def test_ranged_download_rejects_mismatched_content_range(self):
+        self.server.behaviour['wrong_content_range'] = True
+        with mock.patch.object(downloads, 'DOWNLOAD_SEGMENT_SIZE', 16 * 1024), \
+                mock.patch.object(downloads, 'RANGED_DOWNLOAD_MIN_SIZE', 32 * 1024), \
+                mock.patch.object(downloads, 'DOWNLOAD_RETRIES', 0):
+            with self.assertRaises(IOError):
+                await self.download()
+
+    async def test_ranged_download_falls_back_when_range_is_ignored(self):
+        self.server.behaviour['ignore_range'] = True
+        with mock.patch.object(downloads, 'DOWNLOAD_SEGMENT_SIZE', 16 * 1024), \
+                mock.patch.object(downloads, 'RANGED_DOWNLOAD_MIN_SIZE', 32 * 1024):
+            data, _ = await self.download()
+        self.assertEqual(data, BODY)
+        self.assertEqual(self.gets()[-1], (None, None))
+
+    async def test_oversized_content_length_is_refused(self):
+        with mock.patch.object(downloads, 'MAX_DOWNLOAD_SIZE', len(BODY) - 1):
+            with self.assertRaisesRegex(downloads.HttpError, 'download limit'):
+                await self.download()
+        self.assertEqual(self.gets(), [])
+
+    async def test_oversized_chunked_body_is_refused(self):
+        self.server.behaviour['chunked'] = True
+        with mock.patch.object(downloads, 'MAX_DOWNLOAD_SIZE', len(BODY) // 2):
+            with self.assertRaisesRegex(downloads.HttpError, 'download limit'):
+                await self.download()
+
+if __name__ == '__main__':
+    unittest.main()
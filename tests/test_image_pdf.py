@@ -0,0 +1,54 @@
+"""Image-to-PDF: write_jpeg_pdf embeds JPEGs as they are and converts other images once"""
+
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+from PyPDF2 import PdfReader
+
+from pdfusion.image_pdf import write_jpeg_pdf
+
+class WriteJpegPdfTest(unittest.TestCase):
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.scratch = scratch.name
+        self.pdf_path = os.path.join(self.scratch, 'created.pdf')
+
+    def image(self, name, mode, size, color, **save_options):
+        path = os.path.join(self.scratch, name)
+        Image.new(mode, size, color).save(path, **save_options)
+        return path
+
+    def page_image(self, page):
+        image = page['/Resources']['/XObject']['/Im0'].get_object()
+        return image, image.get_data()
+
+    def test_round_trip(self):
+        paths = [self.image('rgb.jpg', 'RGB', (200, 100), 'red'),
+                 self.image('gray.jpg', 'L', (50, 80), 128),
+                 self.image('cmyk.jpg', 'CMYK', (30, 40), (0, 255, 0, 0))]
+        write_jpeg_pdf(self.pdf_path, paths, resolution=100.0)
+        reader = PdfReader(self.pdf_path)
+        self.assertEqual(len(reader.pages), 3)
+        expected = [((144.0, 72.0), '/DeviceRGB'), ((36.0, 57.6), '/DeviceGray'), ((21.6, 28.8), '/DeviceCMYK')]
+        for page, path, (size, color_space) in zip(reader.pages, paths, expected):
+            self.assertEqual((float(page.mediabox.width), float(page.mediabox.height)), size)
+            image, data = self.page_image(page)
+            self.assertEqual(image['/Filter'], '/DCTDecode')
+            self.assertEqual(image['/ColorSpace'], color_space)
+            with open(path, 'rb') as f:
+                self.assertEqual(data, f.read())  # passed through, not re-encoded
+
+    def test_other_formats_become_jpeg(self):
+        path = self.image('transparent.png', 'RGBA', (64, 48), (0, 0, 255, 128))
+        write_jpeg_pdf(self.pdf_path, [path])
+        page = PdfReader(self.pdf_path).pages[0]
+        image, data = self.page_image(page)
+        self.assertEqual((image['/Width'], image['/Height'], image['/ColorSpace']), (64, 48, '/DeviceRGB'))
+        self.assertEqual(data[:2], b'\xff\xd8')
+
+if __name__ == '__main__':
+    unittest.main()
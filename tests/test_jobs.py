@@ -0,0 +1,93 @@
+"""The job scheduler: weighted fair ordering and cancelling queued jobs"""
+
+import threading
+import time
+import types
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from pdfusion import jobs
+from pdfusion.cancel import CancelToken
+
+class FakeOutbound:
+    """Answers the scheduler's queue messages at once"""
+
+    def call(self, chat_id, method, *args, **kwargs):
+        future = Future()
+        future.set_result(types.SimpleNamespace(message_id=chat_id))
+        return future
+
+class JobSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.edits = []
+        for patch in (mock.patch.object(jobs, 'outbound', FakeOutbound()),
+                      mock.patch.object(jobs, 'edit_status', lambda text, chat_id, message_id: self.edits.append(
+                          (chat_id, text)))):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.scheduler = jobs.JobScheduler(max_concurrent=1, max_per_user=1)
+        self.order = []
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def block_worker(self):
+        """Occupy the only worker until self.release is set"""
+        started = threading.Event()
+
+        def blocker():
+            started.set()
+            self.release.wait(10)
+
+        self.scheduler.submit(0, 0, 1, 'blocker', blocker)
+        self.assertTrue(started.wait(5))
+
+    def record(self, name, token=None):
+        self.order.append(name)
+        if token is not None:
+            token.check()
+
+    def test_weighted_fair_order(self):
+        self.block_worker()
+        for i in range(3):
+            self.scheduler.submit(1, 1, 10, 'large', self.record, f'large{i}')
+        self.scheduler.submit(2, 2, 1, 'small', self.record, 'small')
+        self.release.set()
+        self.assertTrue(self.scheduler.wait_idle(5))
+        self.assertEqual(self.order, ['small', 'large0', 'large1', 'large2'])
+
+    def test_users_take_turns(self):
+        self.block_worker()
+        self.scheduler.submit(1, 1, 5, 'first', self.record, 'user1-first')
+        self.scheduler.submit(1, 1, 5, 'second', self.record, 'user1-second')
+        self.scheduler.submit(2, 2, 5, 'other', self.record, 'user2')
+        self.release.set()
+        self.assertTrue(self.scheduler.wait_idle(5))
+        self.assertEqual(self.order, ['user1-first', 'user2', 'user1-second'])
+
+    def test_cancel_while_queued(self):
+        self.block_worker()
+        token = CancelToken()
+        self.scheduler.submit(1, 1, 1, 'queued', self.record, 'queued', token=token)
+        self.assertEqual(len(self.scheduler.waiting), 1)
+        token.cancel("Conversion cancelled.")
+        # The job leaves the queue and cleans up while the only worker is still busy.
+        deadline = time.monotonic() + 5
+        while self.order != ['queued'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.order, ['queued'])
+        self.assertEqual(self.scheduler.waiting, [])
+        self.assertFalse(self.release.is_set())
+        self.assertIn((1, "Conversion cancelled."), self.edits)
+        self.release.set()
+        self.assertTrue(self.scheduler.wait_idle(5))
+
+    def test_finish_tags_are_forgotten_when_idle(self):
+        for user_id in range(5):
+            self.scheduler.submit(user_id, user_id, 3, 'job', self.record, user_id)
+        self.assertTrue(self.scheduler.wait_idle(5))
+        self.assertEqual(self.scheduler.user_finish, {})
+
+if __name__ == '__main__':
+    unittest.main()
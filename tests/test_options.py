@@ -0,0 +1,63 @@
+"""Request options: parsing link and caption options, and selecting pages"""
+
+import unittest
+
+from pdfusion.options import (DEFAULT_RENDER_OPTIONS, MAX_SHEET_PAGES, SHEET_PAGES, parse_caption_options,
+                              parse_render_options, select_pages)
+
+class ParseRenderOptionsTest(unittest.TestCase):
+
+    def test_ranges_and_modes(self):
+        options = parse_render_options(['1-3,7', '10-25', 'THUMBS', 'sheet=9'])
+        self.assertEqual(options, {'pages': [[1, 3], [7, 7], [10, 25]], 'thumbnails': True, 'sheet': 9})
+
+    def test_pages_marker(self):
+        self.assertEqual(parse_render_options(['pages=2-4'])['pages'], [[2, 4]])
+
+    def test_sheet_without_size(self):
+        self.assertEqual(parse_render_options(['sheet'])['sheet'], SHEET_PAGES)
+
+    def test_no_options(self):
+        self.assertEqual(parse_render_options([]), DEFAULT_RENDER_OPTIONS)
+
+    def test_errors(self):
+        for words in (['0-3'], ['5-2'], ['sheet=1'], [f'sheet={MAX_SHEET_PAGES + 1}'], ['sheet=x'], ['pages=thumbs'],
+                      ['colour']):
+            with self.assertRaises(ValueError, msg=words):
+                parse_render_options(words)
+
+    def test_bare_ranges_can_be_refused(self):
+        with self.assertRaises(ValueError):
+            parse_render_options(['10-25'], bare_ranges=False)
+        self.assertEqual(parse_render_options(['pages=10-25'], bare_ranges=False)['pages'], [[10, 25]])
+
+class ParseCaptionOptionsTest(unittest.TestCase):
+
+    def test_ordinary_captions_are_ignored(self):
+        for caption in (None, '', 'Q3 report', '2024', 'sheet 2024', 'thumbs please'):
+            self.assertEqual(parse_caption_options(caption), DEFAULT_RENDER_OPTIONS, caption)
+
+    def test_options_caption(self):
+        self.assertEqual(parse_caption_options('pages=10-25 thumbs'),
+                         {'pages': [[10, 25]], 'thumbnails': True, 'sheet': 0})
+
+    def test_opts_prefix_takes_bare_ranges_and_reports_errors(self):
+        self.assertEqual(parse_caption_options('/opts 10-25')['pages'], [[10, 25]])
+        with self.assertRaises(ValueError):
+            parse_caption_options('/opts Q3 report')
+
+class SelectPagesTest(unittest.TestCase):
+
+    def test_every_page_by_default(self):
+        self.assertEqual(select_pages(DEFAULT_RENDER_OPTIONS, 4), [0, 1, 2, 3])
+
+    def test_ranges_are_sorted_merged_and_clipped(self):
+        options = parse_render_options(['7-9,2', '1-3', '5-100'])
+        self.assertEqual(select_pages(options, 8), [0, 1, 2, 4, 5, 6, 7])
+
+    def test_no_page_in_the_document(self):
+        with self.assertRaisesRegex(ValueError, '10-page document'):
+            select_pages(parse_render_options(['11-20']), 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""The outbound dispatcher: coalescing status edits and retrying after 429"""
+
+import io
+import threading
+import time
+import unittest
+from unittest import mock
+
+from telebot.apihelper import ApiTelegramException
+
+from pdfusion import outbound, telegram
+
+class FakeBot:
+    """Records calls; send_message blocks until release is set, and the first photo to each rate_limited chat gets a 429"""
+
+    def __init__(self, rate_limited=(), retry_after=1):
+        self.calls = []
+        self.release = threading.Event()
+        self.rate_limited = set(rate_limited)
+        self.retry_after = retry_after
+
+    def send_message(self, chat_id, text):
+        self.release.wait(10)
+        return self.record('send_message', text)
+
+    def edit_message_text(self, text, chat_id, message_id):
+        return self.record('edit_message_text', text)
+
+    def send_photo(self, chat_id, photo):
+        if chat_id in self.rate_limited:
+            self.rate_limited.discard(chat_id)
+            self.calls.append((time.monotonic(), 'send_photo', 429))
+            raise ApiTelegramException('sendPhoto', None, {
+                'error_code': 429, 'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}})
+        return self.record('send_photo', photo.read())
+
+    def record(self, method, value):
+        self.calls.append((time.monotonic(), method, value))
+        return value
+
+class OutboundDispatcherTest(unittest.TestCase):
+
+    def dispatcher(self, bot):
+        patch = mock.patch.object(telegram, 'bot', bot)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(bot.release.set)
+        return outbound.OutboundDispatcher(workers=2, global_rate=100, chat_rate=100, chat_burst=100)
+
+    def test_status_edits_of_a_message_are_coalesced(self):
+        bot = FakeBot()
+        dispatcher = self.dispatcher(bot)
+        dispatcher.call(1, 'send_message', 1, "busy")  # holds the chat, so the edits queue up
+        futures = [dispatcher.edit_text(f"{percent}%", 1, 7) for percent in (10, 20, 30)]
+        other = dispatcher.edit_text("other message", 1, 8)
+        self.assertIs(futures[0], futures[2])
+        bot.release.set()
+        self.assertEqual(futures[0].result(5), "30%")
+        self.assertEqual(other.result(5), "other message")
+        self.assertEqual([value for _, method, value in bot.calls if method == 'edit_message_text'],
+                         ["30%", "other message"])
+
+    def test_rate_limited_call_waits_retry_after_and_is_retried(self):
+        bot = FakeBot(rate_limited=[1], retry_after=1)
+        dispatcher = self.dispatcher(bot)
+        result = dispatcher.call(1, 'send_photo', 1, io.BytesIO(b'page')).result(5)
+        self.assertEqual(result, b'page')  # the upload was rewound for the retry
+        (failed_at, _, status), (sent_at, _, _) = bot.calls
+        self.assertEqual(status, 429)
+        self.assertGreaterEqual(sent_at - failed_at, 0.9)
+
+    def test_other_chats_are_not_held_up_by_retry_after(self):
+        bot = FakeBot(rate_limited=[1], retry_after=2)
+        dispatcher = self.dispatcher(bot)
+        limited = dispatcher.call(1, 'send_photo', 1, io.BytesIO(b'one'))
+        start = time.monotonic()
+        self.assertEqual(dispatcher.call(2, 'send_photo', 2, io.BytesIO(b'two')).result(5), b'two')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(limited.result(5), b'one')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Pre-flight page lookup and image-page extraction on hand-built page trees"""
+
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from pdfusion import preflight
+
+def jpeg(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (60, 80), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def image_xobject(data):
+    return (b'<< /Type /XObject /Subtype /Image /Width 60 /Height 80 /ColorSpace /DeviceRGB '
+            b'/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n%s\nendstream' % (len(data), data))
+
+def content_stream(width=300, height=400):
+    data = b'q %d 0 0 %d 0 0 cm /Im0 Do Q' % (width, height)
+    return b'<< /Length %d >>\nstream\n%s\nendstream' % (len(data), data)
+
+def write_pdf(path, objects):
+    """Write numbered objects (1 is the catalog) with a valid xref table"""
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    with open(path, 'wb') as f:
+        f.write(out.getvalue())
+
+COLORS = ['red', 'green', 'blue', 'yellow']
+
+def nested_tree_objects():
+    """
+    Four image pages under an empty /Pages node (which carries a /Rotate that
+    must not leak into its siblings), a two-page branch, a page directly under
+    the root and a page two levels down that inherits its /Resources.
+    """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R 4 0 R 7 0 R 8 0 R] /Count 4 /MediaBox [0 0 300 400] >>',
+        b'<< /Type /Pages /Parent 2 0 R /Kids [] /Count 0 /Rotate 90 >>',
+        b'<< /Type /Pages /Parent 2 0 R /Kids [5 0 R 6 0 R] /Count 2 >>',
+        b'<< /Type /Page /Parent 4 0 R /Resources << /XObject << /Im0 11 0 R >> >> /Contents 10 0 R >>',
+        b'<< /Type /Page /Parent 4 0 R /Resources << /XObject << /Im0 12 0 R >> >> /Contents 10 0 R >>',
+        b'<< /Type /Page /Parent 2 0 R /Resources << /XObject << /Im0 13 0 R >> >> /Contents 10 0 R >>',
+        b'<< /Type /Pages /Parent 2 0 R /Kids [9 0 R] /Count 1 >>',
+        b'<< /Type /Pages /Parent 8 0 R /Kids [15 0 R] /Count 1 /Resources << /XObject << /Im0 14 0 R >> >> >>',
+        content_stream(),
+    ]
+    objects += [image_xobject(jpeg(color)) for color in COLORS]
+    objects.append(b'<< /Type /Page /Parent 9 0 R /Contents 10 0 R >>')
+    return objects
+
+class FindPageTest(unittest.TestCase):
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.path = os.path.join(scratch.name, 'nested.pdf')
+        write_pdf(self.path, nested_tree_objects())
+        preflight._page_trees.clear()
+
+    def test_page_jpeg_follows_counts_past_empty_nodes(self):
+        with preflight.open_reader(self.path) as reader:
+            for page_number, color in enumerate(COLORS, start=1):
+                data, size = preflight.page_jpeg(reader, page_number)
+                self.assertEqual(data, jpeg(color), page_number)
+                self.assertEqual(size, (300.0, 400.0))
+
+    def test_inherited_attributes_stay_in_their_branch(self):
+        with preflight.open_reader(self.path) as reader:
+            for page_number in range(1, 5):
+                self.assertEqual(preflight._page_layout(preflight.find_page(reader, page_number)),
+                                 (300.0, 400.0, 0))
+
+    def test_pages_outside_the_tree(self):
+        with preflight.open_reader(self.path) as reader:
+            for page_number in (0, 5):
+                with self.assertRaises(IndexError):
+                    preflight.find_page(reader, page_number)
+
+    def test_tree_is_walked_once_per_document(self):
+        with preflight.open_reader(self.path) as reader:
+            preflight.find_page(reader, 1)
+        self.assertEqual(len(preflight._page_trees), 1)
+        with preflight.open_reader(self.path) as reader:
+            preflight.find_page(reader, 4)
+        self.assertEqual(len(preflight._page_trees), 1)
+
+    def test_matches_pypdf2_on_a_flat_tree(self):
+        objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+                   b'<< /Type /Pages /Kids [%s] /Count 5 /MediaBox [0 0 100 200] >>'
+                   % b' '.join(b'%d 0 R' % number for number in range(3, 8))]
+        objects += [b'<< /Type /Page /Parent 2 0 R >>'] * 5
+        write_pdf(self.path, objects)
+        with preflight.open_reader(self.path) as reader:
+            for page_number in range(1, 6):
+                self.assertEqual(preflight.find_page(reader, page_number).indirect_reference,
+                                 reader.pages[page_number - 1].indirect_reference)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Session stores: idle TTL, per-session size limits and LRU eviction under the total cap"""
+
+import time
+import unittest
+from unittest import mock
+
+from pdfusion import sessions
+from pdfusion.sessions import SessionFull, SessionStore
+
+class SessionStoreTest(unittest.TestCase):
+
+    def store(self, ttl=60, max_session_bytes=100):
+        self.evicted = []
+        store = SessionStore('test', max_session_bytes, len, list, lambda chat_id, data: data,
+                             on_evict=self.evicted.append, ttl=ttl)
+        self.addCleanup(SessionStore.all_stores.remove, store)
+        return store
+
+    def test_idle_sessions_expire(self):
+        store = self.store(ttl=0.05)
+        store[1] = ['a']
+        self.assertEqual(store[1], ['a'])
+        time.sleep(0.1)
+        self.assertNotIn(1, store)
+        self.assertEqual(self.evicted, [['a']])
+        self.assertEqual(store.stats()['evictions'], 1)
+
+    def test_touch_keeps_a_session_alive(self):
+        store = self.store(ttl=0.2)
+        store[1] = []
+        for _ in range(3):
+            time.sleep(0.1)
+            store[1].append('x')
+            store.touch(1)
+        self.assertEqual(store[1], ['x', 'x', 'x'])
+
+    def test_least_recently_used_sessions_go_first(self):
+        store = self.store()
+        with mock.patch.object(sessions, 'SESSION_MAX_TOTAL_BYTES', 5):
+            store[1] = ['a', 'b']
+            store[2] = ['c', 'd']
+            store.touch(1)  # 2 is now the least recently used
+            store[3] = ['e', 'f']
+        self.assertEqual(self.evicted, [['c', 'd']])
+        self.assertIn(1, store)
+        self.assertNotIn(2, store)
+        self.assertIn(3, store)
+
+    def test_session_size_limit(self):
+        store = self.store(max_session_bytes=3)
+        store[1] = ['a', 'b']
+        store.check_room(1, 1)
+        with self.assertRaises(SessionFull):
+            store.check_room(1, 2)
+
+    def test_popped_sessions_are_not_evicted(self):
+        store = self.store()
+        store[1] = ['a']
+        self.assertEqual(store.pop(1), ['a'])
+        self.assertIsNone(store.pop(1, None))
+        self.assertEqual(self.evicted, [])
+
+if __name__ == '__main__':
+    unittest.main()